@@ -13,6 +13,9 @@ from mcomix import process
 from mcomix import callback
 from mcomix import archive
 
+# Read size when streaming members from external executables.
+_CHUNK_SIZE = 1024 * 1024
+
 class BaseArchive(object):
     """ Base archive interface. All filenames passed from and into archives
     are expected to be Unicode objects. Archive files are converted to
@@ -21,6 +24,12 @@ class BaseArchive(object):
     """ True if concurrent calls to extract is supported. """
     support_concurrent_extractions = False
 
+    """ True if members can be read into memory with read(). """
+    support_memory_extraction = False
+
+    """ True if iter_read() extracts several members at once. """
+    support_batch_extraction = False
+
     def __init__(self, archive):
         assert isinstance(archive, str), "File should be an Unicode string."
 
@@ -55,6 +64,21 @@ class BaseArchive(object):
         assert isinstance(filename, str) and \
             isinstance(destination_dir, str)
 
+    def read(self, filename, max_size=None):
+        """ Returns the contents of the file specified by <filename> as
+        bytes, without writing it to disk. Returns None if the file is
+        larger than <max_size> bytes. Only available if
+        support_memory_extraction is True. """
+
+        raise NotImplementedError("Archive does not support memory extraction.")
+
+    def iter_read(self, entries):
+        """ Generator reading <entries> from the archive, yielding
+        (filename, contents) tuples. Archives with support_batch_extraction
+        read all entries in one go, not necessarily in the given order. """
+        for filename in entries:
+            yield filename, self.read(filename)
+
     def iter_extract(self, entries, destination_dir):
         """ Generator to extract <entries> from archive to <destination_dir>. """
         wanted = set(entries)
@@ -67,6 +91,11 @@ class BaseArchive(object):
             if 0 == len(wanted):
                 break
 
+    @classmethod
+    def get_handler_name(cls):
+        """ Returns a name identifying the class handling the archive. """
+        return '%s.%s' % (cls.__module__, cls.__name__)
+
     def close(self):
         """ Closes the archive and releases held resources. """
 
@@ -77,6 +106,19 @@ class BaseArchive(object):
         in one pass. """
         return False
 
+    def get_listing_state(self):
+        """ Returns what was learned while listing the archive and is needed
+        to extract its members, as an object that can be stored in a table
+        of contents (see archive_toc), or None if it cannot be stored. """
+        return None
+
+    def set_listing_state(self, state, files):
+        """ Restores <state>, as returned by get_listing_state() for the
+        same archive, whose listed members were <files>, so that the archive
+        does not have to be listed again before extracting members. Returns
+        False if the archive must be listed anyway. """
+        return False
+
     def _replace_invalid_filesystem_chars(self, filename):
         """ Replaces characters in <filename> that cannot be saved to the disk
         with underscore and returns the cleaned-up name. """
@@ -166,6 +208,28 @@ class NonUnicodeArchive(BaseArchive):
         else:
             return i18n.to_utf8(filename)
 
+    def get_listing_state(self):
+        # Original names that are bytes are stored as text, undecodable
+        # bytes being mapped to lone surrogates.
+        names = []
+        for name, original in self.unicode_mapping.items():
+            if isinstance(original, bytes):
+                names.append((name, original.decode('utf-8', 'surrogateescape'), True))
+            else:
+                names.append((name, original, False))
+        return {'names': names}
+
+    def set_listing_state(self, state, files):
+        if 'names' not in state:
+            return False
+        mapping = {}
+        for name, original, is_bytes in state['names']:
+            if is_bytes:
+                original = original.encode('utf-8', 'surrogateescape')
+            mapping[name] = original
+        self.unicode_mapping = mapping
+        return True
+
 class ExternalExecutableArchive(NonUnicodeArchive):
     """ For archives that are extracted by spawning an external
     application. """
@@ -173,6 +237,8 @@ class ExternalExecutableArchive(NonUnicodeArchive):
     # Since we're using an external program for extraction,
     # concurrent calls are supported.
     support_concurrent_extractions = True
+    # Extracted files are written to STDOUT, which can be read directly.
+    support_memory_extraction = True
 
     def __init__(self, archive):
         super(ExternalExecutableArchive, self).__init__(archive)
@@ -181,6 +247,28 @@ class ExternalExecutableArchive(NonUnicodeArchive):
         # for extracting filenames that have been internally mapped.
         self.filenames_initialized = False
 
+    #: Attributes set while listing the archive, besides the Unicode
+    #: mapping, see get_listing_state().
+    _listing_attributes = ()
+
+    def get_listing_state(self):
+        if not self.filenames_initialized:
+            return None
+        state = super(ExternalExecutableArchive, self).get_listing_state()
+        for attribute in self._listing_attributes:
+            state[attribute] = getattr(self, attribute)
+        return state
+
+    def set_listing_state(self, state, files):
+        if not all(attribute in state for attribute in self._listing_attributes):
+            return False
+        if not super(ExternalExecutableArchive, self).set_listing_state(state, files):
+            return False
+        for attribute in self._listing_attributes:
+            setattr(self, attribute, state[attribute])
+        self.filenames_initialized = True
+        return True
+
     def _get_executable(self):
         """ Returns the executable's name or path. Return None if no executable
         was found on the system. """
@@ -241,4 +329,44 @@ class ExternalExecutableArchive(NonUnicodeArchive):
         finally:
             output.close()
 
+    def read(self, filename, max_size=None):
+        """ Read <filename> from the archive, aborting the extraction
+        once more than <max_size> bytes have been received. """
+        assert isinstance(filename, str)
+
+        if not self._get_executable():
+            return None
+
+        if not self.filenames_initialized:
+            self.list_contents()
+
+        return self._read_output([self._get_executable()] +
+                                 self._get_extract_arguments() +
+                                 [self.archive, self._original_filename(filename)],
+                                 max_size)
+
+    def _read_output(self, cmd, max_size=None):
+        """ Runs <cmd> and returns its output, or None if it is larger
+        than <max_size> bytes. """
+        proc = process.popen(cmd)
+        try:
+            if max_size is None:
+                return proc.stdout.read()
+            # Reading max_size + 1 bytes at once would allocate that much
+            # for every member, however small.
+            chunks = []
+            size = 0
+            while True:
+                chunk = proc.stdout.read(_CHUNK_SIZE)
+                if not chunk:
+                    return b''.join(chunks)
+                size += len(chunk)
+                if size > max_size:
+                    proc.kill()
+                    return None
+                chunks.append(chunk)
+        finally:
+            proc.stdout.close()
+            proc.wait()
+
 # vim: expandtab:sw=4:ts=4
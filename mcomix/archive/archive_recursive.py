@@ -6,7 +6,9 @@ from mcomix.archive import archive_base
 from mcomix import archive_tools
 from mcomix import log
 
+import itertools
 import os
+import threading
 
 class RecursiveArchive(archive_base.BaseArchive):
 
@@ -21,8 +23,11 @@ class RecursiveArchive(archive_base.BaseArchive):
         self._archive_root = {}
         self._contents_listed = False
         self._contents = []
-        # Assume concurrent extractions are not supported.
+        self._list_lock = threading.Lock()
+        # Assume concurrent and memory extractions are not supported.
         self.support_concurrent_extractions = False
+        self.support_memory_extraction = False
+        self.support_batch_extraction = False
 
     def _iter_contents(self, archive, root=None):
         self._archive_list.append(archive)
@@ -74,6 +79,14 @@ class RecursiveArchive(archive_base.BaseArchive):
                 break
         self.support_concurrent_extractions = supported
 
+    def _check_memory_extraction_support(self):
+        # Sub-archives are always extracted to disk, but their members can
+        # be read into memory if every archive supports it.
+        self.support_memory_extraction = all(archive.support_memory_extraction
+                                             for archive in self._archive_list)
+        self.support_batch_extraction = all(archive.support_batch_extraction
+                                            for archive in self._archive_list)
+
     def iter_contents(self):
         if self._contents_listed:
             for f in self._contents:
@@ -86,15 +99,49 @@ class RecursiveArchive(archive_base.BaseArchive):
         self._contents_listed = True
         # We can now check if concurrent extractions are really supported.
         self._check_concurrent_extraction_support()
+        self._check_memory_extraction_support()
 
     def list_contents(self):
         if self._contents_listed:
             return self._contents
         return [f for f in self.iter_contents()]
 
+    def _ensure_contents_listed(self):
+        # The contents may not have been listed yet when the table of
+        # contents was cached, and extraction threads can get here
+        # concurrently.
+        with self._list_lock:
+            if not self._contents_listed:
+                self.list_contents()
+
+    def get_handler_name(self):
+        return self._main_archive.get_handler_name()
+
+    def get_listing_state(self):
+        # Sub-archives are extracted while listing, so only the state of
+        # an archive without any can be restored.
+        if not self._contents_listed or len(self._archive_list) != 1:
+            return None
+        return self._main_archive.get_listing_state()
+
+    def set_listing_state(self, state, files):
+        with self._list_lock:
+            if self._contents_listed:
+                return True
+            if not self._main_archive.set_listing_state(state, files):
+                return False
+            self._archive_list = [self._main_archive]
+            self._archive_root = {self._main_archive: None}
+            self._entry_mapping = dict((name, (self._main_archive, name))
+                                       for name in files)
+            self._contents = list(files)
+            self._contents_listed = True
+            self._check_concurrent_extraction_support()
+            self._check_memory_extraction_support()
+        return True
+
     def extract(self, filename, destination_dir):
-        if not self._contents_listed:
-            self.list_contents()
+        self._ensure_contents_listed()
         archive, name = self._entry_mapping[filename]
         root = self._archive_root[archive]
         if root is not None:
@@ -103,9 +150,24 @@ class RecursiveArchive(archive_base.BaseArchive):
                   archive.archive, destination_dir, filename)
         archive.extract(name, destination_dir)
 
+    def read(self, filename, max_size=None):
+        self._ensure_contents_listed()
+        archive, name = self._entry_mapping[filename]
+        return archive.read(name, max_size=max_size)
+
+    def iter_read(self, entries):
+        self._ensure_contents_listed()
+        # Keep the requested order, but hand over consecutive entries
+        # from the same archive together.
+        mapping = [(self._entry_mapping[filename], filename)
+                   for filename in entries]
+        for archive, group in itertools.groupby(mapping, key=lambda m: m[0][0]):
+            names = dict((entry[1], filename) for entry, filename in group)
+            for name, data in archive.iter_read(list(names.keys())):
+                yield names[name], data
+
     def iter_extract(self, entries, destination_dir):
-        if not self._contents_listed:
-            self.list_contents()
+        self._ensure_contents_listed()
         # Unfortunately we can't just rely on BaseArchive default
         # implementation if solid archives are to be correctly supported:
         # we need to call iter_extract (not extract) for each archive ourselves.
@@ -132,8 +194,7 @@ class RecursiveArchive(archive_base.BaseArchive):
                 break
 
     def is_solid(self):
-        if not self._contents_listed:
-            self.list_contents()
+        self._ensure_contents_listed()
         # We're solid if at least one archive is solid.
         for archive in self._archive_list:
             if archive.is_solid():
@@ -2,36 +2,58 @@
 
 """ PDF handler. """
 
+from mcomix import constants
 from mcomix import log
 from mcomix import process
 from mcomix.archive import archive_base
 
 # FIXME: LooseVersion is deprecated
 from distutils.version import LooseVersion
+import hashlib
+import io
+import json
 import math
 import os
 import re
+import shutil
 import subprocess
+import tempfile
+import threading
 
 # Default DPI for rendering.
 PDF_RENDER_DPI_DEF = 72 * 4
 # Maximum DPI for rendering.
 PDF_RENDER_DPI_MAX = 72 * 10
+# Maximum size of the rendered pages cache.
+PDF_RENDER_CACHE_MAX_SIZE = 1024 * 1024 * 1024
 
 _pdf_possible = None
 _mutool_exec = None
 _mudraw_exec = None
 _mudraw_trace_args = None
 
+def _get_max_renders():
+    """ Return the number of mutool processes rendering in parallel. """
+    return os.cpu_count() or 1
+
 class PdfArchive(archive_base.BaseArchive):
 
     """ Concurrent calls to extract welcome! """
     support_concurrent_extractions = True
+    # Rendered pages are read from the render cache, and iter_read()
+    # renders a batch of pages with several concurrent mutool processes.
+    support_memory_extraction = True
+    support_batch_extraction = True
 
     _fill_image_regex = re.compile(r'^\s*<fill_image\b.*\bmatrix="(?P<matrix>[^"]+)".*\bwidth="(?P<width>\d+)".*\bheight="(?P<height>\d+)".*/>\s*$')
+    _page_regex = re.compile(r'^\s*<page\b(?:.*\bnumber="(?P<number>\d+)")?')
 
     def __init__(self, archive):
         super(PdfArchive, self).__init__(archive)
+        self._cache = _RenderCache.get(archive)
+        #: Map page number > rendering DPI, see _get_dpi
+        self._dpi = None
+        self._dpi_lock = threading.Lock()
 
     def iter_contents(self):
         proc = subprocess.run(_mutool_exec + ['show', '--', self.archive, 'pages'], stdout=subprocess.PIPE, encoding='utf-8')
@@ -43,33 +65,170 @@ class PdfArchive(archive_base.BaseArchive):
         self._create_directory(destination_dir)
         destination_path = os.path.join(destination_dir, filename)
         page_num = int(filename[0:-4])
-        # Try to find optimal DPI.
-        cmd = _mudraw_exec + _mudraw_trace_args + ['--', self.archive, str(page_num)]
-        log.debug('finding optimal DPI for %s: %s', filename, ' '.join(cmd))
-        proc = subprocess.run(cmd, stdout=subprocess.PIPE, encoding='utf-8', errors='replace')
+        if self._cache is None:
+            self._render(page_num, destination_path)
+            return
+        path = self._cache.get_page_path(page_num, self._get_dpi(page_num))
+        if not os.path.exists(path):
+            self._render(page_num, path)
+        try:
+            os.link(path, destination_path)
+        except OSError:
+            shutil.copyfile(path, destination_path)
+
+    def read(self, filename, max_size=None):
+        if self._cache is None:
+            # Render to disk instead.
+            return None
+        page_num = int(filename[0:-4])
+        path = self._cache.get_page_path(page_num, self._get_dpi(page_num))
+        if not os.path.exists(path):
+            self._render(page_num, path)
+        if max_size is not None and os.path.getsize(path) > max_size:
+            return None
+        with open(path, 'rb') as fp:
+            return fp.read()
+
+    def iter_read(self, entries):
+        """ Render the pages in <entries> that are not cached yet with up
+        to one mutool process per CPU, yielding pages as they are done. """
+        pending = []
+        for filename in entries:
+            page_num = int(filename[0:-4])
+            if self._cache is None:
+                fd, path = tempfile.mkstemp(prefix='mcomix.pdf.', suffix='.png')
+                os.close(fd)
+            else:
+                path = self._cache.get_page_path(page_num, self._get_dpi(page_num))
+                if os.path.exists(path):
+                    yield filename, self._read_rendered(path)
+                    continue
+            pending.append((filename, page_num, path))
+        running = []
+        try:
+            while pending or running:
+                while pending and len(running) < _get_max_renders():
+                    filename, page_num, path = pending.pop(0)
+                    tmp_path = self._get_tmp_path(path)
+                    try:
+                        proc = process.popen(self._get_render_command(page_num, tmp_path),
+                                             stdout=process.NULL)
+                    except Exception:
+                        os.unlink(tmp_path)
+                        raise
+                    running.append((filename, path, tmp_path, proc))
+                # Pages are started in the requested order, so wait
+                # for the oldest render first.
+                filename, path, tmp_path, proc = running.pop(0)
+                self._publish_render(tmp_path, path, 0 == proc.wait())
+                yield filename, self._read_rendered(path)
+                if self._cache is None:
+                    os.unlink(path)
+        finally:
+            for filename, path, tmp_path, proc in running:
+                proc.kill()
+                proc.wait()
+                for leftover in (tmp_path, path if self._cache is None else None):
+                    if leftover is not None and os.path.exists(leftover):
+                        os.unlink(leftover)
+            if self._cache is None:
+                for filename, page_num, path in pending:
+                    os.unlink(path)
+
+    def get_listing_state(self):
+        # Pages are extracted by number, nothing needs to be remembered.
+        return {}
+
+    def set_listing_state(self, state, files):
+        return True
+
+    def _read_rendered(self, path):
+        try:
+            with open(path, 'rb') as fp:
+                return fp.read()
+        except IOError as e:
+            log.error('Rendering %s failed: %s', path, e)
+            return b''
+
+    def _get_render_command(self, page_num, path):
+        return _mudraw_exec + ['-r', str(self._get_dpi(page_num)),
+                               '-o', path, '--', self.archive, str(page_num)]
+
+    def _render(self, page_num, path):
+        """ Render page <page_num> to <path>. The file is written under a
+        temporary name first, so that other readers never see it partially
+        written. """
+        tmp_path = self._get_tmp_path(path)
+        cmd = self._get_render_command(page_num, tmp_path)
+        log.debug('rendering page %u: %s', page_num, ' '.join(cmd))
+        self._publish_render(tmp_path, path, process.call(cmd))
+
+    def _get_tmp_path(self, path):
+        """ Return a new file next to <path> to render into. Each render
+        gets its own, since other PdfArchive instances (e.g. the viewer's
+        and the thumbnailer's) may render the same page at the same time. """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.png')
+        os.close(fd)
+        return tmp_path
+
+    def _publish_render(self, tmp_path, path, success):
+        """ Move the page rendered to <tmp_path> to <path>, or remove it if
+        rendering was not successful. """
+        if success and os.path.getsize(tmp_path) > 0:
+            os.replace(tmp_path, path)
+        else:
+            os.unlink(tmp_path)
+
+    def _get_dpi(self, page_num):
+        """ Return the DPI to render page <page_num> with. The DPI of all
+        pages is found on first use, with a single mutool call. """
+        with self._dpi_lock:
+            if self._dpi is None:
+                if self._cache is not None:
+                    self._dpi = self._cache.load_dpi()
+                if self._dpi is None:
+                    self._dpi = self._find_dpi()
+                    if self._cache is not None:
+                        self._cache.save_dpi(self._dpi)
+            return self._dpi.get(page_num, PDF_RENDER_DPI_DEF)
+
+    def _find_dpi(self):
+        """ Try to find the optimal DPI of every page, which is the one
+        matching the resolution of its largest image. """
+        cmd = _mudraw_exec + _mudraw_trace_args + ['--', self.archive]
+        log.debug('finding optimal DPI for %s: %s', self.archive, ' '.join(cmd))
+        dpi_map = {}
+        page_num = 0
         max_size = 0
-        max_dpi = PDF_RENDER_DPI_DEF
-        for line in proc.stdout.splitlines():
-            match = self._fill_image_regex.match(line)
-            if not match:
-                continue
-            matrix = [float(f) for f in match.group('matrix').split()]
-            for size, coeff1, coeff2 in (
-                (int(match.group('width')), matrix[0], matrix[1]),
-                (int(match.group('height')), matrix[2], matrix[3]),
-            ):
-                if size < max_size:
+        proc = process.popen(cmd)
+        try:
+            for line in io.TextIOWrapper(proc.stdout, encoding='utf-8', errors='replace'):
+                match = self._page_regex.match(line)
+                if match:
+                    number = match.group('number')
+                    page_num = int(number) if number is not None else page_num + 1
+                    max_size = 0
                     continue
-                render_size = math.sqrt(coeff1 * coeff1 + coeff2 * coeff2)
-                dpi = int(size * 72 / render_size)
-                if dpi > PDF_RENDER_DPI_MAX:
-                    dpi = PDF_RENDER_DPI_MAX
-                max_size = size
-                max_dpi = dpi
-        # Render...
-        cmd = _mudraw_exec + ['-r', str(max_dpi), '-o', destination_path, '--', self.archive, str(page_num)]
-        log.debug('rendering %s: %s', filename, ' '.join(cmd))
-        process.call(cmd)
+                match = self._fill_image_regex.match(line)
+                if not match:
+                    continue
+                matrix = [float(f) for f in match.group('matrix').split()]
+                for size, coeff1, coeff2 in (
+                    (int(match.group('width')), matrix[0], matrix[1]),
+                    (int(match.group('height')), matrix[2], matrix[3]),
+                ):
+                    if size < max_size:
+                        continue
+                    render_size = math.sqrt(coeff1 * coeff1 + coeff2 * coeff2)
+                    dpi = int(size * 72 / render_size)
+                    if dpi > PDF_RENDER_DPI_MAX:
+                        dpi = PDF_RENDER_DPI_MAX
+                    max_size = size
+                    dpi_map[page_num] = dpi
+        finally:
+            proc.stdout.close()
+            proc.wait()
+        return dpi_map
 
     @staticmethod
     def is_available():
@@ -124,4 +283,82 @@ class PdfArchive(archive_base.BaseArchive):
             log.info('MuPDF not available.')
         return _pdf_possible
 
+class _RenderCache(object):
+
+    """ On-disk cache of rendered pages. Each document gets a directory,
+    keyed by its path, size and modification time, with the DPI of its
+    pages and the pages rendered so far. """
+
+    _pruned = False
+    _lock = threading.Lock()
+
+    def __init__(self, directory):
+        self._directory = directory
+
+    @classmethod
+    def get(cls, path):
+        """ Return the cache for the PDF document at <path>, or None if it
+        can't be used. """
+        try:
+            stat = os.stat(path)
+            key = '%s:%u:%u' % (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+            directory = os.path.join(constants.PDF_RENDER_CACHE_PATH,
+                                     hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest())
+            with cls._lock:
+                if not cls._pruned:
+                    cls._pruned = True
+                    _prune_render_cache(PDF_RENDER_CACHE_MAX_SIZE)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            # Keep track of the last use for pruning.
+            os.utime(directory)
+        except OSError as e:
+            log.warning('PDF render cache unavailable: %s', e)
+            return None
+        return cls(directory)
+
+    def get_page_path(self, page_num, dpi):
+        return os.path.join(self._directory, '%u-%u.png' % (page_num, dpi))
+
+    def load_dpi(self):
+        try:
+            with open(os.path.join(self._directory, 'dpi.json'), 'r') as fp:
+                return dict((int(page), dpi) for page, dpi in json.load(fp).items())
+        except (IOError, ValueError):
+            return None
+
+    def save_dpi(self, dpi_map):
+        path = os.path.join(self._directory, 'dpi.json')
+        try:
+            with open(path + '.part', 'w') as fp:
+                json.dump(dpi_map, fp)
+            os.replace(path + '.part', path)
+        except IOError as e:
+            log.warning('Could not save DPI of PDF pages: %s', e)
+
+def _prune_render_cache(max_size):
+    """ Remove the least recently used documents from the render cache
+    until it takes less than <max_size> bytes. """
+    root = constants.PDF_RENDER_CACHE_PATH
+    if not os.path.isdir(root):
+        return
+    documents = []
+    total_size = 0
+    for name in os.listdir(root):
+        directory = os.path.join(root, name)
+        try:
+            size = sum(os.path.getsize(os.path.join(directory, f))
+                       for f in os.listdir(directory))
+            documents.append((os.path.getmtime(directory), size, directory))
+        except OSError:
+            continue
+        total_size += size
+    documents.sort()
+    for mtime, size, directory in documents:
+        if total_size <= max_size:
+            break
+        log.debug('pruning PDF render cache: %s', directory)
+        shutil.rmtree(directory, True)
+        total_size -= size
+
 # vim: expandtab:sw=4:ts=4
@@ -106,6 +106,10 @@ class RarArchive(archive_base.BaseArchive):
         # Information about the current file will be stored in this structure
         self._headerdata = RarArchive._RARHeaderDataEx()
         self._current_filename = None
+        #: Position in the archive of the entry under the cursor
+        self._position = 0
+        #: Map filename > position in the archive, filled by iter_contents
+        self._index = None
 
         # Set up function prototypes.
         # Mandatory since pointers get truncated on x64 otherwise!
@@ -131,12 +135,16 @@ class RarArchive(archive_base.BaseArchive):
         """ List archive contents. """
         self._close()
         self._open()
+        index = {}
         try:
             while True:
                 self._read_header()
                 if 0 != (0x10 & self._headerdata.Flags):
                     self._is_solid = True
                 filename = self._current_filename
+                # Like extract() used to, stick to the first entry
+                # in case of duplicate names.
+                index.setdefault(filename, self._position)
                 yield filename
                 # Skip to the next entry if we're still on the same name
                 # (extract may have been called by iter_extract).
@@ -144,43 +152,65 @@ class RarArchive(archive_base.BaseArchive):
                     self._process()
         except UnrarException as exc:
             log.error('Error while listing contents: %s', str(exc))
+            # Entries past the error can't be reached anyway.
+            self._index = index
         except EOFError:
             # End of archive reached.
-            pass
+            self._index = index
         finally:
             self._close()
 
+    def get_listing_state(self):
+        if self._index is None:
+            return None
+        return {'index': list(self._index.items()), 'solid': self._is_solid}
+
+    def set_listing_state(self, state, files):
+        if 'index' not in state:
+            return False
+        self._index = dict(state['index'])
+        self._is_solid = state['solid']
+        return True
+
     def extract(self, filename, destination_dir):
         """ Extract <filename> from the archive to <destination_dir>. """
-        if not self._handle:
+        if self._index is None:
+            self.list_contents()
+        position = self._index.get(filename)
+        if position is None:
+            log.warning('"%s" not found in "%s"', filename, self.archive)
+            return
+        # The library can only move forward: if the file is behind
+        # the cursor, go back to the archive start. Thanks to the index,
+        # we know exactly how many entries to skip from there.
+        if not self._handle or position < self._position:
+            self._close()
             self._open()
-        looped = False
         while True:
-            # Check if the current entry matches the requested file.
-            if self._current_filename is not None:
-                if (self._current_filename == filename):
-                    # It's the entry we're looking for, extract it.
-                    dest = ctypes.c_wchar_p(os.path.join(destination_dir, filename))
-                    self._process(dest)
-                    break
-                # Not the right entry, skip it.
-                self._process()
-            try:
+            if self._current_filename is None:
                 self._read_header()
-            except EOFError:
-                # Archive end was reached, this might be due to out-of-order
-                # extraction while the handle was still open.  Close the
-                # archive and jump back to archive start and try to extract
-                # file again.  Do this only once; if the file isn't found after
-                # a second full pass, it probably doesn't even exist in the
-                # archive.
-                if looped:
-                    break
-                self._open()
+            if self._position == position:
+                # It's the entry we're looking for, extract it.
+                dest = ctypes.c_wchar_p(os.path.join(destination_dir, filename))
+                self._process(dest)
+                break
+            # Not the right entry, skip it.
+            self._process()
         # After the method returns, the RAR handler is still open and pointing
         # to the next archive file. This will improve extraction speed for sequential file reads.
         # After all files have been extracted, close() should be called to free the handler resources.
 
+    def iter_extract(self, entries, destination_dir):
+        """ Extract <entries> in archive order, so that the whole batch
+        is done in a single pass. """
+        if self._index is None:
+            self.list_contents()
+        wanted = [name for name in set(entries) if name in self._index]
+        wanted.sort(key=self._index.get)
+        for filename in wanted:
+            self.extract(filename, destination_dir)
+            yield filename
+
     def close(self):
         """ Close the archive handle """
         self._close()
@@ -199,6 +229,8 @@ class RarArchive(archive_base.BaseArchive):
             raise UnrarException("Couldn't open archive: %s" % errormessage)
         self._unrar.RARSetCallback(handle, self._callback_function, 0)
         self._handle = handle
+        self._position = 0
+        self._current_filename = None
 
     def _check_errorcode(self, errorcode):
         if 0 == errorcode:
@@ -227,12 +259,14 @@ class RarArchive(archive_base.BaseArchive):
             mode = RarArchive._ProcessingMode.RAR_EXTRACT
         errorcode = self._unrar.RARProcessFileW(self._handle, mode, None, dest)
         self._current_filename = None
+        self._position += 1
         self._check_errorcode(errorcode)
 
     def _close(self):
         """ Close the rar handle previously obtained by open. """
         if self._handle is None:
             return
+        self._current_filename = None
         errorcode = self._unrar.RARCloseArchive(self._handle)
         if errorcode != 0:
             errormessage = UnrarException.get_error_message(errorcode)
@@ -27,6 +27,8 @@ class RarArchive(archive_base.ExternalExecutableArchive):
         self._is_encrypted =  False
         self._contents = []
 
+    _listing_attributes = ('_contents', '_is_solid', '_is_encrypted')
+
     def _get_executable(self):
         return self._find_unrar_executable()
 
@@ -137,6 +139,20 @@ class RarArchive(archive_base.ExternalExecutableArchive):
         finally:
             output.close()
 
+    def read(self, filename, max_size=None):
+        """ Read <filename> from the archive without writing it to disk. """
+        assert isinstance(filename, str)
+
+        if not self._get_executable():
+            return None
+
+        if not self.filenames_initialized:
+            self.list_contents()
+
+        desired_filename = self._original_filename(filename)
+        return self._read_output(self._get_extract_arguments() + [desired_filename],
+                                 max_size)
+
     def iter_extract(self, entries, destination_dir):
 
         if not self._get_executable():
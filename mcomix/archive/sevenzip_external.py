@@ -18,6 +18,9 @@ class SevenZipArchive(archive_base.ExternalExecutableArchive):
 
     STATE_HEADER, STATE_LISTING, STATE_FOOTER = 1, 2, 3
 
+    # iter_read() extracts all members in a single 7z call.
+    support_batch_extraction = True
+
     class EncryptedHeader(Exception):
         pass
 
@@ -27,6 +30,8 @@ class SevenZipArchive(archive_base.ExternalExecutableArchive):
         self._is_encrypted =  False
         self._contents = []
 
+    _listing_attributes = ('_contents', '_is_solid', '_is_encrypted')
+
     def _get_executable(self):
         return SevenZipArchive._find_7z_executable()
 
@@ -156,6 +161,71 @@ class SevenZipArchive(archive_base.ExternalExecutableArchive):
         finally:
             os.unlink(tmplistfile.name)
 
+    def read(self, filename, max_size=None):
+        """ Read <filename> from the archive without writing it to disk. """
+        assert isinstance(filename, str)
+
+        if not self._get_executable():
+            return None
+
+        if not self.filenames_initialized:
+            self.list_contents()
+
+        tmplistfile = tempfile.NamedTemporaryFile(prefix='mcomix.7z.', delete=False)
+        try:
+            desired_filename = self._original_filename(filename)
+            if isinstance(desired_filename, str):
+                desired_filename = desired_filename.encode('utf-8')
+
+            tmplistfile.write(desired_filename + os.linesep.encode('utf-8'))
+            tmplistfile.close()
+
+            return self._read_output(
+                self._get_extract_arguments(list_file=tmplistfile.name),
+                max_size)
+        finally:
+            os.unlink(tmplistfile.name)
+
+    def iter_read(self, entries):
+        """ Read <entries> with a single 7z process, in archive order. """
+
+        if not self._get_executable():
+            return
+
+        if not self.filenames_initialized:
+            self.list_contents()
+
+        wanted = set(entries)
+        tmplistfile = tempfile.NamedTemporaryFile(prefix='mcomix.7z.', delete=False)
+        try:
+            for filename in wanted:
+                desired_filename = self._original_filename(filename)
+                if isinstance(desired_filename, str):
+                    desired_filename = desired_filename.encode('utf-8')
+                tmplistfile.write(desired_filename + os.linesep.encode('utf-8'))
+            tmplistfile.close()
+
+            proc = process.popen(self._get_extract_arguments(list_file=tmplistfile.name))
+            try:
+                # Members are written to STDOUT one after the other,
+                # in archive order.
+                for filename, filesize in self._contents:
+                    if filename not in wanted:
+                        continue
+                    yield filename, proc.stdout.read(filesize)
+                    wanted.remove(filename)
+                    if 0 == len(wanted):
+                        break
+            finally:
+                proc.stdout.close()
+                proc.wait()
+        finally:
+            os.unlink(tmplistfile.name)
+
+        # Empty files are not part of the contents sizes.
+        for filename in wanted:
+            yield filename, b''
+
     def iter_extract(self, entries, destination_dir):
 
         if not self._get_executable():
@@ -38,6 +38,10 @@ class TarArchive(archive_base.NonUnicodeArchive):
     def list_contents(self):
         return [f for f in self.iter_contents()]
 
+    def get_listing_state(self):
+        # Members can only be found by reading the archive again.
+        return None
+
     def extract(self, filename, destination_dir):
         if not self._contents_listed:
             self.list_contents()
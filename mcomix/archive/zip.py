@@ -2,14 +2,25 @@
 
 """ Unicode-aware wrapper for zipfile.ZipFile. """
 
+import mmap
 import os
+import struct
+import threading
 import zipfile
-from contextlib import closing
+import zlib
+from contextlib import closing, contextmanager
 
+from mcomix.preferences import prefs
 from mcomix import log
 from mcomix import i18n
 from mcomix.archive import archive_base
 
+# Local file header, see APPNOTE.TXT section 4.3.7.
+_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+_LOCAL_HEADER_SIZE = _LOCAL_HEADER.size
+_LOCAL_HEADER_MAGIC = b'PK\x03\x04'
+# Read size when streaming compressed members.
+_CHUNK_SIZE = 1024 * 1024
 
 def is_py_supported_zipfile(path):
     """Check if a given zipfile has all internal files stored with Python supported compression
@@ -22,6 +33,12 @@ def is_py_supported_zipfile(path):
     return True
 
 class ZipArchive(archive_base.NonUnicodeArchive):
+
+    # Stored members are read from a shared memory map, and deflated
+    # members through a small pool of ZipFile handles.
+    support_concurrent_extractions = True
+    support_memory_extraction = True
+
     def __init__(self, archive):
         super(ZipArchive, self).__init__(archive)
         self.zip = zipfile.ZipFile(archive, 'r')
@@ -30,6 +47,21 @@ class ZipArchive(archive_base.NonUnicodeArchive):
         self._encryption_supported = hasattr(self.zip, "setpassword")
         self._password = None
 
+        self._file = None
+        self._mmap = None
+        try:
+            self._file = open(archive, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            # E.g. empty or special files, fall back to ZipFile.
+            log.debug('Could not map "%s" to memory: %s', archive, e)
+        #: ZipFile handles not currently used for reading
+        self._idle_handles = []
+        #: Number of ZipFile handles opened, idle or not
+        self._handle_count = 0
+        self._handles_condition = threading.Condition()
+        self._closed = False
+
     def iter_contents(self):
         if self._encryption_supported and self._has_encryption():
             self._get_password()
@@ -39,23 +71,133 @@ class ZipArchive(archive_base.NonUnicodeArchive):
             yield self._unicode_filename(filename)
 
     def extract(self, filename, destination_dir):
-        new = self._create_file(os.path.join(destination_dir, filename))
-        content = self.zip.read(self._original_filename(filename))
-        new.write(content)
-        new.close()
-
         zipinfo = self.zip.getinfo(self._original_filename(filename))
-        if len(content) != zipinfo.file_size:
+        new = self._create_file(os.path.join(destination_dir, filename))
+        try:
+            view = self._get_stored_view(zipinfo)
+            if view is not None:
+                new.write(view)
+                size = len(view)
+                view.release()
+            else:
+                size = 0
+                with self._borrow_handle() as handle, \
+                     handle.open(zipinfo) as member:
+                    while True:
+                        chunk = member.read(_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        new.write(chunk)
+                        size += len(chunk)
+        finally:
+            new.close()
+
+        if size != zipinfo.file_size:
             log.warning(_('%(filename)s\'s extracted size is %(actual_size)d bytes,'
                 ' but should be %(expected_size)d bytes.'
                 ' The archive might be corrupt or in an unsupported format.'),
-                { 'filename' : filename, 'actual_size' : len(content),
+                { 'filename' : filename, 'actual_size' : size,
                   'expected_size' : zipinfo.file_size })
 
-
+    def read(self, filename, max_size=None):
+        """ Returns the contents of <filename>. For stored members, this is
+        a memoryview on the mapped archive and no data is copied. """
+        zipinfo = self.zip.getinfo(self._original_filename(filename))
+        if max_size is not None and zipinfo.file_size > max_size:
+            return None
+        view = self._get_stored_view(zipinfo)
+        if view is not None:
+            return view
+        with self._borrow_handle() as handle:
+            return handle.read(zipinfo)
+
+    def get_listing_state(self):
+        if self._encryption_supported and self._has_encryption():
+            # The password is asked for while listing.
+            return None
+        return super(ZipArchive, self).get_listing_state()
 
     def close(self):
+        with self._handles_condition:
+            self._closed = True
+            for handle in self._idle_handles:
+                handle.close()
+            self._idle_handles = []
         self.zip.close()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Views returned by read() are still in use, the map
+                # will be released once they are garbage collected.
+                pass
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _get_stored_view(self, zipinfo):
+        """ Returns a memoryview on the data of <zipinfo> in the mapped
+        archive, or None if the member is compressed, encrypted, does not
+        match its CRC, or the archive could not be mapped. """
+        if self._mmap is None or \
+           zipinfo.compress_type != zipfile.ZIP_STORED or \
+           zipinfo.flag_bits & 0x1:
+            return None
+        # The local header may have a different extra field than the
+        # central directory, so it must be read to find the data.
+        offset = zipinfo.header_offset
+        header = self._mmap[offset:offset + _LOCAL_HEADER_SIZE]
+        if len(header) != _LOCAL_HEADER_SIZE:
+            return None
+        fields = _LOCAL_HEADER.unpack(header)
+        if fields[0] != _LOCAL_HEADER_MAGIC:
+            return None
+        start = offset + _LOCAL_HEADER_SIZE + fields[-2] + fields[-1]
+        end = start + zipinfo.compress_size
+        if end > len(self._mmap):
+            return None
+        view = memoryview(self._mmap)[start:end]
+        if zlib.crc32(view) != zipinfo.CRC:
+            # Let ZipFile read it again and report the corruption.
+            view.release()
+            return None
+        return view
+
+    @contextmanager
+    def _borrow_handle(self):
+        """ Lends a ZipFile handle for one read. At most 'max extract
+        threads' handles are opened, other readers wait for one of them
+        to be returned. """
+        with self._handles_condition:
+            while not self._idle_handles and \
+                  self._handle_count >= max(1, prefs['max extract threads']):
+                self._handles_condition.wait()
+            if self._idle_handles:
+                handle = self._idle_handles.pop()
+            else:
+                handle = None
+                self._handle_count += 1
+        if handle is None:
+            try:
+                handle = zipfile.ZipFile(self.archive, 'r')
+                if self._password:
+                    handle.setpassword(i18n.to_utf8(self._password))
+            except Exception:
+                with self._handles_condition:
+                    self._handle_count -= 1
+                    self._handles_condition.notify()
+                raise
+        try:
+            yield handle
+        finally:
+            with self._handles_condition:
+                if self._closed:
+                    handle.close()
+                    self._handle_count -= 1
+                else:
+                    self._idle_handles.append(handle)
+                self._handles_condition.notify()
 
     def _has_encryption(self):
         """ Checks all files in the archive for encryption.
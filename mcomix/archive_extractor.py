@@ -5,12 +5,17 @@ import os
 import threading
 import traceback
 
+from mcomix import archive_toc
 from mcomix import archive_tools
 from mcomix import callback
 from mcomix import log
 from mcomix.preferences import prefs
+from mcomix import worker_thread
 from mcomix.worker_thread import WorkerThread
 
+#: Number of files extracted together by archives supporting batches.
+BATCH_SIZE = 16
+
 class Extractor(object):
 
     """Extractor is a threaded class for extracting different archive formats.
@@ -23,6 +28,15 @@ class Extractor(object):
     signal is sent on a condition after each extraction, so that it is possible
     for other threads to wait on specific files to be ready.
 
+    If the archive supports it, files are kept in memory instead of being
+    written to the destination directory, as long as their total size stays
+    below the 'max in-memory extraction size' preference. Files that do not
+    fit are extracted to disk as usual, see get_data() and write_to_disk().
+
+    Non-solid archives that support batch extraction get their files in
+    windows of BATCH_SIZE files, following the extraction order, so that
+    each window only costs one call to the archiver.
+
     Note: Support for gzip/bzip2 compressed tar archives is limited, see
     set_files() for more info.
     """
@@ -39,6 +53,12 @@ class Extractor(object):
         self._dst = dst
         self._files = []
         self._extracted = set()
+        #: Files currently being extracted in a batch
+        self._in_progress = set()
+        #: Map name > contents of files extracted to memory
+        self._memory = {}
+        self._memory_size = 0
+        self._memory_limit = prefs['max in-memory extraction size'] * 1024 * 1024
         self._archive = archive_tools.get_recursive_archive_handler(src, dst, type=type)
         if self._archive is None:
             msg = _('Non-supported archive format: %s') % os.path.basename(src)
@@ -46,9 +66,12 @@ class Extractor(object):
             raise ArchiveException(msg)
 
         self._contents_listed = False
+        #: Table of contents, see archive_toc
+        self._toc = None
         self._extract_started = False
         self._condition = threading.Condition()
-        self._list_thread = WorkerThread(self._list_contents, name='list')
+        self._list_thread = WorkerThread(self._list_contents, name='list',
+                                         priority_class=worker_thread.VISIBLE)
         self._list_thread.append_order(self._archive)
         self._setupped = True
 
@@ -98,6 +121,37 @@ class Extractor(object):
         with self._condition:
             return name in self._extracted
 
+    def get_data(self, name):
+        """Return the contents of the file <name> if it was extracted to
+        memory, or None if it was extracted to disk (or not at all).
+        """
+        with self._condition:
+            return self._memory.get(name)
+
+    def write_to_disk(self, name):
+        """Make sure the file <name>, if it was extracted to memory, also
+        exists in the destination directory, for the (few) users that
+        need an actual file.
+        """
+        data = self.get_data(name)
+        if data is None:
+            return
+        path = os.path.join(self._dst, name)
+        if os.path.exists(path):
+            return
+        self._write_file(path, data)
+
+    def _write_file(self, path, data):
+        dst_dir = os.path.dirname(path)
+        if not os.path.exists(dst_dir):
+            os.makedirs(dst_dir)
+        # Write to a temporary file first, so that a partially written
+        # file is never visible under its final name.
+        tmp_path = path + '.mcomix-tmp'
+        with open(tmp_path, 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp_path, path)
+
     def stop(self):
         """Signal the extractor to stop extracting and kill the extracting
         thread. Blocks until the extracting thread has terminated.
@@ -117,26 +171,37 @@ class Extractor(object):
         with self._condition:
             if not self._contents_listed:
                 return
+            # Use the table of contents rather than asking the archive,
+            # which may not have listed its contents yet if they were cached.
+            is_solid = self._toc['solid']
             if not self._extract_started:
-                if self._archive.support_concurrent_extractions \
-                   and not self._archive.is_solid():
+                if self._toc['concurrent'] and not is_solid:
                     max_threads = prefs['max extract threads']
                 else:
                     max_threads = 1
-                if self._archive.is_solid():
+                if is_solid:
                     fn = self._extract_all_files
+                elif self._toc['batch']:
+                    fn = self._extract_batch
                 else:
                     fn = self._extract_file
                 self._extract_thread = WorkerThread(fn,
                                                     name='extract',
                                                     max_threads=max_threads,
-                                                    unique_orders=True)
+                                                    unique_orders=True,
+                                                    priority_class=worker_thread.VISIBLE)
                 self._extract_started = True
             else:
                 self._extract_thread.clear_orders()
-            if self._archive.is_solid():
+            if is_solid:
                 # Sort files so we don't queue the same batch multiple times.
                 self._extract_thread.append_order(sorted(self._files))
+            elif self._toc['batch']:
+                files = [f for f in self._files if f not in self._in_progress]
+                self._extract_thread.extend_orders([
+                    tuple(files[n:n + BATCH_SIZE])
+                    for n in range(0, len(files), BATCH_SIZE)
+                ])
             else:
                 self._extract_thread.extend_orders(self._files)
 
@@ -155,12 +220,19 @@ class Extractor(object):
         extract() method isn't called.
         """
         self.stop()
+        if self._setupped:
+            # Drop in-memory files first, as they may be views on the
+            # archive data.
+            with self._condition:
+                self._memory.clear()
+                self._memory_size = 0
         if self._archive:
             self._archive.close()
 
     def _extraction_finished(self, name):
         with self._condition:
-            self._files.remove(name)
+            if name in self._files:
+                self._files.remove(name)
             self._extracted.add(name)
             self._condition.notifyAll()
         self.file_extracted(self, name)
@@ -195,8 +267,9 @@ class Extractor(object):
         """
 
         try:
-            log.debug('Extracting from "%s" to "%s": "%s"', self._src, self._dst, name)
-            self._archive.extract(name, self._dst)
+            if not self._extract_to_memory(name):
+                log.debug('Extracting from "%s" to "%s": "%s"', self._src, self._dst, name)
+                self._archive.extract(name, self._dst)
 
         except Exception as ex:
             # Better to ignore any failed extractions (e.g. from a corrupt
@@ -210,14 +283,95 @@ class Extractor(object):
             return
         self._extraction_finished(name)
 
+    def _extract_batch(self, files):
+        """Extract the files in <files> with a single call to the archive,
+        keeping them in memory when they fit.
+        """
+        with self._condition:
+            files = [f for f in files
+                     if f not in self._extracted and f not in self._in_progress]
+            self._in_progress.update(files)
+        if not files:
+            return
+
+        try:
+            log.debug('Extracting from "%s": "%s"', self._src, '", "'.join(files))
+            for name, data in self._archive.iter_read(files):
+                if self._extract_thread.must_stop():
+                    return
+                if not self._keep_in_memory(name, data):
+                    self._write_file(os.path.join(self._dst, name), data)
+                self._extraction_finished(name)
+
+        except Exception as ex:
+            # Better to ignore any failed extractions (e.g. from a corrupt
+            # archive) than to crash here and leave the main thread in a
+            # possible infinite block. Damaged or missing files *should* be
+            # handled gracefully by the main program anyway.
+            log.error(_('! Extraction error: %s'), ex)
+            log.debug('Traceback:\n%s', traceback.format_exc())
+
+        finally:
+            with self._condition:
+                self._in_progress.difference_update(files)
+
+        if self._extract_thread.must_stop():
+            return
+        # Mark files the archiver did not produce as done anyway, so that
+        # nobody waits on them forever.
+        for name in files:
+            if not self.is_ready(name):
+                self._extraction_finished(name)
+
+    def _extract_to_memory(self, name):
+        """Read the file <name> into memory if the archive supports it and
+        it fits in what is left of the memory budget. Return False if the
+        file must be extracted to disk instead.
+        """
+        if not self._toc['memory']:
+            return False
+        with self._condition:
+            budget = self._memory_limit - self._memory_size
+        if budget <= 0:
+            return False
+        log.debug('Extracting from "%s" to memory: "%s"', self._src, name)
+        data = self._archive.read(name, max_size=budget)
+        if data is None:
+            log.debug('"%s" is too large to be kept in memory', name)
+            return False
+        return self._keep_in_memory(name, data)
+
+    def _keep_in_memory(self, name, data):
+        """Store <data> as the contents of <name> if it fits in what is
+        left of the memory budget. Return False otherwise.
+        """
+        with self._condition:
+            # Other threads may have used up the budget in the meantime.
+            if self._memory_size + len(data) > self._memory_limit:
+                return False
+            self._memory[name] = data
+            self._memory_size += len(data)
+        return True
+
     def _list_contents(self, archive):
-        files = []
-        for f in archive.iter_contents():
-            if self._list_thread.must_stop():
-                return
-            files.append(f)
+        handler_name = archive.get_handler_name()
+        toc = archive_toc.load(self._src, handler_name)
+        if toc is None:
+            files = []
+            for f in archive.iter_contents():
+                if self._list_thread.must_stop():
+                    return
+                files.append(f)
+            toc = archive_toc.create(archive, files)
+            if files:
+                archive_toc.save(self._src, handler_name, toc)
+        elif toc['state'] is not None:
+            # Extracting will not need to list the archive again.
+            archive.set_listing_state(toc['state'], toc['files'])
+        files = list(toc['files'])
         with self._condition:
             self._files = files
+            self._toc = toc
             self._contents_listed = True
         self.contents_listed(self, files)
 
@@ -2,9 +2,9 @@
 
 import os
 import zipfile
-import threading
 
 from mcomix import log
+from mcomix import worker_thread
 
 class Packer(object):
 
@@ -32,22 +32,22 @@ class Packer(object):
         self._other_files = other_files
         self._archive_path = archive_path
         self._base_name = base_name
-        self._pack_thread = None
+        self._packed = None
         self._packing_successful = False
 
     def pack(self):
         """Pack all the files in the file lists into the archive."""
-        self._pack_thread = threading.Thread(target=self._thread_pack)
-        self._pack_thread.name += '-pack'
-        self._pack_thread.setDaemon(False)
-        self._pack_thread.start()
+        # The user is waiting for the archive, so do not queue it
+        # behind background work.
+        self._packed = worker_thread.submit(worker_thread.VISIBLE,
+                                            self._thread_pack)
 
     def wait(self):
         """Block until the packer thread has finished. Return True if the
         packer finished its work successfully.
         """
-        if self._pack_thread != None:
-            self._pack_thread.join()
+        if self._packed != None:
+            self._packed.wait()
 
         return self._packing_successful
 
@@ -0,0 +1,124 @@
+""" archive_toc.py - Persistent cache of archive tables of contents. """
+
+import hashlib
+import json
+import os
+import threading
+
+from mcomix import constants
+from mcomix import log
+
+#: Bumped whenever the format of cached entries changes.
+TOC_VERSION = 2
+#: Number of archives to keep tables of contents for.
+MAX_ENTRIES = 4096
+
+_pruned = False
+_lock = threading.Lock()
+
+def load(path, handler_name):
+    """Return the cached table of contents of the archive at <path>, as
+    listed by the handler named <handler_name>, or None if the archive
+    was never listed or changed since.
+
+    The table of contents is a dictionary with the following keys:
+    'files': the list of member names, as returned by iter_contents(),
+    'solid': the result of is_solid(), and 'concurrent', 'memory' and
+    'batch': the support_*_extraction flags of the handler, and 'state':
+    the result of get_listing_state(), which may be None.
+    """
+    cache_path = _get_cache_path(path)
+    if cache_path is None:
+        return None
+    try:
+        with open(cache_path, 'r') as fp:
+            toc = json.load(fp)
+    except (IOError, ValueError):
+        return None
+    if toc.get('version') != TOC_VERSION or \
+       toc.get('key') != _get_key(path) or \
+       toc.get('handler') != handler_name:
+        return None
+    # Keep track of the last use for pruning.
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+    log.debug('Using cached table of contents for "%s"', path)
+    return toc
+
+def create(archive, files):
+    """Return the table of contents of <archive>, whose contents
+    <files> have just been listed.
+    """
+    return {
+        'files': files,
+        'solid': archive.is_solid(),
+        'concurrent': archive.support_concurrent_extractions,
+        'memory': archive.support_memory_extraction,
+        'batch': archive.support_batch_extraction,
+        'state': archive.get_listing_state(),
+    }
+
+def save(path, handler_name, toc):
+    """Store <toc>, the table of contents of the archive at <path> as
+    listed by the handler named <handler_name>, see load().
+    """
+    cache_path = _get_cache_path(path)
+    if cache_path is None:
+        return
+    entry = dict(toc)
+    entry.update(version=TOC_VERSION, key=_get_key(path), handler=handler_name)
+    try:
+        _prune()
+        cache_dir = os.path.dirname(cache_path)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_path = cache_path + '.part'
+        with open(tmp_path, 'w') as fp:
+            json.dump(entry, fp)
+        os.replace(tmp_path, cache_path)
+    except (IOError, OSError, ValueError) as e:
+        log.warning('Could not cache table of contents of "%s": %s', path, e)
+
+def _get_key(path):
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+def _get_cache_path(path):
+    try:
+        key = json.dumps(_get_key(path))
+    except OSError:
+        return None
+    digest = hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+    return os.path.join(constants.ARCHIVE_TOC_CACHE_PATH, digest + '.json')
+
+def _prune():
+    """Remove the least recently used entries once per session, when
+    there are more than MAX_ENTRIES of them.
+    """
+    global _pruned
+    with _lock:
+        if _pruned:
+            return
+        _pruned = True
+    cache_dir = constants.ARCHIVE_TOC_CACHE_PATH
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            entries.append((os.path.getmtime(path), path))
+        except OSError:
+            continue
+    if len(entries) <= MAX_ENTRIES:
+        return
+    entries.sort()
+    for mtime, path in entries[:len(entries) - MAX_ENTRIES]:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+# vim: expandtab:sw=4:ts=4
@@ -1,14 +1,19 @@
 """archive_tools.py - Archive tool functions."""
 
+import bz2
 import os
 import shutil
+import struct
 import zipfile
 import tarfile
 import tempfile
+import zlib
 
 from mcomix import image_tools
+from mcomix import archive_toc
 from mcomix import constants
 from mcomix import log
+from mcomix.lru_cache import LRUCache
 from mcomix.archive import (
     lha_external,
     pdf_external,
@@ -116,6 +121,9 @@ def is_archive_file(path):
     """
     return _SUPPORTED_ARCHIVE_REGEX.search(path) is not None
 
+#: Map (path, size, mtime) > archive type, see archive_mime_type()
+_mime_type_cache = LRUCache(max_size=512, sizeof=lambda archive_type: 1)
+
 def archive_mime_type(path):
     """Return the archive type of <path> or None for non-archives."""
     try:
@@ -125,67 +133,190 @@ def archive_mime_type(path):
             if not os.access(path, os.R_OK):
                 return None
 
-            if zipfile.is_zipfile(path):
-                if zip.is_py_supported_zipfile(path):
-                    return constants.ZIP
-                else:
-                    return constants.ZIP_EXTERNAL
+            stat = os.stat(path)
+            key = (path, stat.st_size, stat.st_mtime_ns)
+            if key in _mime_type_cache:
+                return _mime_type_cache.get(key)
 
-            fd = open(path, 'rb')
-            magic = fd.read(5)
-            fd.close()
+            with open(path, 'rb') as fp:
+                archive_type = _sniff_archive_type(fp, stat.st_size)
+            _mime_type_cache.put(key, archive_type)
+            return archive_type
 
-            try:
-                istarfile = tarfile.is_tarfile(path)
-            except IOError:
-                # Tarfile raises an error when accessing certain network shares
-                istarfile = False
+    except Exception:
+        log.warning(_('! Could not read %s'), path)
 
-            if istarfile and os.path.getsize(path) > 0:
-                if magic.startswith(b'BZh'):
-                    return constants.BZIP2
-                elif magic.startswith(b'\037\213'):
-                    return constants.GZIP
-                else:
-                    return constants.TAR
+    return None
 
-            if magic[0:4] == b'Rar!':
-                return constants.RAR
+# Size of the block read at the start of the file, large enough for a tar header.
+_HEADER_BLOCK_SIZE = 512
+# Maximum amount of compressed data read to find the first tar header.
+_MAX_COMPRESSED_HEADER_SIZE = 1024 * 1024
+# ZIP "end of central directory" record, see APPNOTE.TXT section 4.3.16.
+_ZIP_EOCD = struct.Struct('<4s4H2LH')
+_ZIP_EOCD_MAGIC = b'PK\x05\x06'
+_ZIP_CENTRAL_DIRECTORY = struct.Struct('<4s6H3L5H2L')
+_ZIP_CENTRAL_DIRECTORY_MAGIC = b'PK\x01\x02'
+
+def _sniff_archive_type(fp, size):
+    """Return the archive type of the opened file <fp> of <size> bytes,
+    reading only its first block, and the end for ZIP files.
+    """
+    zip_type = _sniff_zip(fp, size)
+    if zip_type is not None:
+        return zip_type
 
-            if magic[0:4] == b'7z\xBC\xAF':
-                return constants.SEVENZIP
+    fp.seek(0)
+    header = fp.read(_HEADER_BLOCK_SIZE)
+    magic = header[0:5]
 
-            # Headers for TAR-XZ and TAR-LZMA that aren't supported by tarfile
-            if magic[0:5] == b'\xFD7zXZ' or magic[0:5] == b']\x00\x00\x80\x00':
-                return constants.XZ
+    if size > 0:
+        if magic.startswith(b'BZh'):
+            if _is_tar_header(_decompress_header(fp, header, bz2.BZ2Decompressor())):
+                return constants.BZIP2
+        elif magic.startswith(b'\037\213'):
+            if _is_tar_header(_decompress_header(fp, header, zlib.decompressobj(16 + zlib.MAX_WBITS))):
+                return constants.GZIP
+        elif _is_tar_header(header):
+            return constants.TAR
 
-            if magic[2:4] == b'-l':
-                return constants.LHA
+    if magic[0:4] == b'Rar!':
+        return constants.RAR
 
-            if magic[0:4] == b'%PDF':
-                return constants.PDF
+    if magic[0:4] == b'7z\xBC\xAF':
+        return constants.SEVENZIP
 
-    except Exception:
-        log.warning(_('! Could not read %s'), path)
+    # Headers for TAR-XZ and TAR-LZMA that aren't supported by tarfile
+    if magic[0:5] == b'\xFD7zXZ' or magic[0:5] == b']\x00\x00\x80\x00':
+        return constants.XZ
+
+    if magic[2:4] == b'-l':
+        return constants.LHA
+
+    if magic[0:4] == b'%PDF':
+        return constants.PDF
 
     return None
 
+def _sniff_zip(fp, size):
+    """Return ZIP or ZIP_EXTERNAL if <fp> is a ZIP file, depending on
+    whether all its members use a compression supported by zipfile.
+    """
+    if size < _ZIP_EOCD.size:
+        return None
+    # Look for the end of central directory record, which is followed by
+    # the archive comment (at most 65535 bytes). Try without comment first.
+    for tail_size in (_ZIP_EOCD.size, _ZIP_EOCD.size + 0xFFFF):
+        tail_size = min(tail_size, size)
+        fp.seek(size - tail_size)
+        tail = fp.read(tail_size)
+        pos = tail.rfind(_ZIP_EOCD_MAGIC)
+        if pos != -1 and len(tail) - pos >= _ZIP_EOCD.size:
+            break
+        if tail_size == size:
+            return None
+    else:
+        return None
+    (magic, disk, cd_disk, disk_entries, total_entries,
+     cd_size, cd_offset, comment_size) = _ZIP_EOCD.unpack_from(tail, pos)
+    if 0xFFFFFFFF in (cd_size, cd_offset) or 0xFFFF == total_entries:
+        # ZIP64 archive, let zipfile handle it.
+        return _zip_type_from_zipfile(fp)
+    # Data may have been prepended to the archive (e.g. self-extracting
+    # archives), so locate the central directory from the record position.
+    cd_start = size - len(tail) + pos - cd_size
+    if cd_start < 0:
+        return None
+    fp.seek(cd_start)
+    central_directory = fp.read(cd_size)
+    if len(central_directory) != cd_size:
+        return None
+    offset = 0
+    for n in range(total_entries):
+        if offset + _ZIP_CENTRAL_DIRECTORY.size > cd_size:
+            return None
+        fields = _ZIP_CENTRAL_DIRECTORY.unpack_from(central_directory, offset)
+        if fields[0] != _ZIP_CENTRAL_DIRECTORY_MAGIC:
+            return None
+        compress_type = fields[4]
+        if compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            return constants.ZIP_EXTERNAL
+        name_size, extra_size, comment_size = fields[10:13]
+        offset += _ZIP_CENTRAL_DIRECTORY.size + name_size + extra_size + comment_size
+    return constants.ZIP
+
+def _zip_type_from_zipfile(fp):
+    fp.seek(0)
+    try:
+        with zipfile.ZipFile(fp, 'r') as zip_file:
+            for file_info in zip_file.infolist():
+                if file_info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                    return constants.ZIP_EXTERNAL
+    except zipfile.BadZipfile:
+        return None
+    return constants.ZIP
+
+def _decompress_header(fp, header, decompressor):
+    """Return the first block of the decompressed contents of <fp>, whose
+    start is <header>, using <decompressor>.
+    """
+    data = header
+    output = b''
+    read_size = len(header)
+    try:
+        while True:
+            output += decompressor.decompress(data)
+            if len(output) >= _HEADER_BLOCK_SIZE:
+                break
+            if read_size >= _MAX_COMPRESSED_HEADER_SIZE:
+                break
+            data = fp.read(64 * 1024)
+            if not data:
+                break
+            read_size += len(data)
+    except (IOError, EOFError, zlib.error):
+        pass
+    return output[:_HEADER_BLOCK_SIZE]
+
+def _is_tar_header(block):
+    """Return True if <block> is a valid tar header."""
+    if len(block) < _HEADER_BLOCK_SIZE:
+        return False
+    try:
+        tarfile.TarInfo.frombuf(block, tarfile.ENCODING, 'surrogateescape')
+    except tarfile.HeaderError:
+        return False
+    return True
+
 def get_archive_info(path):
     """Return a tuple (mime, num_pages, size) with info about the archive
     at <path>, or None if <path> doesn't point to a supported
     """
+    mime = archive_mime_type(path)
+    if mime is None:
+        return None
+    handler = _get_handler(mime)
+    if handler is None:
+        return None
+    toc = archive_toc.load(path, handler.get_handler_name())
+    if toc is not None:
+        num_pages = len(list(filter(image_tools.is_image_file, toc['files'])))
+        return (mime, num_pages, os.stat(path).st_size)
+
     cleanup = []
     try:
         tmpdir = tempfile.mkdtemp(prefix='mcomix_archive_info.')
         cleanup.append(lambda: shutil.rmtree(tmpdir, True))
 
-        mime = archive_mime_type(path)
         archive = get_recursive_archive_handler(path, tmpdir, type=mime)
         if archive is None:
             return None
         cleanup.append(archive.close)
 
         files = archive.list_contents()
+        if files:
+            archive_toc.save(path, handler.get_handler_name(),
+                             archive_toc.create(archive, files))
         num_pages = len(list(filter(image_tools.is_image_file, files)))
         size = os.stat(path).st_size
 
@@ -35,7 +35,8 @@ class Clipboard(object):
                         current_page_pixbufs[ 1 ],
                         self._window.is_manga_mode )
 
-            path = self._window.imagehandler.get_path_to_page()
+            path = self._window.filehandler.ensure_on_disk(
+                self._window.imagehandler.get_path_to_page())
             self.copy(path, pixbuf)
 
 # vim: expandtab:sw=4:ts=4
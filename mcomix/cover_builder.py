@@ -0,0 +1,135 @@
+""" cover_builder.py - Create library covers without the user interface.
+
+Library covers are normally created one at a time, when they are first
+shown in the library window. This module creates them in advance for many
+books at once, in a pool of worker processes, so that it can for instance
+run periodically on a file server. Books whose cover is up to date are
+skipped, so an interrupted run simply resumes where it stopped.
+"""
+
+import concurrent.futures
+import concurrent.futures.process
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+from mcomix import archive_tools
+from mcomix import i18n
+from mcomix import log
+from mcomix import preferences
+
+#: Results of _build_cover().
+CREATED, SKIPPED, FAILED = 'created', 'skipped', 'failed'
+
+def build_covers(paths=None, processes=None, out=sys.stdout):
+    """Create the library covers of the books in <paths>, a list of book
+    files or directories searched recursively, or of all the books in the
+    library if <paths> is None. Covers are created by <processes> worker
+    processes, one per CPU core by default. Progress and statistics are
+    written to <out>. Returns the number of books whose cover could not be
+    created.
+    """
+    if paths is None:
+        books = _get_library_books()
+    else:
+        books = _find_books(paths)
+    total = len(books)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    counts = {CREATED: 0, SKIPPED: 0, FAILED: 0}
+    start = time.monotonic()
+    # Do not fork: the image libraries are not fork safe once initialized.
+    context = multiprocessing.get_context('spawn')
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=processes, mp_context=context,
+            initializer=_init_worker) as executor:
+            futures = [executor.submit(_build_cover, path) for path in books]
+            try:
+                for done, future in enumerate(
+                    concurrent.futures.as_completed(futures), start=1):
+                    path, result = future.result()
+                    counts[result] += 1
+                    if result != SKIPPED:
+                        out.write('[%u/%u] %s: %s\n' % (done, total, result, path))
+                        out.flush()
+            except KeyboardInterrupt:
+                for future in futures:
+                    future.cancel()
+                out.write(_('Interrupted, covers created so far are kept.') + '\n')
+            except concurrent.futures.process.BrokenProcessPool as e:
+                # A worker process died, for instance killed or crashed while
+                # decoding an image: the pool cannot be used any more.
+                log.error(_('! A worker process terminated abruptly: %s'), e)
+                out.write(_('Stopped, covers created so far are kept.') + '\n')
+                # _build_cover() handles its own errors, only the books left
+                # in the dead pool have one.
+                counts[FAILED] += sum(1 for future in futures
+                                      if future.done() and not future.cancelled()
+                                      and future.exception() is not None)
+    finally:
+        elapsed = time.monotonic() - start
+        out.write(_('%(created)u covers created, %(skipped)u up to date, '
+                    '%(failed)u failed, in %(elapsed).1f s (%(rate).1f covers/s).')
+                  % {'created': counts[CREATED], 'skipped': counts[SKIPPED],
+                     'failed': counts[FAILED], 'elapsed': elapsed,
+                     'rate': counts[CREATED] / elapsed if elapsed > 0 else 0.0}
+                  + '\n')
+    return counts[FAILED]
+
+def _get_library_books():
+    """Return the paths of all the books in the library."""
+    # XXX: Deferred import, the library requires GdkPixbuf.
+    from mcomix.library import backend
+    library = backend.LibraryBackend()
+    paths = []
+    for book in library.get_books_in_collection():
+        path = library.get_book_path(book)
+        if path is not None:
+            paths.append(path)
+    library.close()
+    return paths
+
+def _find_books(paths):
+    """Return the archives in <paths>, see build_covers()."""
+    books = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if archive_tools.is_archive_file(filename):
+                        books.append(os.path.join(dirpath, filename))
+        elif os.path.isfile(path):
+            books.append(path)
+        else:
+            log.warning(_('! Could not open %s: No such file.'), path)
+    return books
+
+def _init_worker():
+    # Ctrl-C is sent to the whole process group: leave it to the main
+    # process, which stops the pool and prints the summary.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    preferences.read_preferences_file()
+    i18n.install_gettext()
+
+def _build_cover(path):
+    """Create the cover of the book at <path>, unless it is up to date, in
+    a worker process. Returns (path, result)."""
+    # XXX: Deferred import, only the worker processes need GdkPixbuf.
+    from mcomix.library import backend
+    thumbnailer = backend.get_cover_thumbnailer()
+    try:
+        if thumbnailer.is_up_to_date(path):
+            return path, SKIPPED
+        thumbnailer.force_recreation = True
+        pixbuf = thumbnailer.thumbnail(path)
+    except Exception as ex:
+        log.error(_('! Could not get cover for book "%s"'), path)
+        log.error(ex)
+        pixbuf = None
+    return path, CREATED if pixbuf is not None else FAILED
+
+# vim: expandtab:sw=4:ts=4
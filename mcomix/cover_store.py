@@ -0,0 +1,99 @@
+""" cover_store.py - Library covers packed in a single database.
+
+Storing one PNG per book makes opening a large library cost thousands of
+small file operations. When the 'packed library covers' preference is set,
+library covers are instead stored as PNG encoded blobs in one SQLite
+table, keyed by the path of their book, so that getting a cover is a single
+indexed read.
+"""
+
+import os
+
+from mcomix import constants
+from mcomix import log
+from mcomix import sqlite_cache
+
+#: Bumped whenever the format of the store changes.
+STORE_VERSION = 1
+
+_store = sqlite_cache.SQLiteCache(
+    'cover store', lambda: constants.LIBRARY_COVER_STORE_PATH, 'Cover',
+    '''create table Cover (
+        path text primary key,
+        mtime integer,
+        width integer,
+        height integer,
+        data blob)''', STORE_VERSION)
+
+def load(path):
+    """Return (mtime, width, height, data) for the cover of the book at
+    <path>, where <data> is the cover encoded as PNG and <mtime> the
+    modification time of the book when the cover was created, or None if
+    no cover is stored.
+    """
+    with _store.connection() as connection:
+        if connection is None:
+            return None
+        row = connection.execute('''select mtime, width, height, data
+            from Cover where path = ?''', (_get_key(path),)).fetchone()
+    if row is None:
+        return None
+    mtime, width, height, data = row
+    return mtime, width, height, bytes(data)
+
+def save(path, mtime, width, height, data):
+    """Store <data>, the cover of the book at <path> encoded as PNG, of
+    <width> by <height> pixels, see load()."""
+    with _store.connection() as connection:
+        if connection is None:
+            return
+        try:
+            with connection:
+                connection.execute('''insert or replace into Cover
+                    (path, mtime, width, height, data)
+                    values (?, ?, ?, ?, ?)''',
+                    (_get_key(path), int(mtime), width, height,
+                     sqlite_cache.dbapi2.Binary(data)))
+        except sqlite_cache.dbapi2.Error as e:
+            log.warning('Could not store cover of "%s": %s', path, e)
+
+def remove(path):
+    """Remove the cover of the book at <path>, if any."""
+    with _store.connection() as connection:
+        if connection is None:
+            return
+        try:
+            with connection:
+                connection.execute('delete from Cover where path = ?',
+                                   (_get_key(path),))
+        except sqlite_cache.dbapi2.Error as e:
+            log.warning('Could not remove cover of "%s": %s', path, e)
+
+def compact():
+    """Remove the covers of books that no longer exist, and give the space
+    they used back to the file system. Returns the number of removed
+    covers."""
+    with _store.connection() as connection:
+        if connection is None:
+            return 0
+        paths = [row[0] for row in connection.execute('select path from Cover')]
+        missing = [(path,) for path in paths if not os.path.isfile(path)]
+        try:
+            with connection:
+                connection.executemany('delete from Cover where path = ?',
+                                       missing)
+            connection.execute('vacuum')
+        except sqlite_cache.dbapi2.Error as e:
+            log.warning('Could not compact cover store: %s', e)
+            return 0
+    log.debug('Removed %d covers from the cover store', len(missing))
+    return len(missing)
+
+def close():
+    """Close the store, it is opened again when needed."""
+    _store.close()
+
+def _get_key(path):
+    return os.path.abspath(path)
+
+# vim: expandtab:sw=4:ts=4
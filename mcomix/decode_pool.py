@@ -0,0 +1,146 @@
+""" decode_pool.py - Decode images with PIL in worker processes.
+
+Decoding with PIL holds the GIL for most of the work, so decoding threads
+barely scale. When enabled, images are instead decoded (and downscaled)
+by a pool of worker processes. Image data is handed to them, and the
+pixels back, in shared memory blocks rather than pickled through a pipe:
+each side still copies the data once into or out of a block. This module
+must not depend on GTK, since it is imported by the worker processes.
+"""
+
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+from io import BytesIO
+from multiprocessing import shared_memory
+
+# Only imported to register the JPEG XL plugin with PIL.
+import jxlpy.JXLImagePlugin  # noqa: F401
+from PIL import Image
+
+from mcomix.preferences import prefs
+from mcomix import log
+
+# kill zip bomb warnings from PIL
+Image.MAX_IMAGE_PIXELS = None
+
+_executor = None
+_lock = threading.Lock()
+
+
+class DecodedImage(object):
+
+    """ Pixels of an image decoded by a worker process, stored in a shared
+    memory block until close() is called. """
+
+    def __init__(self, name, mode, size, orientation, icc_profile):
+        self._shm = shared_memory.SharedMemory(name=name)
+        #: 'RGB' or 'RGBA'
+        self.mode = mode
+        #: (width, height)
+        self.size = size
+        #: Exif orientation tag, as a string, or None
+        self.orientation = orientation
+        #: Embedded ICC profile, or None
+        self.icc_profile = icc_profile
+
+    def get_rowstride(self):
+        return len(self.mode) * self.size[0]
+
+    def get_buffer(self):
+        """ Return a memoryview of the pixels, only valid until close(). """
+        return self._shm.buf[:self.get_rowstride() * self.size[1]]
+
+    def close(self):
+        """ Release the shared memory block. """
+        self._shm.close()
+        self._shm.unlink()
+
+
+def is_enabled():
+    """ Return True if images should be decoded by worker processes. """
+    return prefs['decode in worker processes']
+
+def decode(source, size=None):
+    """ Decode the image <source>, either a path or the image data, in a
+    worker process, and return a DecodedImage. If <size> is not None, the
+    image is scaled down to fit inside this (width, height) tuple.
+
+    The caller is responsible for closing the result.
+    """
+    if isinstance(source, str):
+        return DecodedImage(*_get_executor().submit(_decode, source, size).result())
+    data = memoryview(source).cast('B')
+    shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    try:
+        shm.buf[:len(data)] = data
+        result = _get_executor().submit(_decode, (shm.name, len(data)), size).result()
+    finally:
+        shm.close()
+        shm.unlink()
+    return DecodedImage(*result)
+
+def shutdown():
+    """ Stop the worker processes, if they were started. """
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            # Do not fork: the parent process runs GTK and many threads.
+            context = multiprocessing.get_context('spawn')
+            _executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1, mp_context=context)
+            log.debug('Started image decoding processes')
+        return _executor
+
+def _decode(source, size):
+    """ Decode <source> in a worker process, see decode(), where image
+    data is given as the (name, length) of a shared memory block. Return
+    the arguments of DecodedImage. """
+    if isinstance(source, str):
+        im = Image.open(source)
+    else:
+        name, length = source
+        shm = shared_memory.SharedMemory(name=name)
+        view = shm.buf[:length]
+        try:
+            # BytesIO copies the data, so the block is not needed after.
+            im = Image.open(BytesIO(view))
+        finally:
+            view.release()
+            shm.close()
+    orientation = im.getexif().get(274, None) # Orientation tag
+    if orientation is not None:
+        orientation = str(orientation)
+    icc_profile = im.info.get('icc_profile')
+    if size is not None:
+        im.draft(None, size)
+        if im.size[0] > size[0] or im.size[1] > size[1]:
+            im.thumbnail(size, Image.BILINEAR)
+    # Same rules as image_tools.pil_to_pixbuf.
+    if im.mode.startswith('RGB'):
+        has_alpha = im.mode == 'RGBA'
+    else:
+        has_alpha = im.mode in ('LA', 'P')
+    mode = 'RGBA' if has_alpha else 'RGB'
+    if im.mode != mode:
+        im = im.convert(mode)
+    data = im.tobytes()
+    shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    try:
+        shm.buf[:len(data)] = data
+        return shm.name, mode, im.size, orientation, icc_profile
+    except Exception:
+        shm.unlink()
+        raise
+    finally:
+        shm.close()
+
+# vim: expandtab:sw=4:ts=4
@@ -88,6 +88,9 @@ class _EditArchiveDialog(Gtk.Dialog):
 
         image_files = self._image_area.get_file_listing()
         comment_files = self._comment_area.get_file_listing()
+        # Files kept in memory by the extractor must be written out first.
+        for path in image_files + comment_files:
+            self._window.filehandler.ensure_on_disk(path)
 
         try:
             fd, tmp_path = tempfile.mkstemp(
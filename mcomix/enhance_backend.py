@@ -5,6 +5,9 @@ brightness etc.)
 from mcomix.preferences import prefs
 from mcomix import image_tools
 
+#: Enhancement values that leave images unchanged, see get_values().
+NEUTRAL_VALUES = (1.0, 1.0, 1.0, 1.0, False)
+
 class ImageEnhancer(object):
 
     """The ImageEnhancer keeps track of the "enhancement" values and performs
@@ -20,15 +23,24 @@ class ImageEnhancer(object):
         self.sharpness = prefs['sharpness']
         self.autocontrast = prefs['auto contrast']
 
-    def enhance(self, pixbuf):
-        """Return an "enhanced" version of <pixbuf>."""
+    def get_values(self):
+        """Return the current enhancement values as a tuple
+        (brightness, contrast, saturation, sharpness, autocontrast).
+        """
+        return (self.brightness, self.contrast, self.saturation,
+                self.sharpness, self.autocontrast)
 
-        if (self.brightness != 1.0 or self.contrast != 1.0 or
-          self.saturation != 1.0 or self.sharpness != 1.0 or
-          self.autocontrast):
+    def enhance(self, pixbuf, values=None):
+        """Return an "enhanced" version of <pixbuf>. If <values> is not
+        None, it is used instead of the current values, see get_values().
+        """
+        if values is None:
+            values = self.get_values()
+        brightness, contrast, saturation, sharpness, autocontrast = values
 
-            return image_tools.enhance(pixbuf, self.brightness, self.contrast,
-                self.saturation, self.sharpness, self.autocontrast)
+        if tuple(values) != NEUTRAL_VALUES:
+            return image_tools.enhance(pixbuf, brightness, contrast,
+                saturation, sharpness, autocontrast)
 
         return pixbuf
 
@@ -5,9 +5,13 @@ from . import histogram
 
 from mcomix.preferences import prefs
 from mcomix import image_tools
+from mcomix.lru_cache import LRUCache
 
 _dialog = None
 
+#: Number of page histograms to keep.
+HISTOGRAM_CACHE_PAGES = 32
+
 class _EnhanceImageDialog(Gtk.Dialog):
 
     """A Gtk.Dialog which allows modification of the values belonging to
@@ -33,6 +37,8 @@ class _EnhanceImageDialog(Gtk.Dialog):
 
         self._enhancer = window.enhancer
         self._block = False
+        #: Histograms of the current book, from page number > pixbuf
+        self._histograms = LRUCache(HISTOGRAM_CACHE_PAGES, sizeof=lambda pixbuf: 1)
 
         vbox = Gtk.VBox(False, 10)
         self.set_border_width(4)
@@ -99,15 +105,22 @@ class _EnhanceImageDialog(Gtk.Dialog):
         self.show_all()
 
     def _on_book_close(self):
+        self._histograms.clear()
         self.clear_histogram()
 
     def _on_page_change(self):
         if not self._window.imagehandler.page_is_available():
             self.clear_histogram()
             return
-        # XXX transitional(double page limitation)
-        pixbuf = self._window.imagehandler.get_pixbufs(1)[0]
-        self.draw_histogram(pixbuf)
+        page = self._window.imagehandler.get_current_page()
+        histogram_pixbuf = self._histograms.get(page)
+        if histogram_pixbuf is None:
+            # XXX transitional(double page limitation)
+            pixbuf = self._window.imagehandler.get_pixbufs(1)[0]
+            histogram_pixbuf = self.draw_histogram(pixbuf)
+            self._histograms.put(page, histogram_pixbuf)
+        else:
+            self._hist_image.set_from_pixbuf(histogram_pixbuf)
 
     def _on_page_available(self, page_number):
         current_page_number = self._window.imagehandler.get_current_page()
@@ -119,6 +132,7 @@ class _EnhanceImageDialog(Gtk.Dialog):
         pixbuf = image_tools.static_image(pixbuf)
         histogram_pixbuf = histogram.draw_histogram(pixbuf, text=False)
         self._hist_image.set_from_pixbuf(histogram_pixbuf)
+        return histogram_pixbuf
 
     def clear_histogram(self):
         """Clear the histogram in the dialog."""
@@ -31,6 +31,7 @@ class EventHandler(object):
         size = (event.width, event.height)
         if size != self._window.previous_size:
             self._window.previous_size = size
+            self._window.imagehandler.invalidate_prescaled()
             self._window.draw_image()
 
     def window_state_event(self, widget, event):
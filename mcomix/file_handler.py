@@ -4,7 +4,6 @@
 import os
 import shutil
 import tempfile
-import threading
 import re
 import pickle
 from gi.repository import Gtk
@@ -19,6 +18,7 @@ from mcomix import file_provider
 from mcomix import callback
 from mcomix import log
 from mcomix import last_read_page
+from mcomix import worker_thread
 from mcomix import message_dialog
 from mcomix.library import backend
 
@@ -408,7 +408,7 @@ class FileHandler(object):
         """
         self._wait_on_comment(num)
         try:
-            fd = open(self._comment_files[num - 1], 'r')
+            fd = open(self.ensure_on_disk(self._comment_files[num - 1]), 'r')
             text = fd.read()
             fd.close()
         except Exception:
@@ -568,6 +568,34 @@ class FileHandler(object):
         else:
             return False
 
+    def get_file_data(self, filepath):
+        """ Returns the contents of the file specified by "filepath" if it
+        was extracted to memory instead of disk, None otherwise. """
+
+        if self.archive_type is None or filepath is None:
+            return None
+
+        name = self._name_table.get(filepath)
+        if name is None:
+            return None
+        return self._extractor.get_data(name)
+
+    def ensure_on_disk(self, filepath):
+        """ Makes sure the file specified by "filepath" exists on disk,
+        writing it out if it was only extracted to memory. Returns
+        "filepath". """
+
+        if self.archive_type is None or filepath is None:
+            return filepath
+
+        name = self._name_table.get(filepath)
+        if name is not None:
+            try:
+                self._extractor.write_to_disk(name)
+            except Exception as ex:
+                log.error('Writing "%s" to disk failed: %s', filepath, ex)
+        return filepath
+
     @callback.Callback
     def file_available(self, filepaths):
         """ Called every time a new file from the Filehandler's opened
@@ -627,10 +655,7 @@ class FileHandler(object):
         """Start a threaded removal of the directory tree rooted at <path>.
         This is to avoid long blockings when removing large temporary dirs.
         """
-        del_thread = threading.Thread(target=shutil.rmtree, args=(path, True))
-        del_thread.name += '-delete'
-        del_thread.setDaemon(False)
-        del_thread.start()
+        worker_thread.submit(worker_thread.MAINTENANCE, shutil.rmtree, path, True)
 
     def write_fileinfo_file(self):
         """Write current open file information."""
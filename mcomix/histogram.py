@@ -1,13 +1,19 @@
 """histogram.py - Draw histograms (RGB) from pixbufs."""
 
+from gi.repository import GdkPixbuf
 import PIL.Image as Image
 import jxlpy
 import jxlpy.JXLImagePlugin
+import PIL.ImageChops as ImageChops
 import PIL.ImageDraw as ImageDraw
 import PIL.ImageOps as ImageOps
 
 from mcomix import image_tools
 
+#: Larger pixbufs are sampled down to fit in a square of this size
+#: before computing their histogram.
+SAMPLE_SIZE = 512
+
 def draw_histogram(pixbuf, height=170, fill=170, text=True):
     """Draw a histogram from <pixbuf> and return it as another pixbuf.
 
@@ -18,44 +24,57 @@ def draw_histogram(pixbuf, height=170, fill=170, text=True):
 
     If <text> is True a label with the maximum pixel value will be added to
     one corner.
+
+    Pixbufs larger than SAMPLE_SIZE are sampled down first. The shape of
+    the histogram is the same, and the maximum in the label is scaled
+    back up to the number of pixels of <pixbuf>.
     """
-    im = Image.new('RGB', (258, height - 4), (30, 30, 30))
-    hist_data = image_tools.pixbuf_to_pil(pixbuf).histogram()
+    size = (258, height - 4)
+    sample = _sample(pixbuf)
+    hist_data = image_tools.pixbuf_to_pil(sample).histogram()
     maximum = max(hist_data[:768] + [1])
     y_scale = float(height - 6) / maximum
     r = [int(hist_data[n] * y_scale) for n in range(256)]
     g = [int(hist_data[n] * y_scale) for n in range(256, 512)]
     b = [int(hist_data[n] * y_scale) for n in range(512, 768)]
-    im_data = im.getdata()
-    # Draw the filling colours
-    for x in range(256):
-        for y in range(1, max(r[x], g[x], b[x]) + 1):
-            r_px = y <= r[x] and fill or 0
-            g_px = y <= g[x] and fill or 0
-            b_px = y <= b[x] and fill or 0
-            im_data.putpixel((x + 1, height - 5 - y), (r_px, g_px, b_px))
+    # Bottom row of the graphs, for a value of 1.
+    bottom = height - 6
+
+    def draw_columns(values, colour):
+        # Column x + 1 is filled from the bottom up to values[x].
+        im = Image.new('L', size, 0)
+        draw = ImageDraw.Draw(im)
+        for x, value in enumerate(values):
+            if value > 0:
+                draw.line((x + 1, bottom - value + 1, x + 1, bottom), fill=colour)
+        return im
+
+    def draw_outline(values):
+        # The outline follows the top of the columns, with vertical
+        # segments joining columns of different heights.
+        im = Image.new('L', size, 0)
+        draw = ImageDraw.Draw(im)
+        for x in range(1, 256):
+            previous, value = values[x - 1], values[x]
+            if value > 0:
+                low = min(previous + 1, value)
+                draw.line((x + 1, bottom - value + 1, x + 1, bottom - low + 1), fill=255)
+            if previous > value:
+                draw.line((x, bottom - previous + 1, x, bottom - value), fill=255)
+        return im
+
+    # Draw the filling colours, over the background.
+    filled = Image.merge('RGB', [draw_columns(values, fill) for values in (r, g, b)])
+    covered = draw_columns([max(values) for values in zip(r, g, b)], 255)
+    im = Image.composite(filled, Image.new('RGB', size, (30, 30, 30)), covered)
     # Draw the outlines
-    for x in range(1, 256):
-        for y in list(range(r[x-1] + 1, r[x] + 1)) + [r[x]] * (r[x] != 0):
-            r_px, g_px, b_px = im_data.getpixel((x + 1, height - 5 - y))
-            im_data.putpixel((x + 1, height - 5 - y), (255, g_px, b_px))
-        for y in range(r[x] + 1, r[x-1] + 1):
-            r_px, g_px, b_px = im_data.getpixel((x, height - 5 - y))
-            im_data.putpixel((x, height - 5 - y), (255, g_px, b_px))
-        for y in list(range(g[x-1] + 1, g[x] + 1)) + [g[x]] * (g[x] != 0):
-            r_px, g_px, b_px = im_data.getpixel((x + 1, height - 5 - y))
-            im_data.putpixel((x + 1, height - 5 - y), (r_px, 255, b_px))
-        for y in range(g[x] + 1, g[x-1] + 1):
-            r_px, g_px, b_px = im_data.getpixel((x, height - 5 - y))
-            im_data.putpixel((x, height - 5 - y), (r_px, 255, b_px))
-        for y in list(range(b[x-1] + 1, b[x] + 1)) + [b[x]] * (b[x] != 0):
-            r_px, g_px, b_px = im_data.getpixel((x + 1, height - 5 - y))
-            im_data.putpixel((x + 1, height - 5 - y), (r_px, g_px, 255))
-        for y in range(b[x] + 1, b[x-1] + 1):
-            r_px, g_px, b_px = im_data.getpixel((x, height - 5 - y))
-            im_data.putpixel((x, height - 5 - y), (r_px, g_px, 255))
+    im = Image.merge('RGB', [ImageChops.lighter(band, draw_outline(values))
+                             for band, values in zip(im.split(), (r, g, b))])
     if text:
-        maxstr = 'max: ' + str(maximum)
+        # Each pixel of the sample stands for this many pixels of <pixbuf>.
+        ratio = (float(pixbuf.get_width() * pixbuf.get_height()) /
+                 (sample.get_width() * sample.get_height()))
+        maxstr = 'max: ' + str(int(round(maximum * ratio)))
         draw = ImageDraw.Draw(im)
         draw.rectangle((0, 0, len(maxstr) * 6 + 2, 10), fill=(30, 30, 30))
         draw.text((2, 0), maxstr, fill=(255, 255, 255))
@@ -63,5 +82,15 @@ def draw_histogram(pixbuf, height=170, fill=170, text=True):
     im = ImageOps.expand(im, 1, (0, 0, 0))
     return image_tools.pil_to_pixbuf(im)
 
+def _sample(pixbuf):
+    """Return <pixbuf>, or a copy fitting in SAMPLE_SIZE if larger."""
+    width, height = pixbuf.get_width(), pixbuf.get_height()
+    if width <= SAMPLE_SIZE and height <= SAMPLE_SIZE:
+        return pixbuf
+    width, height = image_tools.get_fitting_size((width, height),
+                                                 (SAMPLE_SIZE, SAMPLE_SIZE))
+    # Sampling keeps the original colours, unlike interpolation.
+    return pixbuf.scale_simple(width, height, GdkPixbuf.InterpType.NEAREST)
+
 
 # vim: expandtab:sw=4:ts=4
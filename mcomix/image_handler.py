@@ -1,18 +1,25 @@
 """image_handler.py - Image handler that takes care of cacheing and giving out images."""
 
 import os
+import threading
 import traceback
 
 from mcomix.preferences import prefs
 from mcomix import i18n
 from mcomix import tools
 from mcomix import image_tools
+from mcomix import enhance_backend
 from mcomix import thumbnail_tools
 from mcomix import constants
 from mcomix import callback
 from mcomix import log
+from mcomix.lru_cache import LRUCache
+from mcomix import worker_thread
 from mcomix.worker_thread import WorkerThread
 
+#: Memory budget for the smart background edge strips, in bytes.
+EDGE_CACHE_SIZE = 16 * 1024 * 1024
+
 class ImageHandler(object):
 
     """The FileHandler keeps track of images, pages, caches and reads files.
@@ -31,9 +38,17 @@ class ImageHandler(object):
         #: Reference to main window
         self._window = window
 
-        #: Caching thread
+        #: Caching threads
         self._thread = WorkerThread(self._cache_pixbuf, name='image',
-                                    sort_orders=True)
+                                    max_threads=self._get_decode_threads(),
+                                    sort_orders=True,
+                                    priority_class=worker_thread.VISIBLE)
+        #: Pre-scaling threads
+        self._prescale_thread = WorkerThread(self._prescale_pixbuf,
+                                             name='prescale',
+                                             max_threads=self._get_decode_threads(),
+                                             sort_orders=True,
+                                             priority_class=worker_thread.PREFETCH)
 
         #: Archive path, if currently opened file is archive
         self._base_path = None
@@ -45,10 +60,21 @@ class ImageHandler(object):
         self._available_images = set()
         #: List of pixbufs we want to cache
         self._wanted_pixbufs = []
-        #: Pixbuf map from page > Pixbuf
-        self._raw_pixbufs = {}
+        #: Pixbuf cache from page index > Pixbuf, bounded by decoded size
+        self._raw_pixbufs = LRUCache(self._get_cache_size(),
+                                     sizeof=image_tools.get_pixbuf_byte_size)
+        #: Display-ready pixbufs, see get_display_pixbuf
+        self._display_pixbufs = LRUCache(self._get_display_cache_size(),
+                                         sizeof=image_tools.get_pixbuf_byte_size)
+        #: Edge strips used for the smart background, from
+        #: (page index, side) > RGB PIL image
+        self._edge_images = LRUCache(EDGE_CACHE_SIZE,
+                                     sizeof=lambda im: im.size[0] * im.size[1] * 3)
         #: How many pages to keep in cache
         self._cache_pages = prefs['max pages to cache']
+        #: Map page index > Event for pages currently being decoded
+        self._decoding = {}
+        self._decoding_lock = threading.Lock()
 
         self._window.filehandler.file_available += self._file_available
 
@@ -56,26 +82,56 @@ class ImageHandler(object):
         """Return the pixbuf indexed by <index> from cache.
         Pixbufs not found in cache are fetched from disk first.
         """
-        pixbuf = image_tools.MISSING_IMAGE_ICON
+        while True:
+            pixbuf = self._raw_pixbufs.get(index)
+            if pixbuf is not None:
+                return pixbuf
+            with self._decoding_lock:
+                decoding = self._decoding.get(index)
+                if decoding is None:
+                    decoding = self._decoding[index] = threading.Event()
+                    break
+            # Another thread is already decoding this page, wait for it.
+            decoding.wait()
 
-        if index not in self._raw_pixbufs:
+        try:
             self._wait_on_page(index + 1)
 
             try:
-                pixbuf = image_tools.load_pixbuf(self._image_files[index])
-                self._raw_pixbufs[index] = pixbuf
+                path = self._image_files[index]
+                data = self._window.filehandler.get_file_data(path)
+                if data is not None:
+                    pixbuf = image_tools.load_pixbuf_data(data)
+                else:
+                    pixbuf = image_tools.load_pixbuf(path)
+                if prefs['color manage on decode']:
+                    pixbuf = image_tools.color_manage(pixbuf)
                 tools.garbage_collect()
             except Exception as e:
-                self._raw_pixbufs[index] = image_tools.MISSING_IMAGE_ICON
+                pixbuf = image_tools.MISSING_IMAGE_ICON
                 log.error('Could not load pixbuf for page %u: %r', index + 1, e)
-        else:
-            try:
-                pixbuf = self._raw_pixbufs[index]
-            except Exception:
-                pass
+            self._raw_pixbufs.put(index, pixbuf)
+        finally:
+            with self._decoding_lock:
+                del self._decoding[index]
+            decoding.set()
 
         return pixbuf
 
+    def get_cached_pixbufs(self, index, number_of_bufs):
+        """Return the <number_of_bufs> pixbufs starting at page <index>
+        if all of them are already decoded, None otherwise. Never blocks.
+        """
+        if index < 0 or index + number_of_bufs > self.get_number_of_pages():
+            return None
+        result = []
+        for i in range(index, index + number_of_bufs):
+            pixbuf = self._raw_pixbufs.get(i) if i in self._raw_pixbufs else None
+            if pixbuf is None:
+                return None
+            result.append(pixbuf)
+        return result
+
     def get_pixbufs(self, number_of_bufs):
         """Returns number_of_bufs pixbufs for the image(s) that should be
         currently displayed. This method might fetch images from disk, so make
@@ -86,43 +142,148 @@ class ImageHandler(object):
             result.append(self._get_pixbuf(self._current_image_index + i))
         return result
 
+    def get_display_pixbuf(self, index, pixbuf, size, rotation):
+        """Return <pixbuf>, the raw pixbuf for page <index>, scaled to
+        <size>, rotated by <rotation>, then flipped and enhanced according to
+        the current settings. Results are cached, so redrawing a page with
+        unchanged settings does not scale it again.
+        """
+        key = self._get_display_key(index, size, rotation)
+        display_pixbuf = self._display_pixbufs.get(key)
+        if display_pixbuf is None:
+            display_pixbuf = self._render_display_pixbuf(pixbuf, key)
+            self._display_pixbufs.put(key, display_pixbuf)
+        return display_pixbuf
+
+    def prescale(self, pages):
+        """Prepare display-ready pixbufs in the background. <pages> is a
+        list of (index, size, rotation) tuples, in order of priority, as
+        they would be passed to get_display_pixbuf. Pending orders from
+        a previous call are cancelled.
+        """
+        self._prescale_thread.clear_orders()
+        orders = []
+        for index, size, rotation in pages:
+            key = self._get_display_key(index, size, rotation)
+            if key not in self._display_pixbufs:
+                orders.append((len(orders), key))
+        if len(orders) > 0:
+            self._prescale_thread.set_max_threads(self._get_decode_threads())
+            self._prescale_thread.extend_orders(orders)
+
+    def invalidate_prescaled(self):
+        """Cancel pending pre-scaling orders and drop display-ready
+        pixbufs, e.g. because the viewport size or zoom changed.
+        """
+        self._prescale_thread.clear_orders()
+        self._display_pixbufs.clear()
+
+    def invalidate_color_managed(self):
+        """Drop the pages converted to the display profile with other
+        settings than the current ones, and decode them again if needed.
+        """
+        for index in self._raw_pixbufs.keys():
+            pixbuf = self._raw_pixbufs.peek(index)
+            if pixbuf is not None and \
+               not image_tools.is_color_managed_for_display(pixbuf):
+                self._raw_pixbufs.pop(index)
+        self._edge_images.clear()
+        self.invalidate_prescaled()
+        self.do_cacheing()
+
+    def _prescale_pixbuf(self, order):
+        priority, key = order
+        index = key[0]
+        if key in self._display_pixbufs or index not in self._raw_pixbufs:
+            return
+        pixbuf = self._raw_pixbufs.get(index)
+        if pixbuf is None:
+            return
+        log.debug('Pre-scaling page %u', index + 1)
+        self._display_pixbufs.put(key, self._render_display_pixbuf(pixbuf, key))
+
+    def _get_display_key(self, index, size, rotation):
+        """Return the display cache key for page <index> shown
+        at <size> with <rotation>, using the current settings."""
+        return (index, tuple(size), rotation,
+                prefs['horizontal flip'], prefs['vertical flip'],
+                self._window.enhancer.get_values(),
+                image_tools.get_display_settings())
+
+    def _render_display_pixbuf(self, pixbuf, key):
+        """Scale, flip and enhance <pixbuf> as described by <key>.
+
+        The scaled page is also cached without enhancement, so that moving
+        the enhancement sliders only has to enhance it again.
+        """
+        index, size, rotation, hflip, vflip, enhancement, settings = key
+        enhancement = tuple(enhancement)
+        if enhancement == enhance_backend.NEUTRAL_VALUES:
+            return self._scale_pixbuf(pixbuf, key)
+        scaled_key = key[:5] + (enhance_backend.NEUTRAL_VALUES,) + key[6:]
+        scaled = self._display_pixbufs.get(scaled_key)
+        if scaled is None:
+            scaled = self._scale_pixbuf(pixbuf, scaled_key)
+            self._display_pixbufs.put(scaled_key, scaled)
+        return self._window.enhancer.enhance(scaled, values=enhancement)
+
+    def _scale_pixbuf(self, pixbuf, key):
+        """Scale and flip <pixbuf> as described by <key>."""
+        index, size, rotation, hflip, vflip, enhancement, settings = key
+        pixbuf = image_tools.fit_pixbuf_to_rectangle(pixbuf, size, rotation)
+        if hflip:
+            pixbuf = pixbuf.flip(horizontal=True)
+        if vflip:
+            pixbuf = pixbuf.flip(horizontal=False)
+        return pixbuf
+
     def get_pixbuf_auto_background(self, number_of_bufs): # XXX limited to at most 2 pages
         """ Returns an automatically calculated background color
         for the current page(s). """
 
-        pixbufs = self.get_pixbufs(number_of_bufs)
-
-        if len(pixbufs) == 1:
-            auto_bg = image_tools.get_most_common_edge_colour(pixbufs[0])
-        elif len(pixbufs) == 2:
-            left, right = pixbufs
+        if number_of_bufs == 1:
+            left = right = self._current_image_index
+        elif number_of_bufs == 2:
+            left, right = self._current_image_index, self._current_image_index + 1
             if self._window.is_manga_mode:
                 left, right = right, left
-
-            auto_bg = image_tools.get_most_common_edge_colour((left, right))
         else:
             assert False, 'Unexpected pixbuf count'
 
-        return auto_bg
+        return image_tools.get_most_common_colour(
+            (self._get_edge_image(left, 'left'),
+             self._get_edge_image(right, 'right')))
+
+    def _get_edge_image(self, index, side):
+        """Return the edge strip on <side> of page <index>, see
+        image_tools.get_edge_image."""
+        key = (index, side)
+        im = self._edge_images.get(key)
+        if im is None:
+            im = image_tools.get_edge_image(self._get_pixbuf(index), side)
+            self._edge_images.put(key, im)
+        return im
 
     def do_cacheing(self):
         """Make sure that the correct pixbufs are stored in cache. These
         are (in the current implementation) the current image(s), and
-        if cacheing is enabled, also the one or two pixbufs before and
-        after the current page. All other pixbufs are deleted and garbage
-        collected directly in order to save memory.
+        if cacheing is enabled, also the pixbufs before and after the
+        current page. Those pages are kept in cache, other pixbufs are
+        dropped by least recent use once the page cache memory budget
+        is exceeded.
         """
         if not self._window.filehandler.file_loaded:
             return
 
         # Flush caching orders.
         self._thread.clear_orders()
+        self._thread.set_max_threads(self._get_decode_threads())
+        self._cache_pages = prefs['max pages to cache']
+        self._raw_pixbufs.set_max_size(self._get_cache_size())
+        self._display_pixbufs.set_max_size(self._get_display_cache_size())
         # Get list of wanted pixbufs.
         wanted_pixbufs = self._ask_for_pages(self.get_current_page())
-        if -1 != self._cache_pages:
-            # We're not caching everything, remove old pixbufs.
-            for index in set(self._raw_pixbufs) - set(wanted_pixbufs):
-                del self._raw_pixbufs[index]
+        self._raw_pixbufs.protect(wanted_pixbufs)
         log.debug('Caching page(s) %s', ' '.join([str(index + 1) for index in wanted_pixbufs]))
         self._wanted_pixbufs = wanted_pixbufs
         # Start caching available images not already in cache.
@@ -134,8 +295,42 @@ class ImageHandler(object):
 
     def _cache_pixbuf(self, wanted):
         priority, index = wanted
+        if index not in self._wanted_pixbufs:
+            if -1 != self._cache_pages:
+                # Stale order: the current page changed since it was queued.
+                return
+            if self._raw_pixbufs.is_full():
+                # Only cache pages outside of the current window
+                # as long as they don't push out anything else.
+                return
         log.debug('Caching page %u', index + 1)
         self._get_pixbuf(index)
+        if prefs['smart bg'] or prefs['smart thumb bg']:
+            # Prepare the smart background while we are at it.
+            for side in ('left', 'right'):
+                self._get_edge_image(index, side)
+        self.page_decoded(index + 1)
+
+    def _get_decode_threads(self):
+        """Return the number of threads used for decoding pages."""
+        max_threads = prefs['max decode threads']
+        if max_threads <= 0:
+            max_threads = os.cpu_count() or 1
+        return max_threads
+
+    def _get_cache_size(self):
+        """Return the page cache budget in bytes."""
+        return prefs['page cache size'] * 1024 * 1024
+
+    def _get_display_cache_size(self):
+        """Return the display cache budget in bytes."""
+        return prefs['display cache size'] * 1024 * 1024
+
+    def get_cache_stats(self):
+        """Return a dictionary with the page cache hit, miss and
+        eviction counters, and its current and maximum size in bytes.
+        """
+        return self._raw_pixbufs.get_stats()
 
     def set_page(self, page_num):
         """Set up filehandler to the page <page_num>.
@@ -195,11 +390,22 @@ class ImageHandler(object):
         self.last_wanted = 1
 
         self._thread.stop()
+        self._prescale_thread.stop()
         self._base_path = None
         self._image_files = []
         self._current_image_index = None
         self._available_images.clear()
+        log.debug('Page cache: %(hits)u hits, %(misses)u misses, '
+                  '%(evictions)u evictions', self._raw_pixbufs.get_stats())
         self._raw_pixbufs.clear()
+        self._raw_pixbufs.reset_stats()
+        log.debug('Display cache: %(hits)u hits, %(misses)u misses, '
+                  '%(evictions)u evictions', self._display_pixbufs.get_stats())
+        self._display_pixbufs.clear()
+        self._display_pixbufs.reset_stats()
+        self._edge_images.clear()
+        log.debug('Colour transforms cache: %(hits)u hits, %(misses)u misses, '
+                  '%(evictions)u evictions', image_tools.get_color_xform_stats())
         self._cache_pages = prefs['max pages to cache']
 
     def page_is_available(self, page=None):
@@ -237,11 +443,16 @@ class ImageHandler(object):
             # In the list of wanted pixbufs.
             priority = self._wanted_pixbufs.index(index)
         elif -1 == self._cache_pages:
-            # We're caching everything.
+            # We're caching as much as the memory budget allows.
             priority = self.get_number_of_pages()
         if priority is not None:
             self._thread.append_order((priority, index))
 
+    @callback.Callback
+    def page_decoded(self, page):
+        """ Called whenever the caching threads have decoded <page>. """
+        pass
+
     def _file_available(self, filepaths):
         """ Called by the filehandler when a new file becomes available. """
         # Find the page that corresponds to <filepath>
@@ -328,24 +539,25 @@ class ImageHandler(object):
         if double:
             second_path = self.get_path_to_page(page + 1)
             if second_path != None:
-                try:
-                    first = tools.format_byte_size(os.stat(first_path).st_size)
-                except OSError:
-                    first = ''
-                try:
-                    second = tools.format_byte_size(os.stat(second_path).st_size)
-                except OSError:
-                    second = ''
+                first = self._get_file_size(first_path)
+                second = self._get_file_size(second_path)
             else:
                 return ('', '')
             return first, second
 
+        return self._get_file_size(first_path)
+
+    def _get_file_size(self, path):
+        """Return the formatted size of the file at <path>, which may
+        only have been extracted to memory.
+        """
+        data = self._window.filehandler.get_file_data(path)
+        if data is not None:
+            return tools.format_byte_size(len(data))
         try:
-            size = tools.format_byte_size(os.stat(first_path).st_size)
+            return tools.format_byte_size(os.stat(path).st_size)
         except OSError:
-            size = ''
-
-        return size
+            return ''
 
     def get_pretty_current_filename(self):
         """Return a string with the name of the currently viewed file that is
@@ -370,7 +582,8 @@ class ImageHandler(object):
         """
         self._wait_on_page(page)
 
-        page_path = self.get_path_to_page(page)
+        page_path = self._window.filehandler.ensure_on_disk(
+            self.get_path_to_page(page))
         if page_path is None:
             return (0, 0)
 
@@ -383,7 +596,8 @@ class ImageHandler(object):
         """
         self._wait_on_page(page)
 
-        page_path = self.get_path_to_page(page)
+        page_path = self._window.filehandler.ensure_on_disk(
+            self.get_path_to_page(page))
         if page_path is None:
             return None
 
@@ -410,6 +624,11 @@ class ImageHandler(object):
             return None
 
         try:
+            data = self._window.filehandler.get_file_data(path)
+            if data is not None and not create:
+                return image_tools.load_pixbuf_size(data, width, height,
+                                                    is_thumb=True)
+            self._window.filehandler.ensure_on_disk(path)
             thumbnailer = thumbnail_tools.Thumbnailer(store_on_disk=create,
                                                       size=(width, height))
             return thumbnailer.thumbnail(path)
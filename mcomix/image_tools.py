@@ -1,20 +1,24 @@
 """image_tools.py - Various image manipulations."""
 
+import hashlib
 import operator
+import struct
 from gi.repository import GLib, GdkPixbuf, Gdk, Gtk
 import PIL
 import jxlpy
 import jxlpy.JXLImagePlugin
 from PIL import Image
+from PIL import ImageChops
 from PIL import ImageCms
 from PIL import ImageEnhance
-from PIL import ImageOps
-from io import StringIO, BytesIO
+from io import BytesIO
 
 from mcomix.preferences import prefs
 from mcomix import constants
+from mcomix import decode_pool
 from mcomix import log
 from mcomix import tools
+from mcomix.lru_cache import LRUCache
 
 import base64
 
@@ -69,6 +73,17 @@ default_srgb_rgb_xform = ImageCms.buildTransform(
             prefs['managed color rendering intent']
         )
 
+# transformations for images with an embedded profile, keyed by (sha1 of the
+# embedded profile, display profile, mode, rendering intent): a whole volume
+# usually shares the same profile. Transforms that could not be built are
+# cached as False.
+color_xforms = LRUCache(32, sizeof=lambda xform: 1)
+
+def get_color_xform_stats():
+    """ Return a dictionary with the usage counters of the cache of
+    transformations for embedded profiles. """
+    return color_xforms.get_stats()
+
 def update_xforms():
     global cur_profile_name
     global cur_render_intent
@@ -138,6 +153,18 @@ def fit_pixbuf_to_rectangle(src, rect, rotation):
                             keep_ratio=False,
                             scale_up=True)
 
+def get_display_settings():
+    """ Return a tuple of all preferences affecting the output of
+    fit_in_rectangle, suitable as part of a cache key. """
+    return (prefs['scaling quality'],
+            prefs['pil scaling filter'],
+            prefs['default pixel art mode'],
+            prefs['checkered bg for transparent images'],
+            tuple(prefs['bg colour']),
+            prefs['color management enabled'],
+            prefs['color managed display icc profile'],
+            prefs['managed color rendering intent'])
+
 def fit_in_rectangle(src, width, height, keep_ratio=True, scale_up=False, rotation=0, scaling_quality=None, pil_filter=None, is_thumb=False):
     """Scale (and return) a pixbuf so that it fits in a rectangle with
     dimensions <width> x <height>. A negative <width> or <height>
@@ -156,6 +183,9 @@ def fit_in_rectangle(src, width, height, keep_ratio=True, scale_up=False, rotati
     resample the image.
 
     If <src> has an alpha channel it gets a checkboard background.
+
+    If <is_thumb> is True, <src> is a thumbnail: it keeps its alpha
+    channel, is not colour managed, and is resized with GdkPixbuf only.
     """
     # "Unbounded" really means "bounded to 100000 px" - for simplicity.
     # MComix would probably choke on larger images anyway.
@@ -191,100 +221,167 @@ def fit_in_rectangle(src, width, height, keep_ratio=True, scale_up=False, rotati
                                      keep_ratio=keep_ratio,
                                      scale_up=scale_up)
 
-    if src.get_has_alpha():
+    needs_resize = width != src_width or height != src_height
+    has_alpha = src.get_has_alpha() and not is_thumb
+    # Skip images already converted by color_manage().
+    manage_colors = not is_thumb and \
+        get_color_management_settings() is not None and \
+        getattr(src, 'color-managed', None) is None
+
+    if not (needs_resize or has_alpha or rotation or manage_colors):
+        # Nothing to do, avoid copying the image.
+        return src
+
+    if has_alpha:
         if prefs['checkered bg for transparent images']:
             check_size, color1, color2 = 8, 0x777777, 0x999999
         else:
-#            check_size, color1, color2 = 1024, 0xFFFFFF, 0xFFFFFF
-# wyatt: transparency should be background colour as set in prefs instead of hardcoded white
-#            check_size, color1, color2 = 1024, 0xFFFFFF, 0xFFFFFF
-            # convert the floating point decimal format colour list to a
-            # hexadecimal colour code. Uses bitwise shifting and bitwise OR.
+            # wyatt: transparency should be background colour as set in
+            # prefs instead of hardcoded white: convert the floating point
+            # decimal format colour list to a hexadecimal colour code.
             r,g,b,a = [int(p*255) for p in prefs['bg colour']]
-# hack
-# targetted 0a0a0a, got 0b0b0b. good enough
-#            if bool(prefs['color management enabled']):
-#                bgcol = 5<<16 | 3<<8 | 8 # hex(r<<16 | g<<8 | b)
-#            else:
             bgcol = r<<16 | g<<8 | b # hex(r<<16 | g<<8 | b)
             check_size, color1, color2 = 1024, bgcol, bgcol
-        if width == src_width and height == src_height:
+
+    # Each conversion between pixbuf and PIL image copies the whole image,
+    # so stay in one representation until the end: PIL if resizing with a
+    # PIL filter, GdkPixbuf otherwise. Colour management, which needs PIL,
+    # then costs at most one round-trip.
+    icc_profile = src.get_option('icc-profile')
+    if needs_resize and pil_filter != -1 and not is_thumb:
+        im = pixbuf_to_pil(src).resize([width, height], resample=pil_filter)
+        if has_alpha:
+            im = _composite_color_pil(im, check_size, color1, color2)
+        im = _rotate_pil(im, rotation)
+        if manage_colors:
+            im = _apply_color_management(im, icc_profile)
+        return pil_to_pixbuf(im)
+
+    if has_alpha:
+        if not needs_resize:
             # Using anything other than nearest interpolation will result in a
             # modified image if no resizing takes place (even if it's opaque).
             scaling_quality = GdkPixbuf.InterpType.NEAREST
-#        src = src.composite_color_simple(width, height, scaling_quality,
-#                                         255, check_size, color1, color2)
-
-            src = src.composite_color_simple(width, height, scaling_quality,
-                                             255, check_size, color1, color2)
-        elif pil_filter == -1: # scale; use GDK PixBuf only
-            src = src.composite_color_simple(width, height, scaling_quality,
-                                             255, check_size, color1, color2)
-        else:
-            # use PIL filter and then composite. Since PIL already resized,
-            # use NEAREST for the composition step.
-            src = pil_to_pixbuf(pixbuf_to_pil(src).resize(
-                [width,height], resample=pil_filter)).composite_color_simple(
-                    width, height, GdkPixbuf.InterpType.NEAREST, 255,
-                    check_size, color1, color2)
-
-#   elif width != src_width or height != src_height:
-#       src = src.scale_simple(width, height, scaling_quality)
-    elif width != src_width or height != src_height: # opaque and needs resized
-        if pil_filter == -1:
-            src = src.scale_simple(width, height, scaling_quality)
-        else:
-            src = pil_to_pixbuf(
-                pixbuf_to_pil(src).resize([width,height],resample=pil_filter))
+        src = src.composite_color_simple(width, height, scaling_quality,
+                                         255, check_size, color1, color2)
+    elif needs_resize:
+        src = src.scale_simple(width, height, scaling_quality)
     src = rotate_pixbuf(src, rotation)
-
-    ################ 3D LUT CODE #######################
-
-    im = pixbuf_to_pil(src)
-    if not is_thumb:
-        if bool(prefs['color management enabled']) and bool(prefs['color managed display icc profile']):
-            if im.info.get('icc_profile') is None:
-                # Fall back on sRGB if no profile is embedded. Either RGB or RGBA mode.
-                # (images will be converted to fit).
-                icc_in = default_srgb_profile
-            else:
-                # icc_in = BytesIO(im.info.get('icc_profile'))
-                icc_in = PIL._imagingcms.profile_frombytes(im.info.get('icc_profile'))
-                # handles indexed / black and white, and grayscale images
-                # this function's source currently does nothing if source and destination match.
-            im=im.convert('RGBA' if src.get_has_alpha() else 'RGB') # chooses RGB or RGBA appropriately
-                # im=im.convert('RGB' if src.get_has_alpha() else 'RGBA')
-
-            if icc_in == default_srgb_profile:
-                # do any necessary transform regenerations based on pref changes
-                update_xforms()
-                color_xform = default_srgb_rgba_xform if src.get_has_alpha() else default_srgb_rgb_xform
-
-            # need to apply any color corrections _after_ resize is completed, since
-            # the LUT is supposed to be the final step before being drawn on-screen.
-            # Unfortunately, this means another pixbuf -> pil -> pixbuf transform.
-            # create a transform
-
-            # (NOTE: maybe there should be a global one for sRGB, since it's so
-            # common, just to avoid having to regenerate the conversion  matrix it
-            # on every image.
-            if icc_in != default_srgb_profile:
-                try:
-                    color_xform = ImageCms.buildTransform(icc_in,
-                            prefs['color managed display icc profile'],
-                            im.mode, im.mode,
-                            prefs['managed color rendering intent'])
-                except PIL.ImageCms.PyCMSError:
-                    color_xform = default_srgb_rgba_xform if src.get_has_alpha() else default_srgb_rgb_xform
-
-            ImageCms.applyTransform(im, color_xform, inPlace=True)
-
-    src = pil_to_pixbuf(im)
-
-    ############### END 3D LUT CODE ####################
-
+    if manage_colors:
+        # The colour transform must be the last step before being drawn
+        # on-screen, so it is applied after resizing.
+        im = pixbuf_to_pil(src)
+        src = pil_to_pixbuf(_apply_color_management(im, icc_profile))
     return src
 
+def get_color_management_settings():
+    """Return the preferences affecting colour management, or None if it
+    is disabled."""
+    if not bool(prefs['color management enabled']) or \
+       not bool(prefs['color managed display icc profile']):
+        return None
+    return (prefs['color managed display icc profile'],
+            prefs['managed color rendering intent'])
+
+def color_manage(pixbuf):
+    """Return <pixbuf> converted to the display profile, so that
+    fit_in_rectangle does not need to convert it on every draw. The result
+    remembers the settings used, see is_color_managed_for_display()."""
+    settings = get_color_management_settings()
+    if settings is None or is_animation(pixbuf):
+        return pixbuf
+    orientation = getattr(pixbuf, 'orientation', None)
+    if orientation is None:
+        orientation = pixbuf.get_option('orientation')
+    if orientation is None:
+        orientation = _get_png_implied_rotation(pixbuf)
+    im = _apply_color_management(pixbuf_to_pil(pixbuf),
+                                 pixbuf.get_option('icc-profile'))
+    managed = pil_to_pixbuf(im)
+    if orientation is not None:
+        setattr(managed, 'orientation', orientation)
+    setattr(managed, 'color-managed', settings)
+    return managed
+
+def is_color_managed_for_display(pixbuf):
+    """Return False if <pixbuf> was converted by color_manage() with
+    other settings than the current ones, True otherwise."""
+    settings = getattr(pixbuf, 'color-managed', None)
+    return settings is None or settings == get_color_management_settings()
+
+def _get_color_xform(icc_profile, mode):
+    """Return the transformation from the embedded profile <icc_profile>
+    (bytes) to the display profile for images in <mode>, or False if it
+    cannot be built."""
+    key = (hashlib.sha1(icc_profile).hexdigest(),
+           prefs['color managed display icc profile'],
+           mode, prefs['managed color rendering intent'])
+    color_xform = color_xforms.get(key)
+    if color_xform is None:
+        try:
+            icc_in = PIL._imagingcms.profile_frombytes(icc_profile)
+            color_xform = ImageCms.buildTransform(icc_in,
+                    prefs['color managed display icc profile'],
+                    mode, mode,
+                    prefs['managed color rendering intent'])
+        except (PIL.ImageCms.PyCMSError, OSError) as e:
+            log.debug('Could not build colour transform: %s', e)
+            color_xform = False
+        color_xforms.put(key, color_xform)
+    return color_xform
+
+def _rotate_pil(im, rotation):
+    """Same as rotate_pixbuf for the PIL image <im>."""
+    if 0 == rotation:
+        return im
+    if 90 == rotation:
+        return im.transpose(Image.Transpose.ROTATE_270)
+    if 180 == rotation:
+        return im.transpose(Image.Transpose.ROTATE_180)
+    if 270 == rotation:
+        return im.transpose(Image.Transpose.ROTATE_90)
+    raise ValueError("unsupported rotation: %s" % rotation)
+
+def _composite_color_pil(im, check_size, color1, color2):
+    """Same as GdkPixbuf.Pixbuf.composite_color_simple without scaling, for
+    the RGBA image <im>: composite it over a checkboard of <check_size>
+    pixels squares of colours <color1> and <color2> (0xRRGGBB)."""
+    def to_rgba(color):
+        return (color >> 16 & 0xff, color >> 8 & 0xff, color & 0xff, 255)
+    background = Image.new('RGBA', im.size, to_rgba(color1))
+    if color1 != color2:
+        # Build a checkboard with one pixel per square, then enlarge it.
+        columns = (im.size[0] + check_size - 1) // check_size
+        rows = (im.size[1] + check_size - 1) // check_size
+        row = Image.frombytes('L', (columns, 1),
+                              bytes(255 * (n % 2) for n in range(columns)))
+        column = Image.frombytes('L', (1, rows),
+                                 bytes(255 * (n % 2) for n in range(rows)))
+        mask = ImageChops.difference(row.resize((columns, rows)),
+                                     column.resize((columns, rows)))
+        mask = mask.resize((columns * check_size, rows * check_size),
+                           resample=Image.NEAREST).crop((0, 0) + im.size)
+        background.paste(to_rgba(color2), mask=mask)
+    background.alpha_composite(im)
+    return background
+
+def _apply_color_management(im, icc_profile):
+    """Return the PIL image <im> converted from its colour profile to the
+    display profile. <icc_profile> is the base64 encoded profile embedded in
+    the original image, if any; sRGB is assumed otherwise."""
+    has_alpha = im.mode == 'RGBA'
+    # handles indexed / black and white, and grayscale images
+    im = im.convert('RGBA' if has_alpha else 'RGB')
+    color_xform = None
+    if icc_profile is not None:
+        color_xform = _get_color_xform(base64.b64decode(icc_profile), im.mode)
+    if not color_xform:
+        # Fall back on sRGB if no profile is embedded, or if it is invalid.
+        # do any necessary transform regenerations based on pref changes
+        update_xforms()
+        color_xform = default_srgb_rgba_xform if has_alpha else default_srgb_rgb_xform
+    ImageCms.applyTransform(im, color_xform, inPlace=True)
+    return im
 
 def add_border(pixbuf, thickness, colour=0x000000FF):
     """Return a pixbuf from <pixbuf> with a <thickness> px border of
@@ -304,113 +401,100 @@ def get_most_common_edge_colour(pixbufs, edge=2):
     of <pixbuf>. The return value is a sequence, (r, g, b), with 16 bit
     values. If <pixbuf> is a tuple, the edges will be computed from
     both the left and the right image.
-
-    Note: This could be done more cleanly with subpixbuf(), but that
-    doesn't work as expected together with get_pixels().
     """
-
-    def group_colors(colors, steps=10):
-        """ This rounds a list of colors in C{colors} to the next nearest value,
-        i.e. 128, 83, 10 becomes 130, 85, 10 with C{steps}=5. This compensates for
-        dirty colors where no clear dominating color can be made out.
-
-        @return: The color that appears most often in the prominent group."""
-
-        # Start group
-        group = (0, 0, 0)
-        # List of (count, color) pairs, group contains most colors
-        colors_in_prominent_group = []
-        color_count_in_prominent_group = 0
-        # List of (count, color) pairs, current color group
-        colors_in_group = []
-        color_count_in_group = 0
-
-        for count, color in colors:
-
-            # Round color
-            rounded = [0] * len(color)
-            for i, color_value in enumerate(color):
-                if steps % 2 == 0:
-                    middle = steps // 2
-                else:
-                    middle = steps // 2 + 1
-
-                remainder = color_value % steps
-                if remainder >= middle:
-                    color_value = color_value + (steps - remainder)
-                else:
-                    color_value = color_value - remainder
-
-                rounded[i] = min(255, max(0, color_value))
-
-            # Change prominent group if necessary
-            if rounded == group:
-                # Color still fits in the previous color group
-                colors_in_group.append((count, color))
-                color_count_in_group += count
-            else:
-                # Color group changed, check if current group has more colors
-                # than last group
-                if color_count_in_group > color_count_in_prominent_group:
-                    colors_in_prominent_group = colors_in_group
-                    color_count_in_prominent_group = color_count_in_group
-
-                group = rounded
-                colors_in_group = [ (count, color) ]
-                color_count_in_group = count
-
-        # Cleanup if only one edge color group was found
-        if color_count_in_group > color_count_in_prominent_group:
-            colors_in_prominent_group = colors_in_group
-
-        colors_in_prominent_group.sort(key=operator.itemgetter(0), reverse=True)
-        # List is now sorted by color count, first color appears most often
-        return colors_in_prominent_group[0][1]
-
-    def get_edge_pixbuf(pixbuf, side, edge):
-        """ Returns a pixbuf corresponding to the side passed in <side>.
-        Valid sides are 'left', 'right', 'top', 'bottom'. """
-        pixbuf = static_image(pixbuf)
-        width = pixbuf.get_width()
-        height = pixbuf.get_height()
-        edge = min(edge, width, height)
-
-        subpix = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB,
-                pixbuf.get_has_alpha(), 8, edge, height)
-        if side == 'left':
-            pixbuf.copy_area(0, 0, edge, height, subpix, 0, 0)
-        elif side == 'right':
-            pixbuf.copy_area(width - edge, 0, edge, height, subpix, 0, 0)
-        elif side == 'top':
-            pixbuf.copy_area(0, 0, width, edge, subpix, 0, 0)
-        elif side == 'bottom':
-            pixbuf.copy_area(0, height - edge, width, edge, subpix, 0, 0)
-        else:
-            assert False, 'Invalid edge side'
-
-        return subpix
-
     if not pixbufs:
         return (0, 0, 0)
 
     if not isinstance(pixbufs, (tuple, list)):
-        left_edge = get_edge_pixbuf(pixbufs, 'left', edge)
-        right_edge = get_edge_pixbuf(pixbufs, 'right', edge)
+        left_edge = get_edge_image(pixbufs, 'left', edge)
+        right_edge = get_edge_image(pixbufs, 'right', edge)
     else:
         assert len(pixbufs) == 2, 'Expected two pages in list'
-        left_edge = get_edge_pixbuf(pixbufs[0], 'left', edge)
-        right_edge = get_edge_pixbuf(pixbufs[1], 'right', edge)
+        left_edge = get_edge_image(pixbufs[0], 'left', edge)
+        right_edge = get_edge_image(pixbufs[1], 'right', edge)
 
-    # Find all edge colors. Color count is separate for all four edges
-    ungrouped_colors = []
-    for edge in (left_edge, right_edge):
-        im = pixbuf_to_pil(edge)
-        ungrouped_colors.extend(im.getcolors(im.size[0] * im.size[1]))
+    return get_most_common_colour((left_edge, right_edge))
 
-    # Sum up colors from all edges
-    ungrouped_colors.sort(key=operator.itemgetter(1))
-    most_used = group_colors(ungrouped_colors)[:3]
-    return [color * 257 for color in most_used]
+def get_edge_image(pixbuf, side, edge=2):
+    """ Return a RGB PIL image of the <edge> pixels wide strip of <pixbuf>
+    on <side>. Valid sides are 'left', 'right', 'top', 'bottom'.
+
+    Note: This could be done without copies with subpixbuf(), but that
+    doesn't work as expected together with get_pixels(). Only the strip is
+    copied, never the whole image.
+    """
+    pixbuf = static_image(pixbuf)
+    width = pixbuf.get_width()
+    height = pixbuf.get_height()
+    edge = min(edge, width, height)
+
+    if side in ('left', 'right'):
+        size = edge, height
+    else:
+        size = width, edge
+    subpix = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB,
+            pixbuf.get_has_alpha(), 8, *size)
+    if side == 'left':
+        pixbuf.copy_area(0, 0, edge, height, subpix, 0, 0)
+    elif side == 'right':
+        pixbuf.copy_area(width - edge, 0, edge, height, subpix, 0, 0)
+    elif side == 'top':
+        pixbuf.copy_area(0, 0, width, edge, subpix, 0, 0)
+    elif side == 'bottom':
+        pixbuf.copy_area(0, height - edge, width, edge, subpix, 0, 0)
+    else:
+        assert False, 'Invalid edge side'
+
+    return pixbuf_to_pil(subpix).convert('RGB')
+
+def get_most_common_colour(images, steps=10):
+    """ Return the most commonly occurring colour in the RGB PIL <images>,
+    as a sequence (r, g, b) of 16 bit values.
+
+    Colours are first grouped by rounding each channel to the nearest
+    multiple of <steps>, i.e. 128, 83, 10 becomes 130, 85, 10 with
+    <steps>=5. This compensates for dirty colors where no clear dominating
+    color can be made out. The result is the colour that appears most
+    often in the most prominent group.
+    """
+    middle = (steps + 1) // 2
+    rounding = []
+    for value in range(256):
+        remainder = value % steps
+        if remainder >= middle:
+            value += steps - remainder
+        else:
+            value -= remainder
+        rounding.append(min(255, value))
+    rounding *= 3
+
+    # Count pixels per group, all images together.
+    group_counts = {}
+    rounded_images = []
+    for im in images:
+        rounded = im.point(rounding)
+        rounded_images.append(rounded)
+        for count, group in rounded.getcolors(im.size[0] * im.size[1]):
+            group_counts[group] = group_counts.get(group, 0) + count
+    if not group_counts:
+        return (0, 0, 0)
+    group = max(group_counts.items(), key=operator.itemgetter(1))[0]
+
+    # Count the colours of the prominent group: replace pixels outside of
+    # the group by a colour that cannot be part of it.
+    outsider = tuple((value + 128) % 256 for value in group)
+    colour_counts = {}
+    for im, rounded in zip(images, rounded_images):
+        masks = [channel.point(lambda v, g=g: 255 if v == g else 0)
+                 for channel, g in zip(rounded.split(), group)]
+        mask = ImageChops.multiply(ImageChops.multiply(masks[0], masks[1]), masks[2])
+        im = Image.composite(im, Image.new('RGB', im.size, outsider), mask)
+        for count, colour in im.getcolors(im.size[0] * im.size[1]):
+            if colour != outsider:
+                colour_counts[colour] = colour_counts.get(colour, 0) + count
+    # Ties go to the lowest colour, as with a stable sort.
+    colour = max(sorted(colour_counts.items()), key=operator.itemgetter(1))[0]
+    return [value * 257 for value in colour]
 
 def pil_to_pixbuf(im, keep_orientation=False, is_thumb=False):
     """Return a pixbuf created from the PIL <im>."""
@@ -452,6 +536,45 @@ def pil_to_pixbuf(im, keep_orientation=False, is_thumb=False):
                 setattr(pixbuf, 'icc-profile', str(profile))
     return pixbuf
 
+def _decoded_to_pixbuf(decoded, is_thumb=False):
+    """Return a pixbuf created from <decoded>, a decode_pool.DecodedImage,
+    and release it. The pixels are copied twice on the way, the pixbuf
+    does not wrap the shared memory block."""
+    try:
+        has_alpha = decoded.mode == 'RGBA'
+        # Wrapping the shared memory without a copy is not possible: the
+        # block is released below, and PyGObject converts buffers other
+        # than bytes item per item. bytes() copies the pixels once with a
+        # memcpy, which PyGObject passes on as is, and g_bytes_new()
+        # copies them a second time.
+        pixbuf = GdkPixbuf.Pixbuf.new_from_bytes(
+            GLib.Bytes.new(bytes(decoded.get_buffer())),
+            GdkPixbuf.Colorspace.RGB, has_alpha, 8,
+            decoded.size[0], decoded.size[1], decoded.get_rowstride()
+        )
+    finally:
+        decoded.close()
+    if decoded.orientation is not None:
+        setattr(pixbuf, 'orientation', decoded.orientation)
+    if not is_thumb and decoded.icc_profile is not None:
+        setattr(pixbuf, 'icc-profile', str(base64.b64encode(decoded.icc_profile)))
+    return pixbuf
+
+def _load_pil_pixbuf(source, size=None, is_thumb=False):
+    """Return a pixbuf decoded with PIL from <source>, a path or image
+    data. If <size> is not None, the image may be decoded at a reduced size
+    closer to this (width, height) tuple. Decoding is done in worker
+    processes if enabled."""
+    if decode_pool.is_enabled():
+        return _decoded_to_pixbuf(decode_pool.decode(source, size), is_thumb=is_thumb)
+    if isinstance(source, str):
+        im = Image.open(source)
+    else:
+        im = Image.open(BytesIO(source))
+    if size is not None:
+        im.draft(None, size)
+    return pil_to_pixbuf(im, keep_orientation=True, is_thumb=is_thumb)
+
 def pixbuf_to_pil(pixbuf):
     """Return a PIL image created from <pixbuf>."""
     dimensions = pixbuf.get_width(), pixbuf.get_height()
@@ -468,6 +591,12 @@ def pixbuf_to_pil(pixbuf):
         im.info['icc_profile']=base64.b64decode(profile) # not sure if I can do this, but it's Python, so probably.
     return im
 
+def get_pixbuf_byte_size(pixbuf):
+    """ Return the decoded size of <pixbuf> in bytes,
+    i.e. width x height x channels. """
+    pixbuf = static_image(pixbuf)
+    return pixbuf.get_width() * pixbuf.get_height() * pixbuf.get_n_channels()
+
 def is_animation(pixbuf):
     return isinstance(pixbuf, GdkPixbuf.PixbufAnimation)
 
@@ -531,8 +660,7 @@ def load_pixbuf(path):
             elif provider == constants.IMAGEIO_PIL:
                 # TODO When using PIL, whether or how animations work is
                 # currently undefined.
-                im = Image.open(path)
-                pixbuf = pil_to_pixbuf(im, keep_orientation=True)
+                pixbuf = _load_pil_pixbuf(path)
             else:
                 raise TypeError()
         except Exception as e:
@@ -548,44 +676,56 @@ def load_pixbuf(path):
         raise last_error or TypeError()
     return pixbuf
 
-def load_pixbuf_size(path, width, height, is_thumb=False):
-    """ Loads a pixbuf from a given image file and scale it to fit
-    inside (width, height). """
+def _load_thumb_pixbuf(source, width, height):
+    """ Returns a thumbnail of <source>, a path or image data, scaled to
+    fit inside (width, height), for the formats GdkPixbuf cannot decode at
+    a reduced size: JPEG, which PIL decodes at 1/2, 1/4 or 1/8 of its size
+    in the DCT domain, and GIF. Returns None for other formats. """
+    try:
+        if isinstance(source, str):
+            im = Image.open(source)
+        else:
+            im = Image.open(BytesIO(source))
+        if im.format not in ('JPEG', 'MPO', 'GIF'):
+            return None
+        if decode_pool.is_enabled():
+            return _decoded_to_pixbuf(decode_pool.decode(source, (width, height)),
+                                      is_thumb=True)
+        im.draft(None, (width, height))
+        im.thumbnail((width, height), Image.BILINEAR)
+        return pil_to_pixbuf(im, keep_orientation=True, is_thumb=True)
+    except Exception as e:
+        log.debug('Could not decode thumbnail with PIL: %s', e)
+        return None
+
+def load_pixbuf_size(source, width, height, is_thumb=False):
+    """ Loads a pixbuf from <source>, a path or image data (bytes or any
+    object supporting the buffer protocol), and scale it to fit inside
+    (width, height). """
+    if is_thumb:
+        pixbuf = _load_thumb_pixbuf(source, width, height)
+        if pixbuf is not None:
+            return pixbuf
     # TODO similar to load_pixbuf, should be merged using callbacks etc.
     pixbuf = None
     last_error = None
-    image_format, image_dimensions, providers = get_image_info(path)
+    if isinstance(source, str):
+        image_format, image_dimensions, providers = get_image_info(source)
+        description = source
+    else:
+        providers = (constants.IMAGEIO_GDKPIXBUF, constants.IMAGEIO_PIL)
+        description = '%s bytes' % len(source)
     for provider in providers:
         try:
             # TODO use dynamic dispatch instead of "if" chain
             if provider == constants.IMAGEIO_GDKPIXBUF:
-                # If we could not get the image info, still try to load
-                # the image to let GdkPixbuf raise the appropriate exception.
-                if (0, 0) == image_dimensions:
-                    pixbuf = GdkPixbuf.Pixbuf.new_from_file(path)
-                # Work around GdkPixbuf bug: https://bugzilla.gnome.org/show_bug.cgi?id=735422
-                # (currently https://gitlab.gnome.org/GNOME/gdk-pixbuf/issues/45)
-                elif 'GIF' == image_format:
-                    pixbuf = GdkPixbuf.Pixbuf.new_from_file(path)
+                if isinstance(source, str):
+                    pixbuf = _load_gdk_file_size(source, image_format,
+                                                 image_dimensions, width, height)
                 else:
-                    # Don't upscale if smaller than target dimensions!
-                    image_width, image_height = image_dimensions
-                    if image_width <= width and image_height <= height:
-                        width, height = image_width, image_height
-                    pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(path, width, height)
-#                   out = GdkPixbuf.Pixbuf.new_from_file_at_size(path, width, height)
-#                   del pixbuf
-#                   gc.collect()
-#                   return out
-#               out = fit_in_rectangle(pixbuf, width, height,
-#                                 scaling_quality=GdkPixbuf.InterpType.BILINEAR)
-#        del pixbuf
-#        gc.collect()
-#        return out
+                    pixbuf = _load_gdk_data_size(source, width, height)
             elif provider == constants.IMAGEIO_PIL:
-                im = Image.open(path)
-                im.draft(None, (width, height))
-                pixbuf = pil_to_pixbuf(im, keep_orientation=True, is_thumb=is_thumb)
+                pixbuf = _load_pil_pixbuf(source, (width, height), is_thumb=is_thumb)
             else:
                 raise TypeError()
         except Exception as e:
@@ -593,16 +733,57 @@ def load_pixbuf_size(path, width, height, is_thumb=False):
             last_error = e
         if pixbuf is not None:
             # stop loop on success
-            log.debug("provider %s succeeded in loading %s at size %s", provider, path, (width, height))
+            log.debug("provider %s succeeded in loading %s at size %s", provider, description, (width, height))
             break
-        log.debug("provider %s failed to load %s at size %s", provider, path, (width, height))
+        log.debug("provider %s failed to load %s at size %s", provider, description, (width, height))
     if pixbuf is None:
         # raising necessary because caller expects pixbuf to be not None
         raise last_error or TypeError()
     return fit_in_rectangle(pixbuf, width, height, GdkPixbuf.InterpType.BILINEAR, is_thumb=is_thumb)
 
+def _load_gdk_file_size(path, image_format, image_dimensions, width, height):
+    """ Loads the image file at <path> with GdkPixbuf, at a size fitting
+    inside (width, height) when possible, see load_pixbuf_size(). """
+    # If we could not get the image info, still try to load
+    # the image to let GdkPixbuf raise the appropriate exception.
+    if (0, 0) == image_dimensions:
+        return GdkPixbuf.Pixbuf.new_from_file(path)
+    # Work around GdkPixbuf bug: https://bugzilla.gnome.org/show_bug.cgi?id=735422
+    # (currently https://gitlab.gnome.org/GNOME/gdk-pixbuf/issues/45)
+    if 'GIF' == image_format:
+        return GdkPixbuf.Pixbuf.new_from_file(path)
+    # Don't upscale if smaller than target dimensions!
+    image_width, image_height = image_dimensions
+    if image_width <= width and image_height <= height:
+        width, height = image_width, image_height
+    return GdkPixbuf.Pixbuf.new_from_file_at_size(path, width, height)
+
+def _load_gdk_data_size(imgdata, width, height):
+    """ Decodes <imgdata> with GdkPixbuf, at a size fitting inside
+    (width, height), see load_pixbuf_size(). """
+    loader = GdkPixbuf.PixbufLoader()
+
+    def size_prepared(loader, image_width, image_height):
+        # Don't upscale if smaller than target dimensions!
+        if image_width > width or image_height > height:
+            loader.set_size(*get_fitting_size(
+                (image_width, image_height), (width, height)))
+
+    loader.connect('size-prepared', size_prepared)
+    loader.write(_as_bytes(imgdata))
+    loader.close()
+    return loader.get_pixbuf()
+
+def _as_bytes(imgdata):
+    """ Return <imgdata> as a bytes object: GdkPixbuf cannot be fed
+    buffers such as the memoryviews returned by archive readers. """
+    if isinstance(imgdata, bytes):
+        return imgdata
+    return bytes(imgdata)
+
 def load_pixbuf_data(imgdata):
-    """ Loads a pixbuf from the data passed in <imgdata>. """
+    """ Loads a pixbuf from the data passed in <imgdata>, which can be
+    bytes or any object supporting the buffer protocol. """
     # TODO similar to load_pixbuf, should be merged using callbacks etc.
     pixbuf = None
     last_error = None
@@ -611,11 +792,18 @@ def load_pixbuf_data(imgdata):
             # TODO use dynamic dispatch instead of "if" chain
             if provider == constants.IMAGEIO_GDKPIXBUF:
                 loader = GdkPixbuf.PixbufLoader()
-                loader.write(imgdata)
+                loader.write(_as_bytes(imgdata))
                 loader.close()
-                pixbuf = loader.get_pixbuf()
+                if prefs['animation mode'] != constants.ANIMATION_DISABLED:
+                    animation = loader.get_animation()
+                    if animation is not None and not animation.is_static_image():
+                        pixbuf = animation
+                if pixbuf is None:
+                    pixbuf = loader.get_pixbuf()
             elif provider == constants.IMAGEIO_PIL:
-                pixbuf = pil_to_pixbuf(Image.open(StringIO(imgdata)), keep_orientation=True)
+                # TODO When using PIL, whether or how animations work is
+                # currently undefined.
+                pixbuf = _load_pil_pixbuf(imgdata)
             else:
                 raise TypeError()
         except Exception as e:
@@ -628,7 +816,7 @@ def load_pixbuf_data(imgdata):
         log.debug("provider %s failed to decode %s bytes", provider, len(imgdata))
     if pixbuf is None:
         # raising necessary because caller expects pixbuf to be not None
-        raise last_error
+        raise last_error or TypeError()
     return pixbuf
 
 def enhance(pixbuf, brightness=1.0, contrast=1.0, saturation=1.0,
@@ -638,20 +826,100 @@ def enhance(pixbuf, brightness=1.0, contrast=1.0, saturation=1.0,
     no change. If <autocontrast> is True it overrides the <contrast> value,
     but only if the image mode is supported by ImageOps.autocontrast (i.e.
     it is L or RGB.)
+
+    Brightness and contrast are applied in one pass, see get_enhance_lut().
     """
     im = pixbuf_to_pil(pixbuf)
-    if brightness != 1.0:
-        im = ImageEnhance.Brightness(im).enhance(brightness)
-    if autocontrast and im.mode in ('L', 'RGB'):
-        im = ImageOps.autocontrast(im, cutoff=0.1)
-    elif contrast != 1.0:
-        im = ImageEnhance.Contrast(im).enhance(contrast)
+    autocontrast = autocontrast and im.mode in ('L', 'RGB')
+    if brightness != 1.0 or contrast != 1.0 or autocontrast:
+        im = im.point(get_enhance_lut(im, brightness, contrast, autocontrast))
     if saturation != 1.0:
         im = ImageEnhance.Color(im).enhance(saturation)
     if sharpness != 1.0:
         im = ImageEnhance.Sharpness(im).enhance(sharpness)
     return pil_to_pixbuf(im)
 
+def get_enhance_lut(im, brightness=1.0, contrast=1.0, autocontrast=False):
+    """Return a lookup table for Image.point() giving the same result on
+    the PIL image <im> as ImageEnhance.Brightness with <brightness>,
+    followed by ImageOps.autocontrast if <autocontrast> is True, or else
+    ImageEnhance.Contrast with <contrast>. The alpha channel is kept.
+
+    The statistics used by the contrast steps are computed from the
+    histogram of <im> mapped through the brightness table, instead of
+    from a brightened copy of the image.
+    """
+    def blend(value1, value2, alpha):
+        # Same single precision arithmetic and rounding as Image.blend.
+        product = _float32(alpha) * (value2 - value1)
+        value = _float32(value1 + _float32(product))
+        return 0 if value <= 0 else min(255, int(value))
+
+    brightness_lut = [blend(0, value, brightness) for value in range(256)]
+    bands = im.getbands()
+    if autocontrast or contrast != 1.0:
+        histogram = im.histogram()
+        # Histogram of each band after the brightness change.
+        band_histograms = []
+        for n, band in enumerate(bands):
+            band_histogram = [0] * 256
+            if band != 'A':
+                for value, count in enumerate(histogram[256 * n:256 * (n + 1)]):
+                    band_histogram[brightness_lut[value]] += count
+            band_histograms.append(band_histogram)
+    if not autocontrast and contrast != 1.0:
+        # ImageEnhance.Contrast blends with the mean grey level.
+        weights = {'L': 1.0, 'R': 0.299, 'G': 0.587, 'B': 0.114}
+        mean = 0.0
+        for band, band_histogram in zip(bands, band_histograms):
+            if band in weights:
+                pixels = sum(band_histogram) or 1
+                mean += weights[band] * sum(value * count for value, count
+                                            in enumerate(band_histogram)) / pixels
+        mean = int(mean + 0.5)
+        contrast_lut = [blend(mean, value, contrast) for value in range(256)]
+
+    lut = []
+    for n, band in enumerate(bands):
+        if band == 'A':
+            lut.extend(range(256))
+            continue
+        if autocontrast:
+            contrast_lut = _get_autocontrast_lut(band_histograms[n], 0.1)
+        elif contrast == 1.0:
+            lut.extend(brightness_lut)
+            continue
+        lut.extend(contrast_lut[value] for value in brightness_lut)
+    return lut
+
+def _float32(value):
+    return struct.unpack('f', struct.pack('f', value))[0]
+
+def _get_autocontrast_lut(histogram, cutoff):
+    """Return the table used by ImageOps.autocontrast for a band with
+    <histogram>, ignoring <cutoff> percent of the darkest and lightest
+    pixels."""
+    histogram = list(histogram)
+    pixels = sum(histogram)
+    for values in (range(256), range(255, -1, -1)):
+        cut = int(pixels * cutoff // 100)
+        for value in values:
+            if cut > histogram[value]:
+                cut -= histogram[value]
+                histogram[value] = 0
+            else:
+                histogram[value] -= cut
+                cut = 0
+            if cut <= 0:
+                break
+    used = [value for value in range(256) if histogram[value]]
+    if not used or used[-1] <= used[0]:
+        return list(range(256))
+    low, high = used[0], used[-1]
+    scale = 255.0 / (high - low)
+    offset = -low * scale
+    return [min(255, max(0, int(value * scale + offset))) for value in range(256)]
+
 def _get_png_implied_rotation(pixbuf_or_image):
     """Same as <get_implied_rotation> for PNG files.
 
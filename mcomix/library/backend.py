@@ -3,8 +3,10 @@
 import os
 import datetime
 
+from mcomix.preferences import prefs
 from mcomix import archive_tools
 from mcomix import constants
+from mcomix import cover_store
 from mcomix import thumbnail_tools
 from mcomix import log
 from mcomix import callback
@@ -153,14 +155,7 @@ class _LibraryBackend(object):
         """ Returns a pixbuf with a thumbnail of the cover of the book at <path>,
         or None, if no thumbnail could be generated. """
 
-        # Use the maximum image size allowed by the library, so that thumbnails
-        # might be downscaled, but never need to be upscaled (and look ugly).
-        thumbnailer = thumbnail_tools.Thumbnailer(dst_dir=constants.LIBRARY_COVERS_PATH,
-                                                  store_on_disk=True,
-                                                  archive_support=True,
-                                                  size=(constants.MAX_LIBRARY_COVER_SIZE,
-                                                        constants.MAX_LIBRARY_COVER_SIZE))
-        thumb = thumbnailer.thumbnail(path)
+        thumb = get_cover_thumbnailer().thumbnail(path)
 
         if thumb is None: log.warning( _('! Could not get cover for book "%s"'), path )
         return thumb
@@ -453,13 +448,17 @@ class _LibraryBackend(object):
                 self.remove_book(id)
                 deleted += 1
 
+        if collection is None and prefs['packed library covers']:
+            cover_store.compact()
+
         return deleted
 
     def remove_book(self, book):
         """Remove the <book> from the library."""
         path = self.get_book_path(book)
         if path is not None:
-            thumbnailer = thumbnail_tools.Thumbnailer(dst_dir=constants.LIBRARY_COVERS_PATH)
+            thumbnailer = thumbnail_tools.Thumbnailer(dst_dir=constants.LIBRARY_COVERS_PATH,
+                                                      packed=prefs['packed library covers'])
             thumbnailer.delete(path)
         self._con.execute('delete from Book where id = ?', (book,))
         self._con.execute('delete from Contain where book = ?', (book,))
@@ -501,6 +500,7 @@ class _LibraryBackend(object):
         if self._con is not None:
             self._con.commit()
             self._con.close()
+        cover_store.close()
 
         global _backend
         _backend = None
@@ -667,6 +667,18 @@ class _LibraryBackend(object):
 _backend = None
 
 
+def get_cover_thumbnailer():
+    """ Returns a Thumbnailer for the covers of library books. """
+    # Use the maximum image size allowed by the library, so that thumbnails
+    # might be downscaled, but never need to be upscaled (and look ugly).
+    return thumbnail_tools.Thumbnailer(dst_dir=constants.LIBRARY_COVERS_PATH,
+                                       store_on_disk=True,
+                                       archive_support=True,
+                                       size=(constants.MAX_LIBRARY_COVER_SIZE,
+                                             constants.MAX_LIBRARY_COVER_SIZE),
+                                       packed=prefs['packed library covers'])
+
+
 def LibraryBackend():
     """ Returns the singleton instance of the library backend. """
     global _backend
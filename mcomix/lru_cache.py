@@ -0,0 +1,146 @@
+""" lru_cache.py - Size-bounded cache with least recently used eviction. """
+
+import collections
+import threading
+
+
+class LRUCache(object):
+
+    """A thread-safe mapping that evicts its least recently used entries
+    once the total size of its values exceeds a budget.
+
+    The size of each value is computed with <sizeof> when it is added. Keys
+    passed to protect() are never evicted, so the cache may temporarily
+    grow past its budget if only protected entries remain.
+    """
+
+    def __init__(self, max_size=None, sizeof=len):
+        """Create a new cache holding at most <max_size> worth of values,
+        as measured by <sizeof>. A <max_size> of None means unbounded.
+        """
+        self._max_size = max_size
+        self._sizeof = sizeof
+        #: Map key > (value, size), least recently used first.
+        self._entries = collections.OrderedDict()
+        self._protected = frozenset()
+        self._size = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        """Return True if <key> is cached. Does not count as an access."""
+        return key in self._entries
+
+    def keys(self):
+        """Return the cached keys, least recently used first."""
+        with self._lock:
+            return list(self._entries.keys())
+
+    def get(self, key, default=None):
+        """Return the value for <key>, or <default> if it is not cached.
+        A successful lookup marks <key> as most recently used.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, key, default=None):
+        """Same as get(), but does not count as an access."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            return entry[0]
+
+    def put(self, key, value):
+        """Store <value> for <key>, evicting old entries if necessary."""
+        size = self._sizeof(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._entries[key] = (value, size)
+            self._size += size
+            self._trim()
+
+    def pop(self, key, default=None):
+        """Remove <key> from the cache and return its value, or <default>."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._size -= entry[1]
+            return entry[0]
+
+    def clear(self):
+        """Remove all entries and protections."""
+        with self._lock:
+            self._entries.clear()
+            self._protected = frozenset()
+            self._size = 0
+
+    def protect(self, keys):
+        """Exempt <keys> from eviction, replacing the previous set of
+        protected keys. Entries that are no longer protected may be
+        evicted right away if the cache is over budget.
+        """
+        with self._lock:
+            self._protected = frozenset(keys)
+            self._trim()
+
+    def set_max_size(self, max_size):
+        """Change the cache budget, evicting entries if necessary."""
+        with self._lock:
+            self._max_size = max_size
+            self._trim()
+
+    def get_max_size(self):
+        return self._max_size
+
+    def get_size(self):
+        """Return the total size of all cached values."""
+        return self._size
+
+    def is_full(self):
+        """Return True if no more values fit without evicting others."""
+        return self._max_size is not None and self._size >= self._max_size
+
+    def get_stats(self):
+        """Return a dictionary with the cache usage counters."""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size': self._size,
+                'max size': self._max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def _trim(self):
+        if self._max_size is None or self._size <= self._max_size:
+            return
+        for key in list(self._entries.keys()):
+            if self._size <= self._max_size:
+                break
+            if key in self._protected:
+                continue
+            value, size = self._entries.pop(key)
+            self._size -= size
+            self.evictions += 1
+
+# vim: expandtab:sw=4:ts=4
@@ -10,6 +10,7 @@ from gi.repository import GObject, Gdk, Gtk, GLib
 
 from mcomix import constants
 from mcomix import cursor_handler
+from mcomix import decode_pool
 from mcomix import i18n
 from mcomix import icons
 from mcomix import enhance_backend
@@ -24,6 +25,7 @@ from mcomix import ui
 from mcomix import slideshow
 from mcomix import status
 from mcomix import thumbbar
+from mcomix import thumbnail_index
 from mcomix import clipboard
 from mcomix import pageselect
 from mcomix import osd
@@ -68,6 +70,9 @@ class MainWindow(Gtk.Window):
         self.layout = layout.create_dummy_layout()
         self._spacing = prefs['space between two pages']
         self._waiting_for_redraw = False
+        self._waiting_for_prescale = False
+        #: Last colour set by the smart background
+        self._smart_bg_colour = None
 
         self._image_box = Gtk.HBox(False, 2) # XXX transitional(kept for osd.py)
         self._main_layout = Gtk.Layout()
@@ -88,6 +93,7 @@ class MainWindow(Gtk.Window):
         self.filehandler.file_opened += self._on_file_opened
         self.imagehandler = image_handler.ImageHandler(self)
         self.imagehandler.page_available += self._page_available
+        self.imagehandler.page_decoded += self._schedule_prescale
         self.thumbnailsidebar = thumbbar.ThumbnailSidebar(self)
         # if we give it a name, it is easier for me to theme later with CSS
         self.thumbnailsidebar.set_name("ThumbnailSidebar")
@@ -425,78 +431,21 @@ class MainWindow(Gtk.Window):
             return False
 
         if self.imagehandler.page_is_available():
-            distribution_axis = constants.DISTRIBUTION_AXIS
-            alignment_axis = constants.ALIGNMENT_AXIS
             pixbuf_count = 2 if self.displayed_double() else 1 # XXX limited to at most 2 pages
             pixbuf_list = list(self.imagehandler.get_pixbufs(pixbuf_count))
-            do_not_transform = [image_tools.is_animation(x) for x in pixbuf_list]
-            size_list = [[pixbuf.get_width(), pixbuf.get_height()]
-                         for pixbuf in pixbuf_list]
-
-            if self.is_manga_mode:
-                orientation = constants.MANGA_ORIENTATION
-            else:
-                orientation = constants.WESTERN_ORIENTATION
-
-            # Rotation handling:
-            # - apply Exif rotation on individual images
-            # - apply automatic rotation (size based) on whole page
-            # - apply manual rotation on whole page
-            if prefs['auto rotate from exif']:
-                rotation_list = [image_tools.get_implied_rotation(pixbuf)
-                                 for pixbuf in pixbuf_list]
-            else:
-                rotation_list = [0] * len(pixbuf_list)
-            virtual_size = [0, 0]
-            for i in range(pixbuf_count):
-                if rotation_list[i] in (90, 270):
-                    size_list[i].reverse()
-                size = size_list[i]
-                virtual_size[distribution_axis] += size[distribution_axis]
-                virtual_size[alignment_axis] = max(virtual_size[alignment_axis],
-                                                   size[alignment_axis])
-            rotation = image_tools.get_size_rotation(*virtual_size)
-            rotation = (rotation + prefs['rotation']) % 360
-            if rotation in (90, 270):
-                distribution_axis, alignment_axis = alignment_axis, distribution_axis
-                orientation = list(orientation)
-                orientation.reverse()
-                for i in range(pixbuf_count):
-                    if do_not_transform[i]:
-                        continue
-                    size_list[i].reverse()
-            if rotation in (180, 270):
-                orientation = tools.vector_opposite(orientation)
-            for i in range(pixbuf_count):
-                rotation_list[i] = (rotation_list[i] + rotation) % 360
-            if prefs['vertical flip'] and rotation in (90, 270):
-                orientation = tools.vector_opposite(orientation)
-            if prefs['horizontal flip'] and rotation in (0, 180):
-                orientation = tools.vector_opposite(orientation)
-
-            self.layout = layout.FiniteLayout.create_finite_layout(
-                pixbuf_count, orientation, self._spacing, distribution_axis,
-                alignment_axis, self._show_scrollbars, self.get_visible_area_size,
-                lambda zoom_dummy_size: self.zoom.get_zoomed_size(size_list, zoom_dummy_size,
-                distribution_axis, do_not_transform,
-                prefs['double page autoresize'] == constants.DOUBLE_PAGE_AUTORESIZE_SIZE))
+            self.layout, size_list, rotation_list, do_not_transform = \
+                self._create_layout(pixbuf_list, self._show_scrollbars,
+                                    self.get_visible_area_size)
             content_boxes = self.layout.get_content_boxes()
             scaled_sizes = list(map(box.Box.get_size, content_boxes))
 
+            first_index = self.imagehandler.get_current_page() - 1
             for i in range(pixbuf_count):
                 if do_not_transform[i]:
                     continue
-                pixbuf_list[i] = image_tools.fit_pixbuf_to_rectangle(
-                    pixbuf_list[i], scaled_sizes[i], rotation_list[i])
-
-            for i in range(pixbuf_count):
-                if do_not_transform[i]:
-                    continue
-                if prefs['horizontal flip']:
-                    pixbuf_list[i] = pixbuf_list[i].flip(horizontal=True)
-                if prefs['vertical flip']:
-                    pixbuf_list[i] = pixbuf_list[i].flip(horizontal=False)
-                pixbuf_list[i] = self.enhancer.enhance(pixbuf_list[i])
+                pixbuf_list[i] = self.imagehandler.get_display_pixbuf(
+                    first_index + i, pixbuf_list[i], scaled_sizes[i],
+                    rotation_list[i])
 
             for i in range(pixbuf_count):
                 image_tools.set_from_pixbuf(self.images[i], pixbuf_list[i])
@@ -513,13 +462,14 @@ class MainWindow(Gtk.Window):
             smartbg = prefs['smart bg']
             smartthumbbg = prefs['smart thumb bg'] and prefs['show thumbnails']
             if smartbg or smartthumbbg:
-                bg_colour = [0.05098039215686275,.06274509803921569,0.03137254901960784,1.0]
-                # bg_colour = self.imagehandler.get_pixbuf_auto_background(pixbuf_count)
+                bg_colour = self.imagehandler.get_pixbuf_auto_background(pixbuf_count)
                 # wyatt hack: probably should load a 1px image of background
                 # color and check value after applying correction instead
-                
-            if smartbg:
+
+            if smartbg and bg_colour != self._smart_bg_colour:
+                # set_bg_colour() redraws, only call it on changes.
                 self.set_bg_colour(bg_colour)
+                self._smart_bg_colour = bg_colour
             if smartthumbbg:
                 self.thumbnailsidebar.change_thumbnail_background_color(bg_colour)
 
@@ -552,6 +502,8 @@ class MainWindow(Gtk.Window):
                 self.scroll_to_predefined(destination, index)
 
             self._main_layout.get_bin_window().thaw_updates()
+
+            self._schedule_prescale()
         else:
             # Save scroll destination for when the page becomes available.
             self._last_scroll_destination = scroll_to
@@ -566,6 +518,139 @@ class MainWindow(Gtk.Window):
 
         return False
 
+    def _create_layout(self, pixbuf_list, scrollbar_update, visible_area_update):
+        """ Lay out the pages in <pixbuf_list> for display. <scrollbar_update>
+        and <visible_area_update> are passed to create_finite_layout.
+
+        Returns a tuple (layout, size_list, rotation_list, do_not_transform)
+        with the unscaled (but rotated) size and the rotation of each page,
+        and whether it must be displayed as is (animations). """
+        distribution_axis = constants.DISTRIBUTION_AXIS
+        alignment_axis = constants.ALIGNMENT_AXIS
+        pixbuf_count = len(pixbuf_list)
+        do_not_transform = [image_tools.is_animation(x) for x in pixbuf_list]
+        size_list = [[pixbuf.get_width(), pixbuf.get_height()]
+                     for pixbuf in pixbuf_list]
+
+        if self.is_manga_mode:
+            orientation = constants.MANGA_ORIENTATION
+        else:
+            orientation = constants.WESTERN_ORIENTATION
+
+        # Rotation handling:
+        # - apply Exif rotation on individual images
+        # - apply automatic rotation (size based) on whole page
+        # - apply manual rotation on whole page
+        if prefs['auto rotate from exif']:
+            rotation_list = [image_tools.get_implied_rotation(pixbuf)
+                             for pixbuf in pixbuf_list]
+        else:
+            rotation_list = [0] * len(pixbuf_list)
+        virtual_size = [0, 0]
+        for i in range(pixbuf_count):
+            if rotation_list[i] in (90, 270):
+                size_list[i].reverse()
+            size = size_list[i]
+            virtual_size[distribution_axis] += size[distribution_axis]
+            virtual_size[alignment_axis] = max(virtual_size[alignment_axis],
+                                               size[alignment_axis])
+        rotation = image_tools.get_size_rotation(*virtual_size)
+        rotation = (rotation + prefs['rotation']) % 360
+        if rotation in (90, 270):
+            distribution_axis, alignment_axis = alignment_axis, distribution_axis
+            orientation = list(orientation)
+            orientation.reverse()
+            for i in range(pixbuf_count):
+                if do_not_transform[i]:
+                    continue
+                size_list[i].reverse()
+        if rotation in (180, 270):
+            orientation = tools.vector_opposite(orientation)
+        for i in range(pixbuf_count):
+            rotation_list[i] = (rotation_list[i] + rotation) % 360
+        if prefs['vertical flip'] and rotation in (90, 270):
+            orientation = tools.vector_opposite(orientation)
+        if prefs['horizontal flip'] and rotation in (0, 180):
+            orientation = tools.vector_opposite(orientation)
+
+        page_layout = layout.FiniteLayout.create_finite_layout(
+            pixbuf_count, orientation, self._spacing, distribution_axis,
+            alignment_axis, scrollbar_update, visible_area_update,
+            lambda zoom_dummy_size: self.zoom.get_zoomed_size(size_list, zoom_dummy_size,
+            distribution_axis, do_not_transform,
+            prefs['double page autoresize'] == constants.DOUBLE_PAGE_AUTORESIZE_SIZE))
+
+        return page_layout, size_list, rotation_list, do_not_transform
+
+    def _get_emulated_viewport(self):
+        """ Return a (scrollbar_update, visible_area_update) pair of functions
+        for _create_layout that emulate the scrollbars instead of showing or
+        hiding them, so that pages can be laid out without being displayed. """
+        base_size = list(self.get_visible_area_size())
+        scrollbar_sizes = []
+        for scrollbar in self._scroll:
+            axis = self._toggle_axis[scrollbar]
+            requisition = scrollbar.size_request()
+            if constants.WIDTH_AXIS == axis:
+                size = requisition.width
+            else:
+                size = requisition.height
+            if scrollbar.get_visible():
+                base_size[axis] += size
+            scrollbar_sizes.append((axis, size))
+        limit = self._should_toggle_be_visible('show scrollbar')
+        requests = [False] * len(self._scroll)
+
+        def scrollbar_update(request):
+            requests[:] = [limit and r for r in request]
+
+        def visible_area_update():
+            size = list(base_size)
+            for requested, (axis, scrollbar_size) in zip(requests, scrollbar_sizes):
+                if requested:
+                    size[axis] -= scrollbar_size
+            return tuple(size)
+
+        return scrollbar_update, visible_area_update
+
+    def _schedule_prescale(self, *args):
+        """ Queue pre-scaling of the upcoming pages once idle. """
+        if not self._waiting_for_prescale:
+            self._waiting_for_prescale = True
+            GObject.idle_add(self._prescale_upcoming_pages,
+                             priority=GObject.PRIORITY_LOW)
+
+    def _prescale_upcoming_pages(self):
+        """ Ask the image handler to prepare the next pages for display,
+        using the layout they would get with the current viewport and
+        zoom mode. Only pages that are already decoded are considered. """
+        self._waiting_for_prescale = False
+        page_count = prefs['number of pages to prescale']
+        if not self.filehandler.file_loaded or page_count <= 0 or \
+           not self.imagehandler.page_is_available():
+            return False
+        pixbuf_count = 2 if self.displayed_double() else 1 # XXX limited to at most 2 pages
+        current_index = self.imagehandler.get_current_page() - 1
+        scrollbar_update, visible_area_update = self._get_emulated_viewport()
+        pages = []
+        for step in range(1, page_count + 1):
+            first_index = current_index + step * pixbuf_count
+            pixbuf_list = self.imagehandler.get_cached_pixbufs(first_index,
+                                                               pixbuf_count)
+            if pixbuf_list is None:
+                continue
+            page_layout, size_list, rotation_list, do_not_transform = \
+                self._create_layout(pixbuf_list, scrollbar_update,
+                                    visible_area_update)
+            scaled_sizes = list(map(box.Box.get_size,
+                                    page_layout.get_content_boxes()))
+            for i in range(pixbuf_count):
+                if do_not_transform[i]:
+                    continue
+                pages.append((first_index + i, scaled_sizes[i], rotation_list[i]))
+        self.imagehandler.prescale(pages)
+        return False
+
     def _update_page_information(self):
         """ Updates the window with information that can be gathered
         even when the page pixbuf(s) aren't ready yet. """
@@ -801,6 +886,7 @@ class MainWindow(Gtk.Window):
         self.zoom.set_fit_mode(prefs['zoom mode'])
         self.zoom.set_scale_up(prefs['stretch'])
         self.zoom.reset_user_zoom()
+        self.imagehandler.invalidate_prescaled()
         self.draw_image()
 
     def change_autorotation(self, radioaction=None, *args):
@@ -839,14 +925,17 @@ class MainWindow(Gtk.Window):
 
     def manual_zoom_in(self, *args):
         self.zoom.zoom_in()
+        self.imagehandler.invalidate_prescaled()
         self.draw_image()
 
     def manual_zoom_out(self, *args):
         self.zoom.zoom_out()
+        self.imagehandler.invalidate_prescaled()
         self.draw_image()
 
     def manual_zoom_original(self, *args):
         self.zoom.reset_user_zoom()
+        self.imagehandler.invalidate_prescaled()
         self.draw_image()
 
     def _show_scrollbars(self, request):
@@ -1012,6 +1101,7 @@ class MainWindow(Gtk.Window):
         format (r, g, b). Values are 16-bit.
         """
         colour = colour[:3]
+        self._smart_bg_colour = None
         self._event_box.modify_bg(Gtk.StateType.NORMAL, Gdk.Color(*colour))
         if prefs['thumbnail bg uses main colour']:
             self.thumbnailsidebar.change_thumbnail_background_color(prefs['bg colour'][:3])
@@ -1031,8 +1121,9 @@ class MainWindow(Gtk.Window):
         this_screen = 2 if self.displayed_double() else 1 # XXX limited to at most 2 pages
         for i in reversed(range(this_screen)) if self.is_manga_mode \
         else range(this_screen):
-            file_path = self.imagehandler.get_path_to_page(
-                self.imagehandler.get_current_page() + i)
+            file_path = self.filehandler.ensure_on_disk(
+                self.imagehandler.get_path_to_page(
+                    self.imagehandler.get_current_page() + i))
             if not file_path:
                 return
             file_name = os.path.split(file_path)[-1]
@@ -1221,6 +1312,8 @@ class MainWindow(Gtk.Window):
         if main_dialog._dialog is not None:
             main_dialog._dialog.close()
         backend.LibraryBackend().close()
+        decode_pool.shutdown()
+        thumbnail_index.close()
 
         # This hack is to avoid Python issue #1856.
         for thread in threading.enumerate():
@@ -72,6 +72,14 @@ class OpenWithCommand(object):
 
         current_dir = os.getcwd()
         try:
+            # The command expects the displayed pages to be actual files.
+            if window.filehandler.archive_type is not None:
+                page = window.imagehandler.get_current_page()
+                pages = 2 if window.displayed_double() else 1
+                for i in range(pages):
+                    window.filehandler.ensure_on_disk(
+                        window.imagehandler.get_path_to_page(page + i))
+
             if self.is_valid_workdir(window):
                 workdir = self.parse(window, text=self.get_cwd())[0]
                 os.chdir(workdir)
@@ -3,6 +3,7 @@
 from gi.repository import Gtk
 
 from mcomix.preferences import prefs
+from mcomix import worker_thread
 from mcomix.worker_thread import WorkerThread
 from mcomix import callback
 
@@ -71,7 +72,8 @@ class Pageselector(Gtk.Dialog):
 
         # Currently displayed thumbnail page.
         self._thumbnail_page = 0
-        self._thread = WorkerThread(self._generate_thumbnail, name='preview')
+        self._thread = WorkerThread(self._generate_thumbnail, name='preview',
+                                    priority_class=worker_thread.THUMBNAILS)
         self._update_thumbnail(int(self._selector_adjustment.props.value))
         self._window.imagehandler.page_available += self._page_available
 
@@ -81,6 +81,9 @@ prefs = {
     'sharpness': 1.0,
     'auto contrast': False,
     'max pages to cache': 7,
+    'page cache size': 512, # MiB of decoded pages
+    'display cache size': 128, # MiB of scaled pages
+    'number of pages to prescale': 2,
     'window x': 0,
     'window y': 0,
     'window height': 600,
@@ -97,12 +100,18 @@ prefs = {
     'statusbar fields': constants.STATUS_PAGE | constants.STATUS_RESOLUTION | \
                         constants.STATUS_PATH | constants.STATUS_FILENAME | constants.STATUS_FILESIZE,
     'max threads': 3,
+    'max worker threads': 0, # 0: two more than CPU cores
     'max extract threads': 1,
+    'max in-memory extraction size': 256, # MiB, 0: always extract to disk
+    'max decode threads': 0, # 0: one thread per CPU core
+    'decode in worker processes': False,
+    'packed library covers': False,
     'wrap mouse scroll': False,
     'scaling quality': 2,  # GdkPixbuf.InterpType.BILINEAR
     'pil scaling filter': -1, # Use a PIL filter (just lanczos for now) in main viewing area. -1 to just use GdkPixbuf
     'color managed display icc profile': False,
     'color management enabled': False,
+    'color manage on decode': False,
     'managed color rendering intent': 0, # PIL.ImageCms.INTENT_PERCEPTUAL
     'escape quits': False,
     'fit to size mode': constants.ZOOM_MODE_HEIGHT,
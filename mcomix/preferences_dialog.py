@@ -293,6 +293,10 @@ class _PreferencesDialog(Gtk.Dialog):
         )
         page.add_row(Gtk.Label(label=_('Color rendering intent:')),
             self._create_color_rendering_intent_combobox())
+        page.add_row(self._create_pref_check_button(
+            _('Apply color management when loading pages'),
+            'color manage on decode',
+            _('Convert pages to the display profile once when they are loaded, instead of every time they are drawn. Makes zooming and redrawing faster.')))
 
         return page
 
@@ -318,15 +322,55 @@ class _PreferencesDialog(Gtk.Dialog):
             1, 1, 16, 1, 4, 0,
             _('Set the maximum number of concurrent threads for formats that support it.')))
 
+        page.add_row(Gtk.Label(label=_('Maximum memory used for extracted files (in MiB):')),
+            self._create_pref_spinner('max in-memory extraction size',
+            1, 0, 16384, 16, 128, 0,
+            _('Set the memory available for keeping files extracted from archives in memory instead of writing them to a temporary directory. Files that do not fit are extracted to disk. A value of 0 always extracts to disk. Takes effect when the next archive is opened.')))
+
+        page.add_row(Gtk.Label(label=_('Maximum number of concurrent decoding threads:')),
+            self._create_pref_spinner('max decode threads',
+            1, 0, 64, 1, 4, 0,
+            _('Set the maximum number of pages decoded in parallel. A value of 0 will use one thread per CPU core.')))
+
+        page.add_row(self._create_pref_check_button(
+            _('Decode images in separate processes'),
+            'decode in worker processes',
+            _('Decode images not supported by GdkPixbuf, such as JPEG XL, in separate processes, so that several of them can be decoded at the same time. Uses more memory.')))
+
+        page.add_row(Gtk.Label(label=_('Maximum number of background threads:')),
+            self._create_pref_spinner('max worker threads',
+            1, 0, 64, 1, 4, 0,
+            _('Set the maximum number of threads used for extraction, decoding, thumbnails and other background work, all combined. A value of 0 will use two more threads than CPU cores.')))
+
         page.add_row(self._create_pref_check_button(
             _('Store thumbnails for opened files'),
             'create thumbnails',
             _('Store thumbnails for opened files according to the freedesktop.org specification. These thumbnails are shared by many other applications, such as most file managers.')))
 
+        page.add_row(self._create_pref_check_button(
+            _('Store library covers in a single file'),
+            'packed library covers',
+            _('Store the covers of library books in one database instead of one file per book, which makes opening large libraries faster. Covers of books that no longer exist are removed when cleaning up the whole library.')))
+
         page.add_row(Gtk.Label(label=_('Maximum number of pages to store in the cache:')),
             self._create_pref_spinner('max pages to cache',
             1, -1, 500, 1, 3, 0,
-            _('Set the max number of pages to cache. A value of -1 will cache the entire archive.')))
+            _('Set the max number of pages around the current page to cache. A value of -1 will cache as much of the archive as the page cache memory allows.')))
+
+        page.add_row(Gtk.Label(label=_('Maximum memory used by the page cache (in MiB):')),
+            self._create_pref_spinner('page cache size',
+            1, 16, 65536, 16, 128, 0,
+            _('Set the memory available for decoded pages. When it is exceeded, the least recently viewed pages are dropped first.')))
+
+        page.add_row(Gtk.Label(label=_('Maximum memory used by the display cache (in MiB):')),
+            self._create_pref_spinner('display cache size',
+            1, 0, 16384, 16, 128, 0,
+            _('Set the memory available for pages already scaled and enhanced for display, so that redrawing or going back to a page is instant. A value of 0 disables this cache.')))
+
+        page.add_row(Gtk.Label(label=_('Number of upcoming pages to prepare for display:')),
+            self._create_pref_spinner('number of pages to prescale',
+            1, 0, 20, 1, 2, 0,
+            _('Set the number of following pages that are scaled for the current window size and zoom mode in the background, so that turning the page only has to show them.')))
 
         page.new_section(_('Magnifying Lens'))
 
@@ -738,6 +782,7 @@ class _PreferencesDialog(Gtk.Dialog):
             prefs['managed color rendering intent'] = value
 
             if value != last_value:
+                self._window.imagehandler.invalidate_color_managed()
                 self._window.draw_image()
 
 
@@ -891,6 +936,8 @@ class _PreferencesDialog(Gtk.Dialog):
 
         elif preference in ('checkered bg for transparent images',
           'no double page for wide images', 'auto rotate from exif', 'color management enabled', 'cube lut enabled'):
+            if preference == 'color management enabled':
+                self._window.imagehandler.invalidate_color_managed()
             self._window.draw_image()
 
         elif (preference == 'hide all in fullscreen' and
@@ -962,7 +1009,8 @@ class _PreferencesDialog(Gtk.Dialog):
             self._window.thumbnailsidebar.resize()
             self._window.draw_image()
 
-        elif preference == 'max pages to cache':
+        elif preference in ('max pages to cache', 'page cache size',
+                            'display cache size', 'number of pages to prescale'):
             prefs[preference] = int(value)
             self._window.imagehandler.do_cacheing()
 
@@ -974,9 +1022,14 @@ class _PreferencesDialog(Gtk.Dialog):
             prefs[preference] = int(value)
             self._window.change_zoom_mode()
 
-        elif preference == 'max extract threads':
+        elif preference in ('max extract threads', 'max in-memory extraction size',
+                            'max worker threads'):
             prefs[preference] = int(value)
 
+        elif preference == 'max decode threads':
+            prefs[preference] = int(value)
+            self._window.imagehandler.do_cacheing()
+
         elif preference == 'space between two pages':
             prefs[preference] = int(value)
             self._window.update_space()
@@ -1031,6 +1084,7 @@ class _PreferencesDialog(Gtk.Dialog):
                 except FileNotFoundError:
                     # doesn't exist, reset to null
                     prefs[preference]=default
+                self._window.imagehandler.invalidate_color_managed()
                 self._window.draw_image() # redraw required
             elif preference=='userstyle':
                 self._window.load_style(path=prefs[preference])
@@ -1045,6 +1099,7 @@ class _PreferencesDialog(Gtk.Dialog):
         prefs[preference]=default
         chooser.set_label(prefs[preference] or _('(default)'))
         if preference=='color managed display icc profile':
+            self._window.imagehandler.invalidate_color_managed()
             self._window.draw_image() # redraw required
         elif preference=='userstyle':
             self._window.load_style()
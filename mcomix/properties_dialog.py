@@ -90,7 +90,8 @@ class _PropertiesDialog(Gtk.Dialog):
         if not window.imagehandler.page_is_available():
             return
         self._update_page_image(page)
-        path = window.imagehandler.get_path_to_page()
+        path = window.filehandler.ensure_on_disk(
+            window.imagehandler.get_path_to_page())
         filename = os.path.basename(path)
         page.set_filename(filename)
         width, height = window.imagehandler.get_size()
@@ -73,6 +73,14 @@ def parse_arguments(argv):
             help=_('Start the application with zoom set to fit height.'))
     parser.add_option_group(fitmodes)
 
+    covers = optparse.OptionGroup(parser, _('Library covers'))
+    covers.add_option('--build-covers', dest='build_covers', action='store_true',
+            help=_('Create the library covers of the books in PATH, or of all the books in the library if no PATH is given, and exit. Covers that are up to date are skipped.'))
+    covers.add_option('-j', '--jobs', dest='jobs', action='store', type='int',
+            metavar='N', default=None,
+            help=_('Number of processes creating covers. Defaults to the number of CPU cores.'))
+    parser.add_option_group(covers)
+
     debugopts = optparse.OptionGroup(parser, _('Debug options'))
     debugopts.add_option('-W', dest='loglevel', action='store',
             choices=('all', 'debug', 'info', 'warn', 'error'), default='warn',
@@ -166,6 +174,11 @@ def run():
     if not os.path.exists(constants.CONFIG_DIR):
         os.makedirs(constants.CONFIG_DIR, 0o700)
 
+    if opts.build_covers:
+        from mcomix import cover_builder
+        failed = cover_builder.build_covers(args or None, processes=opts.jobs)
+        sys.exit(1 if failed else 0)
+
     from mcomix import icons
     icons.load_icons()
 
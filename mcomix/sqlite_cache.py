@@ -0,0 +1,87 @@
+""" sqlite_cache.py - Single table SQLite databases used as caches.
+
+The table is dropped and created again whenever its format changes, as
+recorded by the user_version of the database, since its content can always
+be rebuilt.
+"""
+
+import contextlib
+import os
+import threading
+
+from mcomix import log
+
+try:
+    from sqlite3 import dbapi2
+except ImportError:
+    dbapi2 = None
+
+class SQLiteCache(object):
+
+    """A database holding the single table <table>, created by <schema>,
+    stored at the path returned by <get_path>, which is called again each
+    time the database is used so that it can be moved. <version> must be
+    bumped whenever <schema> changes. When <synchronous> is False, the last
+    writes may be lost on a crash, which makes them much faster.
+    <description> names the database in log messages.
+    """
+
+    def __init__(self, description, get_path, table, schema, version,
+                 synchronous=True):
+        self._description = description
+        self._get_path = get_path
+        self._table = table
+        self._schema = schema
+        self._version = version
+        self._synchronous = synchronous
+        self._connection = None
+        self._connection_path = None
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Context manager holding the lock of the database, which gives
+        the connection to it, opened if necessary, or None if it cannot be
+        used."""
+        with self._lock:
+            yield self._get_connection()
+
+    def close(self):
+        """Close the database, it is opened again when needed."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+            self._connection = self._connection_path = None
+
+    def _get_connection(self):
+        """Return the connection to the database, see connection(). Must
+        be called with _lock held."""
+        path = self._get_path()
+        if self._connection_path == path:
+            return self._connection
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        self._connection_path = path
+        if dbapi2 is None:
+            return None
+        try:
+            directory = os.path.dirname(path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            connection = dbapi2.connect(path, check_same_thread=False)
+            if not self._synchronous:
+                connection.execute('pragma synchronous = off')
+            version = connection.execute('pragma user_version').fetchone()[0]
+            if version != self._version:
+                with connection:
+                    connection.execute('drop table if exists %s' % self._table)
+                    connection.execute(self._schema)
+                    connection.execute('pragma user_version = %d' % self._version)
+        except (OSError, dbapi2.Error) as e:
+            log.warning('Could not open %s "%s": %s', self._description, path, e)
+            return None
+        self._connection = connection
+        return self._connection
+
+# vim: expandtab:sw=4:ts=4
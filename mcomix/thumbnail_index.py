@@ -0,0 +1,89 @@
+""" thumbnail_index.py - Index of the metadata of stored thumbnails.
+
+Checking whether a stored thumbnail is up to date requires the modification
+time of its source, which is kept in a tEXt chunk of the thumbnail PNG. This
+module remembers it, along with the dimensions of the thumbnail, so that the
+check does not have to open the PNG. Entries are only trusted while the
+thumbnail file keeps the same size and modification time, since thumbnails
+may be replaced by other programs.
+"""
+
+import os
+
+from mcomix import constants
+from mcomix import log
+from mcomix import sqlite_cache
+
+#: Bumped whenever the format of the index changes.
+INDEX_VERSION = 1
+
+# This is only a cache, losing the last writes is harmless.
+_index = sqlite_cache.SQLiteCache(
+    'thumbnail index', lambda: constants.THUMBNAIL_INDEX_PATH, 'Thumbnail',
+    '''create table Thumbnail (
+        path text primary key,
+        thumb_mtime integer,
+        thumb_size integer,
+        source_mtime integer,
+        width integer,
+        height integer)''', INDEX_VERSION, synchronous=False)
+
+def lookup(thumbpath):
+    """Return (source_mtime, width, height) for the thumbnail stored at
+    <thumbpath>, or None if it is not indexed, or changed since it was.
+    """
+    try:
+        stat = os.stat(thumbpath)
+    except OSError:
+        return None
+    with _index.connection() as connection:
+        if connection is None:
+            return None
+        row = connection.execute('''select thumb_mtime, thumb_size,
+            source_mtime, width, height from Thumbnail where path = ?''',
+            (thumbpath,)).fetchone()
+    if row is None:
+        return None
+    thumb_mtime, thumb_size, source_mtime, width, height = row
+    if thumb_mtime != stat.st_mtime_ns or thumb_size != stat.st_size:
+        return None
+    return source_mtime, width, height
+
+def record(thumbpath, source_mtime, width, height):
+    """Remember that the thumbnail stored at <thumbpath>, of <width> by
+    <height> pixels, was created from a source modified at <source_mtime>.
+    """
+    try:
+        stat = os.stat(thumbpath)
+    except OSError:
+        return
+    with _index.connection() as connection:
+        if connection is None:
+            return
+        try:
+            with connection:
+                connection.execute('''insert or replace into Thumbnail
+                    (path, thumb_mtime, thumb_size, source_mtime, width, height)
+                    values (?, ?, ?, ?, ?, ?)''',
+                    (thumbpath, stat.st_mtime_ns, stat.st_size,
+                     int(source_mtime), width, height))
+        except sqlite_cache.dbapi2.Error as e:
+            log.warning('Could not index thumbnail "%s": %s', thumbpath, e)
+
+def forget(thumbpath):
+    """Remove the entry for <thumbpath>, if any."""
+    with _index.connection() as connection:
+        if connection is None:
+            return
+        try:
+            with connection:
+                connection.execute('delete from Thumbnail where path = ?',
+                                   (thumbpath,))
+        except sqlite_cache.dbapi2.Error as e:
+            log.warning('Could not index thumbnail "%s": %s', thumbpath, e)
+
+def close():
+    """Close the index, it is opened again when needed."""
+    _index.close()
+
+# vim: expandtab:sw=4:ts=4
@@ -7,10 +7,10 @@ import re
 import shutil
 import tempfile
 import mimetypes
-import threading
 import itertools
 import traceback
 import locale
+from io import BytesIO
 import PIL.Image as Image
 import jxlpy
 import jxlpy.JXLImagePlugin
@@ -23,6 +23,7 @@ except ImportError:
 
 from mcomix.preferences import prefs
 from mcomix import archive_extractor
+from mcomix import archive_toc
 from mcomix import constants
 from mcomix import archive_tools
 from mcomix import tools
@@ -30,7 +31,10 @@ from mcomix import image_tools
 from mcomix import portability
 from mcomix import i18n
 from mcomix import callback
+from mcomix import cover_store
 from mcomix import log
+from mcomix import thumbnail_index
+from mcomix import worker_thread
 
 # kill zip bomb warnings from PIL
 Image.MAX_IMAGE_PIXELS = None
@@ -42,7 +46,8 @@ class Thumbnailer(object):
     or simply creates new thumbnails each time it is called. """
 
     def __init__(self, dst_dir=constants.THUMBNAIL_PATH, store_on_disk=None,
-                 size=None, force_recreation=False, archive_support=False):
+                 size=None, force_recreation=False, archive_support=False,
+                 packed=False):
         """
         <dst_dir> set the thumbnailer's storage directory.
 
@@ -60,6 +65,9 @@ class Thumbnailer(object):
         If <archive_support> is True, support for archive thumbnail creation
         (based on cover detection) is enabled. Otherwise, only image files are
         supported.
+
+        If <packed> is True, thumbnails are stored in the packed cover store
+        instead of one file per thumbnail in <dst_dir>.
         """
         self.dst_dir = dst_dir
         if store_on_disk is None:
@@ -74,6 +82,7 @@ class Thumbnailer(object):
             self.default_sizes = False
         self.force_recreation = force_recreation
         self.archive_support = archive_support
+        self.packed = packed
 
     def thumbnail(self, filepath, threaded=False):
         """ Returns a thumbnail pixbuf for <filepath>, transparently handling
@@ -88,22 +97,44 @@ class Thumbnailer(object):
             self.width = prefs['thumbnail size']
             self.height = prefs['thumbnail size']
 
-        if self._thumbnail_exists(filepath):
-            thumbpath = self._path_to_thumbpath(filepath)
-            pixbuf = image_tools.load_pixbuf(thumbpath)
+        pixbuf = self._load_thumbnail(filepath)
+        if pixbuf is not None:
             self.thumbnail_finished(filepath, pixbuf)
             return pixbuf
 
         else:
             if threaded:
-                thread = threading.Thread(target=self._create_thumbnail, args=(filepath,))
-                thread.name += '-thumbnailer'
-                thread.setDaemon(True)
-                thread.start()
+                worker_thread.submit(worker_thread.THUMBNAILS,
+                                     self._create_thumbnail, filepath)
                 return None
             else:
                 return self._create_thumbnail(filepath)
 
+    def is_up_to_date(self, filepath):
+        """ Returns True if a stored thumbnail for <filepath> can be re-used,
+        see _load_thumbnail(). Unlike thumbnail(), the thumbnail is not
+        loaded. """
+
+        if self.force_recreation:
+            return False
+        if self.packed:
+            entry = cover_store.load(filepath)
+            return entry is not None and self._is_fresh(filepath, *entry[:3])
+        thumbpath = self._path_to_thumbpath(filepath)
+        entry = thumbnail_index.lookup(thumbpath)
+        if entry is None:
+            if not os.path.isfile(thumbpath):
+                return False
+            # Only the PNG header is read.
+            try:
+                img = Image.open(thumbpath)
+                stored_mtime = int(float(img.info['Thumb::MTime']))
+            except (IOError, SyntaxError, KeyError, ValueError):
+                return False
+            entry = (stored_mtime,) + img.size
+            thumbnail_index.record(thumbpath, *entry)
+        return self._is_fresh(filepath, *entry)
+
     @callback.Callback
     def thumbnail_finished(self, filepath, pixbuf):
         """ Called every time a thumbnail has been completed.
@@ -114,7 +145,10 @@ class Thumbnailer(object):
 
     def delete(self, filepath):
         """ Deletes the thumbnail for <filepath> (if it exists) """
+        if self.packed:
+            cover_store.remove(filepath)
         thumbpath = self._path_to_thumbpath(filepath)
+        thumbnail_index.forget(thumbpath)
         if os.path.isfile(thumbpath):
             try:
                 os.remove(thumbpath)
@@ -131,6 +165,12 @@ class Thumbnailer(object):
         else:
             mime = None
         if mime is not None:
+            result = self._create_archive_thumbnail_pixbuf(filepath, mime)
+            if result is not None:
+                return result
+
+            # Fall back to extracting the cover to disk, e.g. for covers
+            # within archives within the archive.
             cleanup = []
             try:
                 tmpdir = tempfile.mkdtemp(prefix='mcomix_archive_thumb.')
@@ -181,6 +221,51 @@ class Thumbnailer(object):
         else:
             return None, None
 
+    def _create_archive_thumbnail_pixbuf(self, filepath, mime):
+        """ Creates a thumbnail pixbuf for the archive <filepath> by only
+        reading its cover in memory, using the cached table of contents if
+        there is one. Returns the same as _create_thumbnail_pixbuf, or None
+        if the cover must be extracted to disk instead. """
+
+        archive = archive_tools.get_archive_handler(filepath, mimetype=mime)
+        if archive is None:
+            return None
+        try:
+            handler_name = archive.get_handler_name()
+            toc = archive_toc.load(filepath, handler_name)
+            if toc is None:
+                files = archive.list_contents()
+                toc = archive_toc.create(archive, files)
+                if files:
+                    archive_toc.save(filepath, handler_name, toc)
+            if not toc['memory']:
+                return None
+            wanted = self._guess_cover(toc['files'])
+            if wanted is None:
+                return None
+            try:
+                data = archive.read(wanted)
+            except Exception as ex:
+                # The cover might be within an archive within the archive.
+                log.debug('Could not read cover "%s" of "%s" in memory: %s',
+                          wanted, filepath, ex)
+                return None
+            if data is None:
+                return None
+        finally:
+            archive.close()
+
+        pixbuf = image_tools.load_pixbuf_size(data, self.width, self.height, is_thumb=True)
+        if self.store_on_disk:
+            try:
+                image_size = Image.open(BytesIO(data)).size
+            except (IOError, SyntaxError):
+                image_size = (pixbuf.get_width(), pixbuf.get_height())
+            tEXt_data = self._get_text_data(filepath, image_size=image_size)
+        else:
+            tEXt_data = None
+        return pixbuf, tEXt_data
+
     def _create_thumbnail(self, filepath):
         """ Creates the thumbnail pixbuf for <filepath>, and saves the pixbuf
         to disk if necessary. Returns the created pixbuf, or None, if creation failed. """
@@ -189,20 +274,26 @@ class Thumbnailer(object):
         self.thumbnail_finished(filepath, pixbuf)
 
         if pixbuf and self.store_on_disk:
-            thumbpath = self._path_to_thumbpath(filepath)
-            self._save_thumbnail(pixbuf, thumbpath, tEXt_data)
+            if self.packed:
+                self._save_packed_thumbnail(pixbuf, filepath, tEXt_data)
+            else:
+                thumbpath = self._path_to_thumbpath(filepath)
+                self._save_thumbnail(pixbuf, thumbpath, tEXt_data)
 
         return pixbuf
 
-    def _get_text_data(self, filepath):
-        """ Creates a tEXt dictionary for <filepath>. """
+    def _get_text_data(self, filepath, image_size=None):
+        """ Creates a tEXt dictionary for <filepath>. The image dimensions
+        are read from <filepath>, unless given as <image_size>. """
         mime = mimetypes.guess_type(filepath)[0] or "unknown/mime"
         uri = portability.uri_prefix() + pathname2url(os.path.normpath(filepath))
         stat = os.stat(filepath)
         # MTime could be floating point number, so convert to long first to have a fixed point number
         mtime = str(int(stat.st_mtime))
         size = str(stat.st_size)
-        format, (width, height), providers = image_tools.get_image_info(filepath)
+        if image_size is None:
+            format, image_size, providers = image_tools.get_image_info(filepath)
+        width, height = image_size
         return {
             'tEXt::Thumb::URI':           uri,
             'tEXt::Thumb::MTime':         mtime,
@@ -231,38 +322,87 @@ class Thumbnailer(object):
                 option_values.append(value)
             pixbuf.savev(thumbpath, 'png', option_keys, option_values)
             os.chmod(thumbpath, 0o600)
+            thumbnail_index.record(thumbpath, tEXt_data['tEXt::Thumb::MTime'],
+                                   pixbuf.get_width(), pixbuf.get_height())
 
         except Exception as ex:
             log.warning( _('! Could not save thumbnail "%(thumbpath)s": %(error)s'),
                 { 'thumbpath' : thumbpath, 'error' : ex } )
 
-    def _thumbnail_exists(self, filepath):
-        """ Checks if the thumbnail for <filepath> already exists.
-        This function will return False if the thumbnail exists
-        and it's mTime doesn't match the mTime of <filepath>,
-        it's size is different from the one specified in the thumbnailer,
-        or if <force_recreation> is True. """
-
-        if not self.force_recreation:
-            thumbpath = self._path_to_thumbpath(filepath)
-
-            if os.path.isfile(thumbpath):
-                # Check the thumbnail's stored mTime
-                try:
-                    img = Image.open(thumbpath)
-                except IOError:
-                    return False
-
-                info = img.info
-                stored_mtime = int(float(info['Thumb::MTime']))
-                # The source file might no longer exist
-                file_mtime = os.path.isfile(filepath) and int(os.stat(filepath).st_mtime) or stored_mtime
-                return stored_mtime == file_mtime and \
-                    max(*img.size) == max(self.width, self.height)
-            else:
-                return False
-        else:
-            return False
+    def _save_packed_thumbnail(self, pixbuf, filepath, tEXt_data):
+        """ Saves <pixbuf> in the packed cover store as the thumbnail for
+        <filepath>, see _save_thumbnail(). """
+        try:
+            success, data = pixbuf.save_to_bufferv('png', [], [])
+            if not success:
+                raise ValueError('PNG encoding failed')
+        except Exception as ex:
+            log.warning( _('! Could not save thumbnail "%(thumbpath)s": %(error)s'),
+                { 'thumbpath' : filepath, 'error' : ex } )
+            return
+        cover_store.save(filepath, tEXt_data['tEXt::Thumb::MTime'],
+                         pixbuf.get_width(), pixbuf.get_height(), data)
+
+    def _load_packed_thumbnail(self, filepath):
+        """ Returns the thumbnail for <filepath> from the packed cover
+        store, or None, see _load_thumbnail(). """
+        entry = cover_store.load(filepath)
+        if entry is None:
+            return None
+        stored_mtime, width, height, data = entry
+        if not self._is_fresh(filepath, stored_mtime, width, height):
+            return None
+        try:
+            img = Image.open(BytesIO(data))
+            img.load()
+        except (IOError, SyntaxError):
+            return None
+        return image_tools.pil_to_pixbuf(img, is_thumb=True)
+
+    def _load_thumbnail(self, filepath):
+        """ Returns the stored thumbnail for <filepath>, or None if there
+        is none, or if it is outdated: when it's mTime doesn't match the
+        mTime of <filepath>, it's size is different from the one specified
+        in the thumbnailer, or if <force_recreation> is True.
+
+        The stored mTime and size are looked up in the thumbnail index
+        first, so that outdated thumbnails are not opened at all, and
+        fresh ones are only read once. """
+
+        if self.force_recreation:
+            return None
+        if self.packed:
+            return self._load_packed_thumbnail(filepath)
+        thumbpath = self._path_to_thumbpath(filepath)
+        entry = thumbnail_index.lookup(thumbpath)
+        if entry is not None and not self._is_fresh(filepath, *entry):
+            return None
+        if entry is None and not os.path.isfile(thumbpath):
+            return None
+        try:
+            img = Image.open(thumbpath)
+            img.load()
+        except (IOError, SyntaxError):
+            return None
+        if entry is None:
+            # Not indexed yet, check the thumbnail's stored mTime
+            try:
+                stored_mtime = int(float(img.info['Thumb::MTime']))
+            except (KeyError, ValueError):
+                return None
+            thumbnail_index.record(thumbpath, stored_mtime, *img.size)
+            if not self._is_fresh(filepath, stored_mtime, *img.size):
+                return None
+        return image_tools.pil_to_pixbuf(img, is_thumb=True)
+
+    def _is_fresh(self, filepath, stored_mtime, width, height):
+        """ Returns True if a thumbnail of <width> by <height> pixels,
+        created from <filepath> when it was last modified at <stored_mtime>,
+        can be re-used. """
+        # The source file might no longer exist
+        file_mtime = os.path.isfile(filepath) and int(os.stat(filepath).st_mtime) or stored_mtime
+        return stored_mtime == file_mtime and \
+            max(width, height) == max(self.width, self.height)
 
     def _path_to_thumbpath(self, filepath):
         """ Converts <path> to an URI for the thumbnail in <dst_dir>. """
@@ -5,6 +5,7 @@ from gi.repository import Gtk
 from gi.repository import GObject
 
 from mcomix.preferences import prefs
+from mcomix import worker_thread
 from mcomix.worker_thread import WorkerThread
 
 
@@ -32,7 +33,8 @@ class ThumbnailViewBase(object):
         self._thread = WorkerThread(self._pixbuf_worker,
                                     name='thumbview',
                                     unique_orders=True,
-                                    max_threads=prefs["max threads"])
+                                    max_threads=prefs["max threads"],
+                                    priority_class=worker_thread.THUMBNAILS)
 
     def generate_thumbnail(self, uid):
         """ This function must return the thumbnail for C{uid}. """
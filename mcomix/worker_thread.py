@@ -1,36 +1,209 @@
 """ Worker thread class. """
 
 
+import heapq
+import itertools
+import os
 import threading
 import traceback
 
 from mcomix import log
+from mcomix.preferences import prefs
+
+#: Priority classes of work orders, from highest to lowest priority.
+#: Pages about to be displayed, and the extractions they depend on.
+VISIBLE = 0
+#: Pages prepared ahead of time for faster page turns.
+PREFETCH = 1
+#: Thumbnails and previews.
+THUMBNAILS = 2
+#: Background maintenance: library scans, cleanups, packing.
+MAINTENANCE = 3
+PRIORITY_CLASSES = (VISIBLE, PREFETCH, THUMBNAILS, MAINTENANCE)
+
+#: Marks cancelled entries in the orders heap.
+_CANCELLED = object()
+
+
+class _Scheduler(object):
+
+    """ Process-wide pool of threads shared by all WorkerThread instances.
+
+    Worker threads are started on demand, up to a global limit, and pick
+    their next order from the queues of the highest priority class first.
+    Queues of the same class are served in turn. The last free thread is
+    reserved to the VISIBLE class, so that background work waiting on an
+    extraction can never starve the extraction itself. Threads exit as
+    soon as there is nothing left to run.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        #: Map priority class > list of queues with pending orders.
+        self._queues = dict((priority_class, []) for priority_class in PRIORITY_CLASSES)
+        self._threads = []
+        #: Number of threads currently processing an order.
+        self._busy = 0
+        self._local = threading.local()
+
+    def get_max_threads(self):
+        """Return the maximum number of threads running at the same time."""
+        max_threads = prefs['max worker threads']
+        if max_threads <= 0:
+            max_threads = (os.cpu_count() or 1) + 2
+        return max(max_threads, 2)
+
+    def get_queue_depths(self):
+        """Return a dictionary mapping each priority class to the number
+        of orders waiting for processing in that class."""
+        with self._condition:
+            return dict((priority_class,
+                         sum(queue._orders_count for queue in queues))
+                        for priority_class, queues in self._queues.items())
+
+    def get_current_queue(self):
+        """Return the queue whose order the calling thread is processing,
+        or None."""
+        return getattr(self._local, 'queue', None)
+
+    def register(self, queue):
+        """Make the pending orders of <queue> available to worker threads,
+        and start new threads if necessary. Must be called with the lock
+        held."""
+        queues = self._queues[queue._priority_class]
+        if queue not in queues:
+            queues.append(queue)
+        max_threads = self.get_max_threads()
+        nb_threads = min(max_threads - len(self._threads),
+                         queue._get_free_slots())
+        for n in range(nb_threads):
+            thread = threading.Thread(target=self._run)
+            thread.name += '-worker'
+            thread.daemon = False
+            self._threads.append(thread)
+            thread.start()
+
+    def _pick_order(self, max_threads):
+        for priority_class in PRIORITY_CLASSES:
+            if priority_class != VISIBLE and self._busy >= max_threads - 1:
+                break
+            queues = self._queues[priority_class]
+            for n, queue in enumerate(queues):
+                if 0 == queue._get_free_slots():
+                    continue
+                order = queue._pop_order()
+                # Serve the other queues of this class first next time.
+                del queues[n]
+                if queue._orders_count > 0:
+                    queues.append(queue)
+                return queue, order
+            # Forget about queues with nothing left to run.
+            queues[:] = [queue for queue in queues
+                         if queue._orders_count > 0]
+        return None
+
+    def _run(self):
+        thread = threading.current_thread()
+        thread_name = thread.name
+        queue = None
+        while True:
+            with self._condition:
+                if queue is not None:
+                    queue._order_done(order)
+                    self._busy -= 1
+                    self._condition.notify_all()
+                picked = None
+                if self._busy < self.get_max_threads():
+                    picked = self._pick_order(self.get_max_threads())
+                if picked is None:
+                    self._threads.remove(thread)
+                    return
+                queue, order = picked
+                self._busy += 1
+            if queue._name is not None:
+                thread.name = thread_name + '-' + queue._name
+            self._local.queue = queue
+            try:
+                queue._run_order(order)
+            finally:
+                self._local.queue = None
+                thread.name = thread_name
+
+_scheduler = _Scheduler()
+
+def get_queue_depths():
+    """Return a dictionary mapping each priority class to the number of
+    orders waiting for processing in that class, for all worker threads."""
+    return _scheduler.get_queue_depths()
+
+def submit(priority_class, function, *args):
+    """Call <function> with <args> in a worker thread, with the priority
+    of <priority_class>. Return a threading.Event which is set once
+    <function> has returned."""
+    done = threading.Event()
+    with _scheduler._condition:
+        queue = _task_queues.get(priority_class)
+        if queue is None:
+            queue = _task_queues[priority_class] = WorkerThread(
+                _run_task, name='task', max_threads=None,
+                priority_class=priority_class)
+    queue.append_order((function, args, done))
+    return done
+
+def _run_task(order):
+    function, args, done = order
+    try:
+        function(*args)
+    finally:
+        done.set()
+
+#: Map priority class > WorkerThread running tasks passed to submit().
+_task_queues = {}
+
 
 class WorkerThread(object):
 
     def __init__(self, process_order, name=None, max_threads=1,
-                 sort_orders=False, unique_orders=False):
-        """Create a new pool of worker threads.
-
-        Optional <name> will be added to spawned thread names.
-        <process_order> will be called to process each work order.
-        At most <max_threads> will be started for processing.
-        If <sort_orders> is True, the orders queue will be sorted
-        after each addition. If <unique_orders> is True, duplicate
-        orders will not be added to the queue. """
+                 sort_orders=False, unique_orders=False,
+                 priority_class=VISIBLE):
+        """Create a new queue of work orders, processed by the worker
+        threads shared by the whole process.
+
+        Optional <name> will be added to the thread names while they
+        process its orders. <process_order> will be called to process each
+        work order. At most <max_threads> orders will be processed at the
+        same time, or any number if it is None. <priority_class> is one of
+        PRIORITY_CLASSES, and decides which queue is served first when
+        orders from several queues are waiting.
+        If <sort_orders> is True, orders are processed smallest first,
+        otherwise in the order they were added. If <unique_orders> is True,
+        duplicate orders will not be added to the queue.
+
+        The key of an order, used to detect duplicates and by
+        cancel_order() and reprioritize_order(), is its first item for
+        tuples and lists, or the order itself. """
         self._name = name
         self._process_order = process_order
         self._max_threads = max_threads
         self._sort_orders = sort_orders
         self._unique_orders = unique_orders
+        self._priority_class = priority_class
         self._stop = False
-        self._threads = []
-        # Queue of orders waiting for processing.
-        self._orders_queue = []
+        # Number of orders being processed.
+        self._running = 0
+        # Heap of orders waiting for processing, as [priority, sequence
+        # number, key, order] entries. Cancelled entries are left in the
+        # heap with their order set to _CANCELLED, and skipped when popped.
+        self._orders_heap = []
+        # Map order key > list of its entries in the heap.
+        self._queued_orders = {}
+        # Number of orders waiting for processing.
+        self._orders_count = 0
+        self._sequence = itertools.count()
         if self._unique_orders:
             # Track orders.
             self._orders_set = set()
-        self._condition = threading.Condition()
+        self._condition = _scheduler._condition
 
     def __enter__(self):
         return self._condition.__enter__()
@@ -38,41 +211,67 @@ class WorkerThread(object):
     def __exit__(self, exc_type, exc_value, traceback):
         return self._condition.__exit__(exc_type, exc_value, traceback)
 
-    def _start(self, nb_threads=1):
-        for n in range(nb_threads):
-            if len(self._threads) == self._max_threads:
-                break
-            thread = threading.Thread(target=self._run)
-            if self._name is not None:
-                thread.name += '-' + self._name
-            thread.setDaemon(False)
-            thread.start()
-            self._threads.append(thread)
+    def _get_free_slots(self):
+        """Return how many more orders can be processed right now."""
+        if self._stop:
+            return 0
+        if self._max_threads is None:
+            return self._orders_count
+        return max(0, min(self._orders_count,
+                          self._max_threads - self._running))
 
     def _order_uid(self, order):
         if isinstance(order, tuple) or isinstance(order, list):
             return order[0]
         return order
 
-    def _run(self):
-        order_uid = None
+    def _push_order(self, order, order_uid):
+        priority = order if self._sort_orders else 0
+        entry = [priority, next(self._sequence), order_uid, order]
+        heapq.heappush(self._orders_heap, entry)
+        self._queued_orders.setdefault(order_uid, []).append(entry)
+        self._orders_count += 1
+
+    def _pop_order(self):
         while True:
-            with self._condition:
-                if order_uid is not None:
-                    self._orders_set.remove(order_uid)
-                while not self._stop and 0 == len(self._orders_queue):
-                    self._condition.wait()
-                if self._stop:
-                    return
-                order = self._orders_queue.pop(0)
-                if self._unique_orders:
-                    order_uid = self._order_uid(order)
-            try:
-                self._process_order(order)
-            except Exception as e:
-                log.error(_('! Worker thread processing %(function)r failed: %(error)s'),
-                          { 'function' : self._process_order, 'error' : e })
-                log.debug('Traceback:\n%s', traceback.format_exc())
+            priority, sequence, order_uid, order = heapq.heappop(self._orders_heap)
+            if order is _CANCELLED:
+                continue
+            entries = self._queued_orders[order_uid]
+            if 1 == len(entries):
+                del self._queued_orders[order_uid]
+            else:
+                entries.remove([priority, sequence, order_uid, order])
+            self._orders_count -= 1
+            self._running += 1
+            return order
+
+    def _cancel_queued(self, order_uid):
+        entries = self._queued_orders.pop(order_uid, ())
+        for entry in entries:
+            entry[-1] = _CANCELLED
+        self._orders_count -= len(entries)
+        return len(entries)
+
+    def _run_order(self, order):
+        try:
+            self._process_order(order)
+        except Exception as e:
+            log.error(_('! Worker thread processing %(function)r failed: %(error)s'),
+                      { 'function' : self._process_order, 'error' : e })
+            log.debug('Traceback:\n%s', traceback.format_exc())
+
+    def _order_done(self, order):
+        self._running -= 1
+        if self._unique_orders:
+            self._orders_set.discard(self._order_uid(order))
+
+    def set_max_threads(self, max_threads):
+        """Change the maximum number of orders processed at the same time."""
+        with self._condition:
+            self._max_threads = max_threads
+            if self._orders_count > 0:
+                _scheduler.register(self)
 
     def must_stop(self):
         """Return true if we've been asked to stop processing.
@@ -81,66 +280,91 @@ class WorkerThread(object):
         """
         return self._stop
 
+    def get_queue_size(self):
+        """Return the number of orders waiting for processing."""
+        return self._orders_count
+
     def clear_orders(self):
         """Clear the current orders queue."""
         with self._condition:
             if self._unique_orders:
                 # We can't just clear the set, as some orders
                 # can be in the process of being processed.
-                for order in self._orders_queue:
-                    order_uid = self._order_uid(order)
-                    self._orders_set.remove(order_uid)
-            self._orders_queue = []
+                for order_uid in self._queued_orders:
+                    self._orders_set.discard(order_uid)
+            self._orders_heap = []
+            self._queued_orders = {}
+            self._orders_count = 0
+
+    def cancel_order(self, order_uid):
+        """Remove the queued orders with key <order_uid>. Orders already
+        being processed are not interrupted. Return True if an order was
+        removed."""
+        with self._condition:
+            if 0 == self._cancel_queued(order_uid):
+                return False
+            if self._unique_orders:
+                self._orders_set.discard(order_uid)
+            return True
+
+    def reprioritize_order(self, order_uid, order):
+        """Replace the queued order with key <order_uid> by <order>, which is
+        then processed according to its own priority. Return False, without
+        adding <order>, if no order with that key is waiting."""
+        with self._condition:
+            if 0 == self._cancel_queued(order_uid):
+                return False
+            new_uid = self._order_uid(order)
+            if self._unique_orders and new_uid != order_uid:
+                self._orders_set.discard(order_uid)
+                if new_uid in self._orders_set:
+                    # Duplicate order.
+                    return True
+                self._orders_set.add(new_uid)
+            self._push_order(order, new_uid)
+            return True
 
     def append_order(self, order):
         """Append work order to the thread orders queue."""
         with self._condition:
+            order_uid = self._order_uid(order)
             if self._unique_orders:
-                order_uid = self._order_uid(order)
                 if order_uid in self._orders_set:
                     # Duplicate order.
                     return
                 self._orders_set.add(order_uid)
-            self._orders_queue.append(order)
-            if self._sort_orders:
-                self._orders_queue.sort()
-            self._condition.notifyAll()
-            self._start()
+            self._push_order(order, order_uid)
+            _scheduler.register(self)
 
     def extend_orders(self, orders_list):
         """Append work orders to the thread orders queue."""
         with self._condition:
-            if self._unique_orders:
-                nb_added = 0
-                for order in orders_list:
-                    order_uid = self._order_uid(order)
+            nb_added = 0
+            for order in orders_list:
+                order_uid = self._order_uid(order)
+                if self._unique_orders:
                     if order_uid in self._orders_set:
                         # Duplicate order.
                         continue
                     self._orders_set.add(order_uid)
-                    self._orders_queue.append(order)
-                    nb_added += 1
-            else:
-                self._orders_queue.extend(orders_list)
-                nb_added = len(orders_list)
+                self._push_order(order, order_uid)
+                nb_added += 1
             if 0 == nb_added:
                 return
-            if self._sort_orders:
-                self._orders_queue.sort()
-            self._condition.notifyAll()
-            self._start(nb_threads=nb_added)
+            _scheduler.register(self)
 
     def stop(self):
-        """Stop the worker threads and flush the orders queue."""
-        self._stop = True
+        """Stop processing orders, flush the orders queue, and wait for
+        the orders being processed to finish."""
         with self._condition:
-            self._condition.notifyAll()
-        for thread in self._threads:
-            thread.join()
-        self._threads = []
-        self._stop = False
-        self._orders_queue = []
-        if self._unique_orders:
-            self._orders_set.clear()
+            self._stop = True
+            self.clear_orders()
+            if self._unique_orders:
+                self._orders_set.clear()
+            # Do not wait for ourself if called while processing an order.
+            running = 1 if _scheduler.get_current_queue() is self else 0
+            while self._running > running:
+                self._condition.wait()
+            self._stop = False
 
 # vim: expandtab:sw=4:ts=4
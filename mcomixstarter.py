@@ -19,4 +19,7 @@
 # -------------------------------------------------------------------------
 
 import mcomix.run
-mcomix.run.run()
+
+# Guard needed by the image decoding processes, which re-import this script.
+if __name__ == '__main__':
+    mcomix.run.run()
@@ -37,11 +37,20 @@ import shutil
 import tempfile
 import unittest
 
+from mcomix import constants
 from mcomix.preferences import prefs
 
 default_prefs = {}
 default_prefs.update(prefs)
 
+# Paths computed by mcomix.constants on import, which do not follow the
+# environment changes: moved into the test storage directories instead.
+storage_paths = {
+    'ARCHIVE_TOC_CACHE_PATH': 'cache',
+    'THUMBNAIL_INDEX_PATH': 'cache',
+    'LIBRARY_COVER_STORE_PATH': 'data',
+}
+
 class MComixTest(unittest.TestCase):
 
     def setUp(self):
@@ -59,11 +68,19 @@ class MComixTest(unittest.TestCase):
         os.environ['HOME'] = home_dir
         os.environ['XDG_DATA_HOME'] = os.path.join(home_dir, 'data')
         os.environ['XDG_CONFIG_HOME'] = os.path.join(home_dir, 'config')
+        os.environ['XDG_CACHE_HOME'] = os.path.join(home_dir, 'cache')
+        self._storage_paths = {}
+        for name, directory in storage_paths.items():
+            path = getattr(constants, name)
+            self._storage_paths[name] = path
+            setattr(constants, name, os.path.join(home_dir, directory,
+                                                  os.path.basename(path)))
         # Create and setup temporary directory.
         temp_dir = os.path.join(self.tmp_dir, 'tmp')
         os.mkdir(temp_dir)
         os.environ['TMPDIR'] = os.environ['TEMP'] = os.environ['TMP'] = temp_dir
         # Make sure tempfile module uses the correct directory.
+        self._tempdir = tempfile.tempdir
         tempfile.tempdir = temp_dir
         # Reset preferences to default.
         prefs.clear()
@@ -74,18 +91,23 @@ class MComixTest(unittest.TestCase):
             self.__module__.split('.')[-1],
             self.__class__.__name__,
             self._testMethodName))
+        tempfile.tempdir = self._tempdir
+        for name, path in self._storage_paths.items():
+            setattr(constants, name, path)
         failed = False
-        if hasattr(self._resultForDoCleanups, '_excinfo'):
+        # Only set by older versions of unittest.
+        result = getattr(self, '_resultForDoCleanups', None)
+        if hasattr(result, '_excinfo'):
             # When running under py.test2
-            exclist = self._resultForDoCleanups._excinfo
+            exclist = result._excinfo
             if exclist is not None:
                 for exc in exclist:
                     if 'XFailed' != exc.typename:
                         failed = True
                         break
-        if hasattr(self._resultForDoCleanups, 'failures'):
+        if hasattr(result, 'failures'):
             # When running under nosetest2
-            for failure, traceback in self._resultForDoCleanups.failures:
+            for failure, traceback in result.failures:
                 if failure.id() == self.id():
                     failed = True
                     break
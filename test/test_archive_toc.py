@@ -0,0 +1,53 @@
+
+import os
+
+from . import MComixTest
+
+from mcomix import archive_toc
+
+
+class FakeArchive(object):
+
+    support_concurrent_extractions = True
+    support_memory_extraction = False
+    support_batch_extraction = False
+
+    def is_solid(self):
+        return True
+
+    def get_listing_state(self):
+        return {'names': [['1.jpg', '1.jpg', False]]}
+
+
+class ArchiveTocTest(MComixTest):
+
+    def setUp(self):
+        super(ArchiveTocTest, self).setUp()
+        self.archive_path = os.path.join(self.tmp_dir, 'book.cbz')
+        with open(self.archive_path, 'wb') as fp:
+            fp.write(b'PK')
+
+    def test_save_and_load(self):
+        toc = archive_toc.create(FakeArchive(), ['1.jpg', '2.jpg'])
+        archive_toc.save(self.archive_path, 'handler', toc)
+        loaded = archive_toc.load(self.archive_path, 'handler')
+        self.assertEqual(loaded['files'], ['1.jpg', '2.jpg'])
+        self.assertTrue(loaded['solid'])
+        self.assertTrue(loaded['concurrent'])
+        self.assertFalse(loaded['memory'])
+        self.assertFalse(loaded['batch'])
+        self.assertEqual(loaded['state'], {'names': [['1.jpg', '1.jpg', False]]})
+
+    def test_other_handler(self):
+        toc = archive_toc.create(FakeArchive(), ['1.jpg'])
+        archive_toc.save(self.archive_path, 'handler', toc)
+        self.assertIsNone(archive_toc.load(self.archive_path, 'other handler'))
+
+    def test_modified_archive(self):
+        toc = archive_toc.create(FakeArchive(), ['1.jpg'])
+        archive_toc.save(self.archive_path, 'handler', toc)
+        with open(self.archive_path, 'ab') as fp:
+            fp.write(b'\x03\x04')
+        self.assertIsNone(archive_toc.load(self.archive_path, 'handler'))
+
+# vim: expandtab:sw=4:ts=4
@@ -1,5 +1,6 @@
 
 import os
+import shutil
 
 from . import MComixTest, get_testfile_path
 
@@ -54,3 +55,13 @@ class ArchiveToolsTest(MComixTest):
            )
            self.assertEqual(archive_type, expected_type, msg=msg)
 
+    def test_archive_mime_type_cache(self):
+
+       path = os.path.join(self.tmp_dir, 'archive')
+       shutil.copyfile(get_testfile_path('archives', 'Flat.zip'), path)
+       self.assertEqual(archive_tools.archive_mime_type(path), constants.ZIP)
+       # Replacing the file must not return the cached type.
+       shutil.copyfile(get_testfile_path('archives', 'SolidFlat.tar'), path)
+       stat = os.stat(path)
+       os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+       self.assertEqual(archive_tools.archive_mime_type(path), constants.TAR)
@@ -1,6 +1,7 @@
 # coding: utf-8
 
 import hashlib
+import json
 import locale
 import os
 import re
@@ -8,6 +9,7 @@ import shutil
 import sys
 import tempfile
 import unittest
+import zipfile
 
 from . import MComixTest, get_testfile_path
 
@@ -233,6 +235,49 @@ class ArchiveFormatTest(object):
             original_md5 = md5(get_testfile_path(self.archive_contents[name]))
             self.assertEqual((name, extracted_md5), (name, original_md5))
 
+    def test_read(self):
+        self.archive = self.handler(self.archive_path)
+        contents = self.archive.list_contents()
+        if not self.archive.support_memory_extraction:
+            raise unittest.SkipTest('memory extraction not supported')
+        for name in reversed(contents):
+            original = open(get_testfile_path(self.archive_contents[name]), 'rb').read()
+            data = self.archive.read(name)
+            self.assertEqual((name, hashlib.md5(data).hexdigest()),
+                             (name, hashlib.md5(original).hexdigest()))
+            if len(original) > 0:
+                self.assertIsNone(self.archive.read(name, max_size=len(original) - 1))
+            self.assertEqual(self.archive.read(name, max_size=len(original)), original)
+
+    def test_listing_state(self):
+        archive = self.handler(self.archive_path)
+        contents = archive.list_contents()
+        # Round trip through JSON, as when stored in a table of contents.
+        state = json.loads(json.dumps(archive.get_listing_state()))
+        archive.close()
+        if state is None:
+            raise unittest.SkipTest('listing state not supported')
+        self.archive = self.handler(self.archive_path)
+        self.assertTrue(self.archive.set_listing_state(state, contents))
+        self.assertEqual(self.archive.is_solid(), self.solid)
+        for name in reversed(contents):
+            self.archive.extract(name, self.dest_dir)
+            path = os.path.join(self.dest_dir, name)
+            self.assertEqual(md5(path), md5(get_testfile_path(self.archive_contents[name])))
+
+    def test_iter_read(self):
+        self.archive = self.handler(self.archive_path)
+        contents = self.archive.list_contents()
+        if not self.archive.support_memory_extraction:
+            raise unittest.SkipTest('memory extraction not supported')
+        read = []
+        for name, data in self.archive.iter_read(reversed(contents)):
+            read.append(name)
+            original = open(get_testfile_path(self.archive_contents[name]), 'rb').read()
+            self.assertEqual((name, hashlib.md5(data).hexdigest()),
+                             (name, hashlib.md5(original).hexdigest()))
+        self.assertCountEqual(read, contents)
+
     def test_iter_extract(self):
         self.archive = self.handler(self.archive_path)
         contents = self.archive.list_contents()
@@ -487,6 +532,32 @@ class RecursiveArchiveFormat7zExternalTarXzTest(RecursiveArchiveFormatTest, MCom
         ('meh.png' , os.path.join('archive.tar', 'meh.png' ), 'images/03-PNG-RGB.png'    ),
     )
 
+class ZipCorruptStoredTest(MComixTest):
+
+    def setUp(self):
+        super(ZipCorruptStoredTest, self).setUp()
+        self.archive_path = os.path.join(self.tmp_dir, 'corrupt.cbz')
+        with zipfile.ZipFile(self.archive_path, 'w') as archive:
+            archive.writestr('page.jpg', b'page data' * 100)
+        with open(self.archive_path, 'r+b') as fp:
+            data = fp.read()
+            fp.seek(data.index(b'page data'))
+            fp.write(b'P')
+        self.archive = zip.ZipArchive(self.archive_path)
+
+    def tearDown(self):
+        self.archive.close()
+        super(ZipCorruptStoredTest, self).tearDown()
+
+    def test_read(self):
+        self.archive.list_contents()
+        self.assertRaises(zipfile.BadZipFile, self.archive.read, 'page.jpg')
+
+    def test_extract(self):
+        self.archive.list_contents()
+        self.assertRaises(zipfile.BadZipFile, self.archive.extract,
+                          'page.jpg', self.tmp_dir)
+
 xfail_list = [
     # No password support when using some external tools.
     ('ZipExternalEncrypted'             , 'test_extract'      ),
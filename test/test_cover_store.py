@@ -0,0 +1,43 @@
+import os
+
+from . import MComixTest
+
+from mcomix import cover_store
+
+
+class CoverStoreTest(MComixTest):
+
+    def setUp(self):
+        super(CoverStoreTest, self).setUp()
+        self.book_path = os.path.join(self.tmp_dir, 'book.cbz')
+        with open(self.book_path, 'wb') as fp:
+            fp.write(b'PK')
+
+    def tearDown(self):
+        cover_store.close()
+        super(CoverStoreTest, self).tearDown()
+
+    def test_save_and_load(self):
+        self.assertIsNone(cover_store.load(self.book_path))
+        cover_store.save(self.book_path, '1234', 350, 500, b'PNG data')
+        self.assertEqual(cover_store.load(self.book_path),
+                         (1234, 350, 500, b'PNG data'))
+        # Survives reopening.
+        cover_store.close()
+        self.assertEqual(cover_store.load(self.book_path),
+                         (1234, 350, 500, b'PNG data'))
+
+    def test_remove(self):
+        cover_store.save(self.book_path, 1234, 350, 500, b'PNG data')
+        cover_store.remove(self.book_path)
+        self.assertIsNone(cover_store.load(self.book_path))
+
+    def test_compact(self):
+        missing_path = os.path.join(self.tmp_dir, 'missing.cbz')
+        cover_store.save(self.book_path, 1234, 350, 500, b'PNG data')
+        cover_store.save(missing_path, 1234, 350, 500, b'PNG data')
+        self.assertEqual(cover_store.compact(), 1)
+        self.assertIsNone(cover_store.load(missing_path))
+        self.assertIsNotNone(cover_store.load(self.book_path))
+
+# vim: expandtab:sw=4:ts=4
@@ -8,12 +8,13 @@ import tempfile
 from gi.repository import GdkPixbuf, GObject
 
 from collections import namedtuple
-from PIL import Image, ImageDraw
+from PIL import Image, ImageDraw, ImageEnhance, ImageOps
 from io import StringIO
 from difflib import unified_diff
 
 from . import MComixTest, get_testfile_path
 
+from mcomix import decode_pool
 from mcomix import image_tools
 from mcomix.preferences import prefs
 
@@ -249,6 +250,28 @@ class ImageToolsTest(object):
             )
             self.assertImagesEqual(pixbuf, expected_im, msg=msg)
 
+    def test_load_pixbuf_decode_pool(self):
+        orig_decode_pool = prefs['decode in worker processes']
+        try:
+            for image in _TEST_IMAGES:
+                image_path = get_image_path(image.name)
+                prefs['decode in worker processes'] = False
+                expected = image_tools._load_pil_pixbuf(image_path)
+                prefs['decode in worker processes'] = True
+                pixbuf = image_tools._load_pil_pixbuf(image_path)
+                msg = (
+                    'decoding "%s" in a worker process failed; '
+                    'result %%(diff_type)s differs: %%(diff)s'
+                    % (image.name,)
+                )
+                self.assertImagesEqual(pixbuf, image_tools.pixbuf_to_pil(expected), msg=msg)
+                pixbuf = image_tools._load_pil_pixbuf(image_path, (16, 16))
+                self.assertLessEqual(pixbuf.get_width(), 16)
+                self.assertLessEqual(pixbuf.get_height(), 16)
+        finally:
+            prefs['decode in worker processes'] = orig_decode_pool
+            decode_pool.shutdown()
+
     def test_load_pixbuf_invalid(self):
         if self.use_pil:
             exception = IOError
@@ -323,6 +346,20 @@ class ImageToolsTest(object):
             self.assertEqual((result.get_width(), result.get_height()),
                              (image.size[0] / 2, image.size[1] / 2))
 
+    def test_load_pixbuf_size_thumb(self):
+        # JPEG and GIF thumbnails are decoded with PIL, at a reduced size.
+        for name in (
+            'pattern.jpg',
+            'animated.gif',
+        ):
+            image_path = get_image_path(name)
+            size = Image.open(image_path).size
+            target_size = size[0], size[1] // 2
+            result = image_tools.load_pixbuf_size(image_path, *target_size,
+                                                  is_thumb=True)
+            self.assertEqual((result.get_width(), result.get_height()),
+                             (size[0] // 2, size[1] // 2))
+
     def test_load_pixbuf_size_invalid(self):
         if self.use_pil:
             exception = IOError
@@ -553,6 +590,55 @@ class ImageToolsTest(object):
                 )
                 self.assertImagesEqual(result, input, msg=msg)
 
+    def test_get_most_common_colour(self):
+        # 140 pixels of a dirty red group, with one dominating shade,
+        # against 60 pixels of a single blue.
+        left = Image.new('RGB', (2, 50), (201, 10, 10))
+        left.paste((199, 11, 9), (0, 0, 2, 10))
+        right = Image.new('RGB', (2, 50), (0, 0, 255))
+        right.paste((201, 10, 10), (0, 0, 2, 10))
+        right.paste((198, 12, 11), (0, 10, 2, 20))
+        colour = image_tools.get_most_common_colour((left, right))
+        self.assertEqual(colour, [201 * 257, 10 * 257, 10 * 257])
+
+    def test_get_enhance_lut(self):
+        # One lookup table gives the same result as the successive passes.
+        im = Image.open(get_image_path('pattern-opaque-rgb.png')).convert('RGB')
+        for brightness, contrast, autocontrast in (
+            (1.3, 1.0, False), (0.5, 1.7, False),
+            (1.3, 0.3, False), (0.8, 1.0, True),
+        ):
+            expected = ImageEnhance.Brightness(im).enhance(brightness)
+            if autocontrast:
+                expected = ImageOps.autocontrast(expected, cutoff=0.1)
+            else:
+                expected = ImageEnhance.Contrast(expected).enhance(contrast)
+            lut = image_tools.get_enhance_lut(im, brightness, contrast, autocontrast)
+            self.assertEqual(im.point(lut).tobytes(), expected.tobytes())
+
+    def test_fit_in_rectangle_no_transform(self):
+        # Nothing to do: the input is returned as is, without copies.
+        input = image_tools.load_pixbuf(get_image_path('pattern-opaque-rgb.png'))
+        width, height = input.get_width(), input.get_height()
+        prefs['color management enabled'] = False
+        result = image_tools.fit_in_rectangle(input, width, height)
+        self.assertIs(result, input)
+
+    def test_fit_in_rectangle_transparent_pil_filter(self):
+        # Resizing with a PIL filter composites in PIL too.
+        image = 'pattern-transparent-rgba.png'
+        control = Image.open(get_image_path(image))
+        width, height = control.size[0] // 2, control.size[1] // 2
+        prefs['checkered bg for transparent images'] = False
+        expected = Image.alpha_composite(
+            Image.new('RGBA', (width, height), color='white'),
+            control.resize((width, height), resample=Image.NEAREST)
+        )
+        result = image_tools.fit_in_rectangle(image_tools.pil_to_pixbuf(control),
+                                              width, height,
+                                              pil_filter=Image.NEAREST)
+        self.assertImagesEqual(result, expected)
+
     def test_fit_in_rectangle_transparent_no_resize(self):
         # And with a transparent test image, check alpha blending.
         image = 'pattern-transparent-rgba.png'
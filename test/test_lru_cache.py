@@ -0,0 +1,54 @@
+import unittest
+
+from mcomix.lru_cache import LRUCache
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_least_recently_used_is_evicted(self):
+        cache = LRUCache(max_size=6)
+        cache.put(1, 'aa')
+        cache.put(2, 'bb')
+        cache.put(3, 'cc')
+        cache.get(1)
+        cache.put(4, 'dd')
+        self.assertListEqual(cache.keys(), [3, 1, 4])
+        self.assertEqual(cache.get_size(), 6)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_protected_keys_are_kept(self):
+        cache = LRUCache(max_size=4)
+        cache.put(1, 'aa')
+        cache.put(2, 'bb')
+        cache.protect([1, 2])
+        cache.put(3, 'cc')
+        self.assertListEqual(cache.keys(), [1, 2])
+        cache.protect([2])
+        cache.put(3, 'cc')
+        self.assertListEqual(cache.keys(), [2, 3])
+
+    def test_counters(self):
+        cache = LRUCache()
+        cache.put('a', 'x')
+        self.assertEqual(cache.get('a'), 'x')
+        self.assertIsNone(cache.get('b'))
+        stats = cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_peek_is_not_an_access(self):
+        cache = LRUCache()
+        cache.put('a', 'x')
+        cache.put('b', 'y')
+        self.assertEqual(cache.peek('a'), 'x')
+        self.assertIsNone(cache.peek('c'))
+        self.assertListEqual(cache.keys(), ['a', 'b'])
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+    def test_shrinking_budget_evicts(self):
+        cache = LRUCache(max_size=10)
+        for n in range(5):
+            cache.put(n, 'xx')
+        cache.set_max_size(4)
+        self.assertListEqual(cache.keys(), [3, 4])
+        self.assertTrue(cache.is_full())
+
+# vim: expandtab:sw=4:ts=4
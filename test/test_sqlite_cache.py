@@ -0,0 +1,51 @@
+import os
+
+from . import MComixTest
+
+from mcomix import sqlite_cache
+
+
+class SQLiteCacheTest(MComixTest):
+
+    def setUp(self):
+        super(SQLiteCacheTest, self).setUp()
+        self.path = os.path.join(self.tmp_dir, 'cache', 'test.db')
+
+    def _open(self, version):
+        return sqlite_cache.SQLiteCache(
+            'test cache', lambda: self.path, 'Test',
+            'create table Test (key text primary key)', version)
+
+    def test_reopen(self):
+        cache = self._open(1)
+        with cache.connection() as connection:
+            with connection:
+                connection.execute("insert into Test values ('key')")
+        cache.close()
+        with cache.connection() as connection:
+            self.assertEqual(connection.execute('select key from Test').fetchall(),
+                             [('key',)])
+        cache.close()
+
+    def test_version_change(self):
+        cache = self._open(1)
+        with cache.connection() as connection:
+            with connection:
+                connection.execute("insert into Test values ('key')")
+        cache.close()
+        cache = self._open(2)
+        with cache.connection() as connection:
+            self.assertEqual(connection.execute('select key from Test').fetchall(), [])
+        cache.close()
+
+    def test_moved(self):
+        cache = self._open(1)
+        with cache.connection() as connection:
+            with connection:
+                connection.execute("insert into Test values ('key')")
+        self.path = os.path.join(self.tmp_dir, 'other.db')
+        with cache.connection() as connection:
+            self.assertEqual(connection.execute('select key from Test').fetchall(), [])
+        cache.close()
+
+# vim: expandtab:sw=4:ts=4
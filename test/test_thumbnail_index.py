@@ -0,0 +1,44 @@
+import os
+
+from . import MComixTest
+
+from mcomix import thumbnail_index
+
+
+class ThumbnailIndexTest(MComixTest):
+
+    def setUp(self):
+        super(ThumbnailIndexTest, self).setUp()
+        self.thumbpath = os.path.join(self.tmp_dir, 'thumb.png')
+        with open(self.thumbpath, 'wb') as fp:
+            fp.write(b'PNG')
+
+    def tearDown(self):
+        thumbnail_index.close()
+        super(ThumbnailIndexTest, self).tearDown()
+
+    def test_record_and_lookup(self):
+        self.assertIsNone(thumbnail_index.lookup(self.thumbpath))
+        thumbnail_index.record(self.thumbpath, '1234', 128, 96)
+        self.assertEqual(thumbnail_index.lookup(self.thumbpath), (1234, 128, 96))
+        # Survives reopening.
+        thumbnail_index.close()
+        self.assertEqual(thumbnail_index.lookup(self.thumbpath), (1234, 128, 96))
+
+    def test_thumbnail_replaced(self):
+        thumbnail_index.record(self.thumbpath, 1234, 128, 96)
+        with open(self.thumbpath, 'wb') as fp:
+            fp.write(b'Another PNG')
+        self.assertIsNone(thumbnail_index.lookup(self.thumbpath))
+
+    def test_thumbnail_removed(self):
+        thumbnail_index.record(self.thumbpath, 1234, 128, 96)
+        os.unlink(self.thumbpath)
+        self.assertIsNone(thumbnail_index.lookup(self.thumbpath))
+
+    def test_forget(self):
+        thumbnail_index.record(self.thumbpath, 1234, 128, 96)
+        thumbnail_index.forget(self.thumbpath)
+        self.assertIsNone(thumbnail_index.lookup(self.thumbpath))
+
+# vim: expandtab:sw=4:ts=4
@@ -0,0 +1,39 @@
+import os
+from unittest import mock
+
+from . import MComixTest
+
+from mcomix import archive_tools
+from mcomix import constants
+from mcomix import thumbnail_tools
+
+
+class ThumbnailerTest(MComixTest):
+
+    def setUp(self):
+        super(ThumbnailerTest, self).setUp()
+        self.archive_path = os.path.join(self.tmp_dir, 'book.cbz')
+        with open(self.archive_path, 'wb') as fp:
+            fp.write(b'PK')
+        self.thumbnailer = thumbnail_tools.Thumbnailer(
+            dst_dir=self.tmp_dir, store_on_disk=False, size=(128, 128),
+            archive_support=True)
+
+    def test_archive_without_handler(self):
+        with mock.patch.object(archive_tools, 'get_archive_handler',
+                               return_value=None):
+            self.assertIsNone(self.thumbnailer._create_archive_thumbnail_pixbuf(
+                self.archive_path, constants.ZIP))
+
+    def test_archive_without_handler_falls_back(self):
+        with mock.patch.object(archive_tools, 'archive_mime_type',
+                               return_value=constants.ZIP), \
+             mock.patch.object(archive_tools, 'get_archive_handler',
+                               return_value=None), \
+             mock.patch.object(archive_tools, 'get_recursive_archive_handler',
+                               return_value=None) as get_recursive_handler:
+            self.assertEqual(self.thumbnailer._create_thumbnail_pixbuf(
+                self.archive_path), (None, None))
+        self.assertTrue(get_recursive_handler.called)
+
+# vim: expandtab:sw=4:ts=4
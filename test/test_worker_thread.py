@@ -0,0 +1,112 @@
+
+import threading
+import unittest
+
+from mcomix import worker_thread
+from mcomix.preferences import prefs
+from mcomix.worker_thread import WorkerThread
+
+
+class WorkerThreadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.processed = []
+        self.started = threading.Event()
+        self.blocker = threading.Event()
+
+    def _process_order(self, order):
+        self.started.set()
+        self.blocker.wait()
+        self.processed.append(order)
+
+    def _run(self, thread, orders, blocking_order):
+        # Queue a first order and keep the only thread busy with it,
+        # so the others are all queued before any is processed.
+        thread.append_order(blocking_order)
+        self.started.wait()
+        thread.extend_orders(orders)
+
+    def _finish(self, thread):
+        self.blocker.set()
+        while True:
+            with thread:
+                if 0 == thread.get_queue_size():
+                    break
+            threading.Event().wait(0.01)
+        thread.stop()
+
+    def test_fifo(self):
+        thread = WorkerThread(self._process_order)
+        self._run(thread, [5, 3, 4, 1], 0)
+        self._finish(thread)
+        self.assertEqual(self.processed, [0, 5, 3, 4, 1])
+
+    def test_sorted(self):
+        thread = WorkerThread(self._process_order, sort_orders=True)
+        self._run(thread, [(5, 'e'), (3, 'c'), (4, 'd'), (1, 'a')], (9, 'z'))
+        self._finish(thread)
+        self.assertEqual([order[1] for order in self.processed],
+                         ['z', 'a', 'c', 'd', 'e'])
+
+    def test_unique(self):
+        thread = WorkerThread(self._process_order, unique_orders=True)
+        self._run(thread, [1, 2, 1, 0, 2], 0)
+        self._finish(thread)
+        self.assertEqual(self.processed, [0, 1, 2])
+
+    def test_cancel(self):
+        thread = WorkerThread(self._process_order, sort_orders=True,
+                              unique_orders=True)
+        self._run(thread, [(1, 'a'), (2, 'b'), (3, 'c')], (0, 'z'))
+        self.assertTrue(thread.cancel_order(2))
+        self.assertFalse(thread.cancel_order(2))
+        self.assertEqual(thread.get_queue_size(), 2)
+        # Cancelled orders can be queued again.
+        thread.append_order((2, 'B'))
+        self._finish(thread)
+        self.assertEqual([order[1] for order in self.processed],
+                         ['z', 'a', 'B', 'c'])
+
+    def test_reprioritize(self):
+        thread = WorkerThread(self._process_order, sort_orders=True)
+        self._run(thread, [(2, 'b'), (3, 'c'), (4, 'd')], (0, 'z'))
+        self.assertTrue(thread.reprioritize_order(4, (1, 'd')))
+        self.assertFalse(thread.reprioritize_order(4, (5, 'd')))
+        self.assertEqual(thread.get_queue_size(), 3)
+        self._finish(thread)
+        self.assertEqual([order[1] for order in self.processed],
+                         ['z', 'd', 'b', 'c'])
+
+    def test_clear(self):
+        thread = WorkerThread(self._process_order, unique_orders=True)
+        self._run(thread, [1, 2, 3], 0)
+        thread.clear_orders()
+        thread.extend_orders([3, 4])
+        self._finish(thread)
+        self.assertEqual(self.processed, [0, 3, 4])
+
+    def test_priority_classes(self):
+        max_threads = prefs['max worker threads']
+        prefs['max worker threads'] = 2
+        try:
+            visible = WorkerThread(self._process_order,
+                                   priority_class=worker_thread.VISIBLE)
+            thumbnails = WorkerThread(self._process_order,
+                                      priority_class=worker_thread.THUMBNAILS)
+            self._run(visible, [], 'page')
+            # The last free thread is reserved to visible pages.
+            thumbnails.append_order('thumbnail')
+            depths = worker_thread.get_queue_depths()
+            self.assertEqual(depths[worker_thread.THUMBNAILS], 1)
+            self.assertEqual(depths[worker_thread.VISIBLE], 0)
+            done = worker_thread.submit(worker_thread.VISIBLE,
+                                        self.processed.append, 'task')
+            self.assertTrue(done.wait(10))
+            self.assertEqual(self.processed, ['task'])
+            self._finish(visible)
+            self._finish(thumbnails)
+            self.assertEqual(self.processed, ['task', 'page', 'thumbnail'])
+        finally:
+            prefs['max worker threads'] = max_threads
+
+# vim: expandtab:sw=4:ts=4